@@ -5,9 +5,24 @@ import os.path
 import re
 import subprocess
 import time
-from .lib import util, thread, settings, output, panels
-
-STATUS_COMMAND = 'git status --porcelain -u all'
+from .lib import startup, util, thread, settings, output, stalls, ssh, recorder
+
+panels = startup.lazy('panels')
+pipeline = startup.lazy('pipeline')
+logstore = startup.lazy('logstore')
+blame = startup.lazy('blame')
+worktree = startup.lazy('worktree')
+checks = startup.lazy('checks')
+review = startup.lazy('review')
+runner = startup.lazy('runner')
+status = startup.lazy('status')
+stash = startup.lazy('stash')
+sizes = startup.lazy('sizes')
+sparse = startup.lazy('sparse')
+patch = startup.lazy('patch')
+history = startup.lazy('history')
+
+STATUS_COMMAND = 'git status --porcelain'
 STATUS_UNTRACKED = r'(^|\n)\?\?'
 STATUS_ADDED = r'^A[ MD]'
 STATUS_STAGED = r'^M[ MD]'
@@ -15,6 +30,10 @@ STATUS_UNSTAGED = r'^[ MARC]M'
 STATUS_DELETED = r'^D[ M]'
 STATUS_TRACKED = r'^[^\?][^\?]'
 STATUS_PARSE = r'^.. "?([^"\n]*)'
+STATUS_CHANGES_COMMAND = 'git status --porcelain -z'
+
+NUMSTAT_COMMAND = 'git diff HEAD --numstat -z'
+EXCLUDE_PATHSPEC = ':(top,exclude,literal)'
 
 CURRENT_BRANCH_COMMAND = 'git rev-parse --abbrev-ref HEAD'
 
@@ -23,6 +42,26 @@ LOG_PARSE = r'^(\S*) - <([^>]*)> {([^}]*)} (.*)'
 
 LOG_FULL = 'git show --name-only'
 
+STASH_PANEL = 'arcinator-stash'
+
+
+def plugin_loaded():
+    """Warms the caches of the open repositories"""
+    stalls.set_main_thread()
+    recorder.reset_replay()
+    startup.start()
+
+
+def plugin_unloaded():
+    """Releases resources held by the plugin"""
+    ssh.close_all()
+    if startup.is_loaded(logstore):
+        logstore.close_all()
+    if startup.is_loaded(runner):
+        runner.stop()
+    if startup.is_loaded(status):
+        status.stop_all()
+
 
 class ArcinatorCommand(sublime_plugin.WindowCommand):
     """Base command for arcinator commands"""
@@ -34,13 +73,25 @@ class ArcinatorCommand(sublime_plugin.WindowCommand):
         self.command_name = 'Arcinator Command'
         self.tests = {}
 
+    def run_(self, *args, **kwargs):
+        """Runs the command for Sublime Text, recording it if it stalls the main thread"""
+        with stalls.watch('Run', type(self).__name__):
+            return super().run_(*args, **kwargs)
+
+    def is_enabled_(self, *args, **kwargs):
+        """Checks if the command is enabled for Sublime Text, recording it if it stalls the main thread"""
+        with stalls.watch('Is enabled', type(self).__name__):
+            return super().is_enabled_(*args, **kwargs)
+
     def nothing(self, nothing1=None, nothing2=None, nothing3=None, **args):
         """Does nothing, just a placeholder for things I don't handle"""
         return
 
-    def run_command(self, cmd, files=None, log=True, async=True, on_complete=None):
+    def run_command(self, cmd, files=None, log=True, background=True, on_complete=None):
         """Starts a process for a native command"""
-        return thread.Process(self.command_name, cmd, files, log, async, on_complete)
+        if background and settings.get('processRunner', 'thread') == 'asyncio' and runner.enabled():
+            return runner.Job(self.command_name, cmd, files, log, on_complete, window=self.window)
+        return thread.Process(self.command_name, cmd, files, log, background, on_complete, window=self.window)
 
     def run_external(self, cmd, files):
         """Starts a process for an external command that should run without """
@@ -56,15 +107,23 @@ class ArcinatorCommand(sublime_plugin.WindowCommand):
         """Tests output to verify if a file is tracked"""
         return len(result) > 0
 
+    def get_status(self, files):
+        """Gets the porcelain status of files, from the watched status snapshot when it can be used"""
+        root = util.get_root(files[0] if len(files) > 0 else None)
+        if root is not None:
+            status.check_fast_status(root)
+        result = status.query(files, root)
+        if result is None:
+            result = self.run_command(STATUS_COMMAND + ' ' + status.UNTRACKED_FOLDERS, files, False, False).output()
+        return result
+
     def is_tracked(self, files):
         """Runs a command to verify if a file is tracked"""
-        status = self.run_command(STATUS_COMMAND, files, False, False)
-        return self.test_tracked(status.output())
+        return self.test_tracked(self.get_status(files))
 
     def is_changed(self, files):
         """Runs a status command to see if a file has been changed since last revision"""
-        status = self.run_command(STATUS_COMMAND, files, False, False)
-        return self.test_changed(status.output())
+        return self.test_changed(self.get_status(files))
 
     def is_unchanged(self, files):
         """Checks if a file is unchanged since last revision"""
@@ -89,22 +148,23 @@ class ArcinatorCommand(sublime_plugin.WindowCommand):
         return False
 
     def test_all(self, files):
-        """Gets the result of all of the tests"""
+        """Gets the result of all of the tests, skipping the status when no test needs it"""
         uid = "*".join(files)
+        needs_status = 'tracked' in self.tests or 'changed' in self.tests
         for tests in ArcinatorCommand.recent_files:
             if time.time() - tests['timestamp'] > 1:
                 ArcinatorCommand.recent_files.remove(tests)
                 continue
-            if uid == tests['uid']:
+            if uid == tests['uid'] and (tests['tracked'] is not None or not needs_status):
                 return tests
-        status = self.run_command(STATUS_COMMAND, files, False, False)
+        result = self.get_status(files) if needs_status else None
         tests = {
             'uid': uid,
             'file': self.is_file(files),
             'folder': self.is_folder(files),
             'single': self.is_single(files),
-            'tracked': self.test_tracked(status.output()),
-            'changed': self.test_changed(status.output()),
+            'tracked': self.test_tracked(result) if needs_status else None,
+            'changed': self.test_changed(result) if needs_status else None,
             'timestamp': time.time()
         }
         util.debug(tests)
@@ -115,33 +175,87 @@ class ArcinatorCommand(sublime_plugin.WindowCommand):
         """Handles completion of the MultiSelect"""
         self.files = values
 
-    def parse_changes(self, raw):
-        """Parses the output of a status command for use in a MultiSelect"""
-        matches = re.findall(STATUS_PARSE, raw, re.M)
-        if len(matches) < 1:
+    def parse_status(self, raw):
+        """Parses the output of a -z status command into (status, path) entries"""
+        return status.parse(raw)
+
+    def parse_numstat(self, raw):
+        """Parses the output of a --numstat -z diff into (insertions, deletions, binary) by path"""
+        numstat = {}
+        fields = raw.rstrip('\n').split('\0')
+        index = 0
+        while index < len(fields):
+            parts = fields[index].split('\t')
+            index += 1
+            if len(parts) != 3:
+                continue
+            added, deleted, path = parts
+            if path == '' and index + 1 < len(fields):
+                path = fields[index + 1]
+                index += 2
+            binary = added == '-'
+            numstat[path] = (0 if binary else int(added), 0 if binary else int(deleted), binary)
+        return numstat
+
+    def describe_change(self, code, path, numstat, info):
+        """Builds the MultiSelect item for a change, with its status and size"""
+        added, deleted, binary = numstat.get(path, (0, 0, False))
+        if code == '??':
+            detail = 'new file'
+        elif binary:
+            detail = 'binary'
+        else:
+            detail = '+%d -%d' % (added, deleted)
+        if sizes.skips_content(info):
+            detail = ('new file  ' if code == '??' else '') + sizes.describe(info)
+        return {
+            'label': [path, code + '  ' + detail],
+            'value': path,
+            'selected': code != '??',
+            'changed': added + deleted,
+            'size': (info['size'] or info['head_size'] or 0) if info else 0
+        }
+
+    def parse_changes(self, status, numstat=''):
+        """Parses the output of a status and a numstat diff for use in a MultiSelect"""
+        entries = self.parse_status(status)
+        if len(entries) < 1:
             sublime.status_message('No changes')
             return False
-        items = []
-        for path in matches:
-            item = {
-                'label': path,
-                'value': path,
-                'selected': self.is_tracked([path])
-            }
-            items.append(item)
+        numstat = self.parse_numstat(numstat)
+        classes = self.classes
+        items = [self.describe_change(code, path, numstat, classes.get(path)) for code, path in entries]
+        if settings.get('changeSort', 'path') == 'size':
+            items.sort(key=lambda item: (item['changed'], item['size']), reverse=True)
         self.items = items
         return True
 
-    def on_changes_available(self, process):
+    def on_numstat_available(self, process):
         """Shows the list of changes to the user"""
-        output = process.output()
-        if not self.parse_changes(output):
+        numstat = process.output() if process.returncode == 0 else ''
+        if not self.parse_changes(self.status, numstat):
             return
         panels.MultiSelect(self.items, self.on_complete_select, show_select_all=True)
 
-    def select_changes(self):
-        """Gets the committable changes"""
-        self.run_command(STATUS_COMMAND, self.files, False, False, self.on_changes_available)
+    def classify_changes(self):
+        """Sizes the changes, then gets the line counts of those that are not large, binary or LFS files"""
+        root = util.get_root(self.files[0] if self.files else None)
+        paths = [path for code, path in self.parse_status(self.status) if not path.endswith('/')]
+        self.classes = status.classify(root, paths) if root is not None else {}
+        excluded = [EXCLUDE_PATHSPEC + path for path in paths if sizes.skips_content(self.classes[path])]
+        self.run_command(NUMSTAT_COMMAND, self.files + excluded, False, False, self.on_numstat_available)
+
+    def on_changes_available(self, process):
+        """Gets the size of the changes once the status is available"""
+        self.status = process.output()
+        self.classes = {}
+        sublime.set_timeout_async(self.classify_changes, 0)
+
+    def select_changes(self, untracked=None):
+        """Gets the committable changes, listing every untracked file unless untracked is status.UNTRACKED_NONE"""
+        if untracked is None:
+            untracked = status.UNTRACKED_FILES
+        self.run_command(STATUS_CHANGES_COMMAND + ' ' + untracked, self.files, False, False, self.on_changes_available)
 
     def on_select_branch(self, index):
         """Handles completion of the MultiSelect"""
@@ -170,7 +284,11 @@ class ArcinatorCommand(sublime_plugin.WindowCommand):
         util.debug(output)
         if not self.parse_branches(output):
             return
-        sublime.active_window().show_quick_panel(self.items, self.on_select_branch, sublime.MONOSPACE_FONT)
+        items = self.items
+        root = util.get_root()
+        if review.enabled() and root is not None:
+            items = review.labels(root, self.items)
+        sublime.active_window().show_quick_panel(items, self.on_select_branch, sublime.MONOSPACE_FONT)
 
     def select_branch(self):
         """Gets the list of branches"""
@@ -178,7 +296,7 @@ class ArcinatorCommand(sublime_plugin.WindowCommand):
 
     def run(self, cmd="", paths=None, group=-1, index=-1):
         """Runs the command"""
-        if cmd is "":
+        if cmd == "":
             return
         files = util.get_files(paths, group, index)
         self.command_name = cmd.upper()
@@ -310,49 +428,49 @@ class ArcinatorSvnFetchCommand(ArcinatorCommand):
         super().__init__(window)
         self.command_name = 'SVN Fetch'
         self.tests = {}
-
-    def svn_rebase(self, process):
-        if process.returncode is not 0:
-            sublime.status_message('Dag namit!')
-            return
-        self.command_name = 'SVN Fetch - Rebase Git from SVN'
-        self.run_command('git svn rebase', [])
-
-    def svn_fetch(self, process):
-        if process.returncode is not 0:
-            sublime.status_message('Dag namit!')
-            return
-        self.command_name = 'SVN Fetch - SVN Fetch'
-        self.run_command('git svn fetch', [], on_complete=self.svn_rebase)
-
-    def pull(self, process):
-        if process.returncode is not 0:
-            sublime.status_message('Dag namit!')
-            return
-        self.command_name = 'SVN Fetch - Pull in new changes'
-        self.run_command('git pull --ff-only --no-stat', [], on_complete=self.svn_fetch)
-
-    def git_fetch(self, process=None):
-        if process is not None:
-            if process.returncode is not 0:
-                sublime.status_message('Dag namit!')
-                return
-        self.command_name = 'SVN Fetch - Git Fetch'
-        self.run_command('git fetch', [], on_complete=self.pull)
-
-    def switch_trunk(self):
-        self.command_name = 'SVN Fetch - Switch to trunk'
-        self.run_command('git checkout trunk', [], on_complete=self.git_fetch)
+        self.pipeline = None
+
+    def get_remotes(self):
+        """Gets the names of the remotes of the repository"""
+        p = self.run_command('git remote', [], False, False)
+        return [remote.strip() for remote in p.output().split('\n') if remote.strip()]
+
+    def create_pipeline(self, switch_trunk):
+        """Creates the pipeline of steps needed to fetch from SVN"""
+        steps = []
+        fetch_requires = []
+        if switch_trunk:
+            steps.append(pipeline.Step('Switch to trunk', 'git checkout trunk'))
+            fetch_requires = ['Switch to trunk']
+        fetches = []
+        for remote in self.get_remotes():
+            name = 'Git Fetch (%s)' % remote
+            steps.append(pipeline.Step(name, 'git fetch ' + remote, fetch_requires))
+            fetches.append(name)
+        steps.append(pipeline.Step('Pull in new changes', 'git pull --ff-only --no-stat', fetch_requires + fetches))
+        steps.append(pipeline.Step('SVN Fetch', 'git svn fetch', ['Pull in new changes']))
+        steps.append(pipeline.Step('Rebase Git from SVN', 'git svn rebase', ['SVN Fetch']))
+        return pipeline.Pipeline(self.command_name, steps)
 
     def run(self, paths=None, group=-1, index=-1):
         """Runs the command"""
         util.debug(self.command_name)
+        if self.pipeline is not None and self.pipeline.running:
+            sublime.status_message(self.command_name + ' is already running')
+            return
+        if self.pipeline is not None and self.pipeline.can_resume():
+            failed = self.pipeline.failed_step()
+            if sublime.ok_cancel_dialog('The last %s failed at "%s", would you like to resume from there?' % (self.command_name, failed.name)):
+                self.pipeline.start()
+                return
         p = self.run_command(CURRENT_BRANCH_COMMAND, [], False, False)
-        if p.output() == 'trunk':
-            self.git_fetch()
+        if p.output().strip() == 'trunk':
+            self.pipeline = self.create_pipeline(False)
         elif sublime.ok_cancel_dialog('This operation must be done from trunk, would you like to switch branches?'):
-            self.switch_trunk()
-
+            self.pipeline = self.create_pipeline(True)
+        else:
+            return
+        self.pipeline.start()
 
 
 class ArcinatorStatusCommand(ArcinatorCommand):
@@ -400,13 +518,12 @@ class ArcinatorLogCommand(ArcinatorCommand):
         self.command_name = 'Log revision (%s)' % revision
         self.run_command(LOG_FULL + ' ' + revision)
 
-    def parse_logs(self, raw):
-        """Parses the logs"""
-        matches = re.findall(LOG_PARSE, raw, re.M)
+    def set_logs(self, entries):
+        """Sets the revisions and quick panel items from (revision, author, date, message) entries"""
         revisions = []
         logs = []
-        show_more = len(matches) >= self.number
-        for revision, author, date, message in matches:
+        show_more = len(entries) >= self.number
+        for revision, author, date, message in entries:
             revisions.append(revision)
             logs.append([message, revision, author + ' - ' + date])
         if (show_more):
@@ -414,18 +531,47 @@ class ArcinatorLogCommand(ArcinatorCommand):
         self.revisions = revisions
         self.logs = logs
 
+    def parse_logs(self, raw):
+        """Parses the logs"""
+        self.set_logs(re.findall(LOG_PARSE, raw, re.M))
+
+    def show_logs(self):
+        """Shows the logs to the user"""
+        util.debug('found %s revisions' % str(len(self.revisions)))
+        if len(self.logs) > 0:
+            sublime.active_window().show_quick_panel(self.logs, self.on_select)
+
     def on_logs_available(self, process):
         """Handles the logs being available"""
         output = process.output()
         self.parse_logs(output)
-        util.debug('found %s revisions' % str(len(self.revisions)))
-        if len(self.logs) > 0:
-            sublime.active_window().show_quick_panel(self.logs, self.on_select)
+        self.show_logs()
 
-    def get_revisions(self):
+    def get_stored_revisions(self, store):
+        """Gets the logs from the commit store, falling back to git if it cannot be updated"""
+        commits = store.log(self.number, paths=self.files)
+        if commits is None:
+            self.get_git_revisions()
+            return
+        now = time.time()
+        self.set_logs([
+            (commit['hash'], commit['author'], util.relative_time(commit['date'], now), commit['subject'])
+            for commit in commits
+        ])
+        self.show_logs()
+
+    def get_git_revisions(self):
         """Runs a process to get log output"""
         thread.Process('Log', LOG_FORMAT + ' -n' + str(self.number), self.files, False, True, self.on_logs_available)
 
+    def get_revisions(self):
+        """Gets the logs from the commit store if there is one, otherwise from git"""
+        store = logstore.get(util.get_root(self.files[0] if self.files else None))
+        if store is None:
+            self.get_git_revisions()
+            return
+        sublime.set_timeout_async(lambda: self.get_stored_revisions(store), 0)
+
     def run(self, paths=None, group=-1, index=-1):
         """Runs the command"""
         util.debug(self.command_name)
@@ -434,6 +580,111 @@ class ArcinatorLogCommand(ArcinatorCommand):
         self.get_revisions()
 
 
+class ArcinatorSearchHistoryCommand(ArcinatorLogCommand):
+    """A command that searches the commit messages, authors and paths of the history"""
+
+    def __init__(self, window):
+        """Initialize the command object"""
+        super().__init__(window)
+        self.command_name = 'Search History'
+        self.store = None
+        self.query = ''
+
+    def on_change_input(self, value):
+        """Shows the number of matches while the query is typed"""
+        store = self.store
+        sublime.set_timeout_async(lambda: sublime.status_message('%d matching commits' % store.count(value)), 0)
+
+    def on_done_input(self, value):
+        """Handles completion of the input panel"""
+        self.query = value
+        self.get_revisions()
+
+    def get_stored_revisions(self, store):
+        """Gets the search results from the commit store"""
+        commits = store.search(self.query, self.number)
+        if commits is None:
+            sublime.status_message('Could not search the history for "%s"' % self.query)
+            return
+        now = time.time()
+        self.set_logs([
+            (commit['hash'], commit['author'], util.relative_time(commit['date'], now), commit['subject'])
+            for commit in commits
+        ])
+        if len(self.revisions) < 1:
+            sublime.status_message('No commits match "%s"' % self.query)
+            return
+        self.show_logs()
+
+    def get_revisions(self):
+        """Runs the search on a background thread"""
+        store = self.store
+        sublime.set_timeout_async(lambda: self.get_stored_revisions(store), 0)
+
+    def run(self, paths=None, group=-1, index=-1):
+        """Runs the command"""
+        util.debug(self.command_name)
+        files = util.get_files(paths, group, index)
+        self.store = logstore.get(util.get_root(files[0] if files else None))
+        if self.store is None:
+            sublime.status_message('Search History requires the log index (logIndex setting and sqlite3)')
+            return
+        self.number = 20
+        sublime.set_timeout_async(self.store.update, 0)
+        sublime.active_window().show_input_panel('Search history', self.query, self.on_done_input, self.on_change_input, self.nothing)
+
+
+class ArcinatorHistoryCommand(ArcinatorCommand):
+    """A command that opens a view of the commit graph of the current branch, loaded as it is scrolled"""
+
+    def __init__(self, window):
+        """Initialize the command object"""
+        super().__init__(window)
+        self.command_name = 'History'
+        self.tests = {}
+
+    def run(self, paths=None, group=-1, index=-1):
+        """Runs the command"""
+        util.debug(self.command_name)
+        files = util.get_files(paths, group, index)
+        root = util.get_root(files[0] if files else None)
+        if root is None:
+            sublime.status_message('Not in a repository')
+            return
+        history.open_view(self.window, root)
+
+
+class ArcinatorBlameCommand(ArcinatorCommand):
+    """A command that toggles blame annotations for a file"""
+
+    def __init__(self, window):
+        """Initialize the command object"""
+        super().__init__(window)
+        self.command_name = 'Blame'
+        self.tests = {
+            'file': True,
+            'tracked': True
+        }
+
+    def run(self, paths=None, group=-1, index=-1):
+        """Runs the command"""
+        util.debug(self.command_name)
+        files = util.get_files(paths, group, index, 'current')
+        if not self.is_file(files):
+            return
+        view = self.window.find_open_file(files[0])
+        if view is None:
+            view = self.window.open_file(files[0])
+        blame.toggle(view)
+
+    def is_enabled(self, paths=None, group=-1, index=-1):
+        """Checks if the command should be visible"""
+        files = util.get_files(paths, group, index, 'current')
+        if not self.is_file(files):
+            return False
+        return super().is_enabled(files)
+
+
 class ArcinatorSubmitCommand(ArcinatorCommand):
     """A command that sends a feature to arcanist for review"""
 
@@ -445,10 +696,18 @@ class ArcinatorSubmitCommand(ArcinatorCommand):
             'tracked': True
         }
 
+    def submit(self, root):
+        """Runs the pre-submit checks, then sends the feature for review if they pass"""
+        if not checks.run(root, self.command_name):
+            sublime.status_message(self.command_name + ' stopped, a pre-submit check failed')
+            return
+        self.run_command('arc diff --preview --browse')
+
     def run(self, paths=None, group=-1, index=-1):
         """Runs the command"""
         util.debug(self.command_name)
-        self.run_command('arc diff --preview --browse')
+        root = util.get_root()
+        sublime.set_timeout_async(lambda: self.submit(root), 0)
 
 
 class ArcinatorFeatureCommand(ArcinatorCommand):
@@ -495,6 +754,54 @@ class ArcinatorFeatureFromCurrentCommand(ArcinatorCommand):
         sublime.active_window().show_input_panel('Feature name', '', self.on_done_input, self.nothing, self.nothing)
 
 
+class ArcinatorPatchCommand(ArcinatorCommand):
+    """Applies the diff of a Differential revision, downloaded through arc or taken from the patch cache"""
+    last_revision = ''
+
+    def __init__(self, window):
+        """Initialize the command object"""
+        super().__init__(window)
+        self.command_name = 'Apply Patch'
+        self.tests = {}
+
+    def on_applied(self, root, process):
+        """Refreshes the status once the patch has been applied"""
+        if process.returncode == 0:
+            status.invalidate(root)
+
+    def apply(self, root, revision, diff):
+        """Gets the diff and applies it to the working copy"""
+        diff, text = patch.fetch(root, revision, diff)
+        if text is None and diff is not None:
+            sublime.status_message('Diff %d is not a diff of D%d' % (diff, revision))
+            return
+        if text is None:
+            sublime.status_message('Could not get the diff of D%d' % revision)
+            return
+        name = '%s D%d (diff %d)' % (self.command_name, revision, diff)
+        thread.Process(name, patch.apply_command(), None, True, True, lambda process: self.on_applied(root, process), root, input_text=text, window=self.window)
+
+    def on_done_input(self, root, value):
+        """Handles completion of the input panel"""
+        parsed = patch.parse_revision(value)
+        if parsed is None:
+            sublime.status_message('Not a revision: ' + value)
+            return
+        ArcinatorPatchCommand.last_revision = value.strip()
+        revision, diff = parsed
+        sublime.set_timeout_async(lambda: self.apply(root, revision, diff), 0)
+
+    def run(self, paths=None, group=-1, index=-1):
+        """Runs the command"""
+        util.debug(self.command_name)
+        files = util.get_files(paths, group, index)
+        root = util.get_root(files[0] if files else None)
+        if root is None:
+            return
+        self.window.show_input_panel('Revision (D123, or D123:456 for a specific diff)', ArcinatorPatchCommand.last_revision,
+                                     lambda value: self.on_done_input(root, value), self.nothing, self.nothing)
+
+
 class ArcinatorLandCommand(ArcinatorCommand):
     """A command that lands an approved review"""
 
@@ -549,11 +856,34 @@ class ArcinatorSwitchCommand(ArcinatorCommand):
 
     def on_select_branch(self, index):
         """Handles completion of the MultiSelect"""
-        self.branch = self.items[index]
         if index < 0:
             return
+        self.branch = self.items[index]
+        if worktree.enabled():
+            root = util.get_root(self.files[0] if self.files else None)
+            sublime.set_timeout_async(lambda: self.open_worktree(root, self.branch), 0)
+            return
         self.run_command('git checkout ' + self.branch)
 
+    def open_worktree(self, root, branch):
+        """Opens a window for a worktree of the branch instead of checking it out"""
+        folder = worktree.checkout(root, branch)
+        if folder is None:
+            sublime.status_message('Could not create a worktree for ' + branch)
+            return
+        sublime.set_timeout(lambda: self.open_folder(folder), 0)
+
+    def open_folder(self, folder):
+        """Opens a folder in a new window, unless a window already has it open"""
+        for window in sublime.windows():
+            if folder in [os.path.normpath(f) for f in window.folders()]:
+                window.focus_view(window.active_view())
+                sublime.status_message(self.branch + ' is already open in ' + folder)
+                return
+        sublime.run_command('new_window')
+        window = sublime.active_window()
+        window.set_project_data({'folders': [{'path': folder}]})
+
     def run(self, paths=None, group=-1, index=-1):
         """Runs the command"""
         util.debug(self.command_name)
@@ -576,8 +906,33 @@ class ArcinatorDiffCommand(ArcinatorCommand):
         """Runs the command"""
         util.debug(self.command_name)
         self.files = util.get_files(paths, group, index)
-        appName = settings.get('externalDiffTool')
-        self.run_external(appName, self.files)
+        sublime.set_timeout_async(self.diff, 0)
+
+    def skipped_files(self):
+        """Gets the large, binary and LFS files to leave out of the diff, with their size deltas"""
+        root = util.get_root(self.files[0] if self.files else None)
+        if root is None or sizes.diffs_large_files():
+            return {}
+        relative = dict(
+            (path, os.path.relpath(path, root).replace(os.sep, '/'))
+            for path in self.files if os.path.isfile(path)
+        )
+        classes = status.classify(root, list(relative.values()))
+        return dict(
+            (path, sizes.describe(classes[relative[path]]))
+            for path in relative if sizes.skips_content(classes[relative[path]])
+        )
+
+    def diff(self):
+        """Runs the external diff tool on the files that are not too large to diff"""
+        skipped = self.skipped_files()
+        if len(skipped) > 0:
+            output.add_command(self.command_name, window=self.window)
+            output.add_result('\n'.join('Skipped %s  %s' % (path, skipped[path]) for path in sorted(skipped)))
+            output.end_command()
+        files = [path for path in self.files if path not in skipped]
+        if len(files) > 0 or len(skipped) < 1:
+            self.run_external(settings.get('externalDiffTool'), files)
 
 
 class ArcinatorRevertCommand(ArcinatorCommand):
@@ -609,7 +964,144 @@ class ArcinatorRevertCommand(ArcinatorCommand):
         if self.is_file(files):
             self.verify()
         else:
-            self.select_changes()
+            self.select_changes(status.UNTRACKED_NONE)
+
+
+class ArcinatorStashCommand(ArcinatorCommand):
+    """A command that stashes the changes in the working copy"""
+
+    def __init__(self, window):
+        """Initialize the command object"""
+        super().__init__(window)
+        self.command_name = 'Stash'
+        self.tests = {
+            'changed': True
+        }
+
+    def on_stashed(self, root, process):
+        """Adds the new stash to the stash list"""
+        if process.returncode == 0:
+            sublime.set_timeout_async(lambda: stash.get(root).added(), 0)
+
+    def on_done_input(self, value):
+        """Handles completion of the input panel"""
+        root = util.get_root()
+        cmd = 'git stash push'
+        if value:
+            cmd = cmd + ' -m "' + util.escape_quotes(value) + '"'
+        self.run_command(cmd, [], True, True, lambda process: self.on_stashed(root, process))
+
+    def run(self, paths=None, group=-1, index=-1):
+        """Runs the command"""
+        util.debug(self.command_name)
+        sublime.active_window().show_input_panel('Stash message', '', self.on_done_input, self.nothing, self.nothing)
+
+
+class ArcinatorStashApplyCommand(ArcinatorCommand):
+    """A command that applies a stash picked from a list that previews the diffstat of each stash"""
+
+    def __init__(self, window):
+        """Initialize the command object"""
+        super().__init__(window)
+        self.command_name = 'Stash Apply'
+        self.tests = {
+            'tracked': True
+        }
+        self.stashes = None
+        self.entries = []
+        self.highlighted = -1
+
+    def load(self, root):
+        """Gets the stashes and shows them to the user"""
+        self.stashes = stash.get(root)
+        self.entries = self.stashes.get()
+        if len(self.entries) < 1:
+            sublime.status_message('No stashes')
+            return
+        items = [[entry['ref'] + ': ' + entry['subject'], entry['id'][:8] + ', ' + entry['date']] for entry in self.entries]
+        sublime.set_timeout(lambda: self.window.show_quick_panel(items, self.on_select_stash, sublime.MONOSPACE_FONT, 0, self.on_highlight_stash), 0)
+
+    def on_highlight_stash(self, index):
+        """Shows the diffstat of the highlighted stash"""
+        self.highlighted = index
+        if index < 0:
+            return
+        self.stashes.diffstat(self.entries[index], lambda text: sublime.set_timeout(lambda: self.show_preview(index, text), 0))
+
+    def show_preview(self, index, text):
+        """Shows a diffstat in the preview panel, if its stash is still highlighted"""
+        if index != self.highlighted:
+            return
+        panel = self.window.create_output_panel(STASH_PANEL)
+        panel.run_command(output.CLEAR_COMMAND)
+        panel.run_command(output.MESSAGE_COMMAND, {'message': text.rstrip('\n')})
+        self.window.run_command('show_panel', {'panel': 'output.' + STASH_PANEL})
+
+    def on_select_stash(self, index):
+        """Handles completion of the quick panel"""
+        self.highlighted = -1
+        self.window.run_command('hide_panel', {'panel': 'output.' + STASH_PANEL})
+        if index < 0:
+            return
+        entry = self.entries[index]
+        ref = self.current_ref(entry)
+        if ref is None:
+            sublime.status_message(entry['ref'] + ' no longer exists')
+            return
+        self.apply(entry, ref)
+
+    def current_ref(self, entry):
+        """Gets the stash@{n} name of a stash, in case something else changed the stashes"""
+        for current in self.stashes.get():
+            if current['id'] == entry['id']:
+                return current['ref']
+        return None
+
+    def on_removed(self, entry, process):
+        """Removes a stash from the stash list once it has been popped or dropped"""
+        if process.returncode == 0:
+            self.stashes.removed(entry)
+
+    def apply(self, entry, ref):
+        """Applies a stash"""
+        self.run_command('git stash apply "%s"' % ref, [], True, True)
+
+    def run(self, paths=None, group=-1, index=-1):
+        """Runs the command"""
+        util.debug(self.command_name)
+        root = util.get_root()
+        if root is None:
+            return
+        sublime.set_timeout_async(lambda: self.load(root), 0)
+
+
+class ArcinatorStashPopCommand(ArcinatorStashApplyCommand):
+    """A command that applies and removes a stash picked from the stash list"""
+
+    def __init__(self, window):
+        """Initialize the command object"""
+        super().__init__(window)
+        self.command_name = 'Stash Pop'
+
+    def apply(self, entry, ref):
+        """Pops a stash"""
+        self.run_command('git stash pop "%s"' % ref, [], True, True, lambda process: self.on_removed(entry, process))
+
+
+class ArcinatorStashDropCommand(ArcinatorStashApplyCommand):
+    """A command that removes a stash picked from the stash list"""
+
+    def __init__(self, window):
+        """Initialize the command object"""
+        super().__init__(window)
+        self.command_name = 'Stash Drop'
+
+    def apply(self, entry, ref):
+        """Drops a stash after checking with the user"""
+        if not sublime.ok_cancel_dialog('Are you sure you want to drop this stash?\n\n%s: %s' % (ref, entry['subject'])):
+            return
+        self.run_command('git stash drop "%s"' % ref, [], True, True, lambda process: self.on_removed(entry, process))
+
 
 class ArcinatorDiffAgainstTrunkCommand(ArcinatorCommand):
     """Run the git defined difftool on the current branch versus trunk"""
@@ -624,15 +1116,31 @@ class ArcinatorDiffAgainstTrunkCommand(ArcinatorCommand):
 
     def on_select_branch(self, index):
         """Handles completion of the MultiSelect"""
+        if index < 0:
+            return
         self.branch = self.items[index]
         if self.branch[:2] == '* ':
             self.branch = self.branch.strip('* ').strip()
-        if index < 0:
+        if worktree.enabled():
+            root = util.get_root()
+            sublime.set_timeout_async(lambda: self.diff_worktrees(root, self.branch), 0)
             return
         command = 'git difftool --dir-diff trunk..' + self.branch
         util.debug('running: ' + command)
         self.run_command(command)
 
+    def diff_worktrees(self, root, branch):
+        """Runs the external diff tool on worktrees of trunk and the branch"""
+        trunk = worktree.checkout(root, 'trunk', capacity=max(worktree.size(), 2))
+        if trunk is None:
+            sublime.status_message('Could not create worktrees to diff ' + branch + ' against trunk')
+            return
+        other = worktree.checkout(root, branch, [trunk], max(worktree.size(), 2))
+        if other is None:
+            sublime.status_message('Could not create worktrees to diff ' + branch + ' against trunk')
+            return
+        self.run_external(settings.get('externalDiffTool'), [trunk, other])
+
     def parse_branches(self, raw):
         """Parses the output of a status command for use in a MultiSelect"""
         lines = raw.split('\n')
@@ -675,4 +1183,202 @@ class ArcinatorDiffAgainstTrunkCommand(ArcinatorCommand):
     def run(self, paths=None, group=-1, index=-1):
         """Runs the command"""
         util.debug('\n\n'+self.command_name)
+        if worktree.enabled():
+            self.select_branch_to_diff()
+            return
         self.check_diff_tool()
+
+
+class ArcinatorSparseCommand(ArcinatorCommand):
+    """Base command for the commands that show and edit the sparse-checkout cone"""
+
+    def __init__(self, window):
+        """Initialize the command object"""
+        super().__init__(window)
+        self.command_name = 'Sparse Checkout'
+        self.tests = {}
+
+    def get_folder(self, paths):
+        """Gets the side bar folder the command was run on, None when it was run from elsewhere"""
+        if isinstance(paths, list) and len(paths) == 1 and os.path.isdir(paths[0]):
+            return paths[0]
+        return None
+
+    def on_changed(self, root, process):
+        """Refreshes the status of the repository once the cone has changed"""
+        if process.returncode == 0:
+            status.invalidate(root)
+
+    def change(self, root, cmd):
+        """Runs a command that changes the cone"""
+        thread.Process(self.command_name, cmd, None, True, True, lambda process: self.on_changed(root, process), root, window=self.window)
+
+
+class ArcinatorSparseShowCommand(ArcinatorSparseCommand):
+    """Shows the folders of the sparse-checkout cone"""
+
+    def show(self, root):
+        """Writes the cone to the output"""
+        checkout = sparse.get(root)
+        folders = checkout.get()
+        if folders is None:
+            result = 'Not a sparse checkout'
+        elif len(folders) < 1:
+            result = 'Only the files at the top of the repository are checked out'
+        else:
+            result = '\n'.join(folders)
+        if checkout.partial:
+            result += '\n\nPartial clone: missing objects are fetched when they are needed'
+        output.add_command(self.command_name, window=self.window)
+        output.add_result(result)
+        output.end_command()
+
+    def run(self, paths=None, group=-1, index=-1):
+        """Runs the command"""
+        util.debug(self.command_name)
+        root = util.get_root(self.get_folder(paths))
+        if root is None:
+            return
+        sublime.set_timeout_async(lambda: self.show(root), 0)
+
+
+class ArcinatorSparseAddCommand(ArcinatorSparseCommand):
+    """Adds a folder to the sparse-checkout cone, starting a sparse checkout if there is none"""
+
+    def __init__(self, window):
+        """Initialize the command object"""
+        super().__init__(window)
+        self.command_name = 'Sparse Checkout Add'
+
+    def add(self, root, folder):
+        """Adds a folder, relative to the repository, to the cone"""
+        folder = folder.strip().strip('/')
+        if not folder:
+            return
+        checkout = sparse.get(root)
+        if not checkout.is_cone() and not sublime.ok_cancel_dialog(
+                'This is not a sparse checkout yet. Only the files at the top of the repository and this folder will stay checked out.\n\nFolder:\n' + folder):
+            return
+        self.change(root, sparse.add_command(root, folder))
+
+    def run(self, paths=None, group=-1, index=-1):
+        """Runs the command"""
+        util.debug(self.command_name)
+        folder = self.get_folder(paths)
+        root = util.get_root(folder)
+        if root is None:
+            return
+        if folder is not None:
+            self.add(root, sparse.relative(root, folder))
+            return
+        self.window.show_input_panel('Folder to check out', '', lambda value: self.add(root, value), self.nothing, self.nothing)
+
+    def is_enabled(self, paths=None, group=-1, index=-1):
+        """Checks if the folder is not already checked out in full, from the cone read in the background"""
+        folder = self.get_folder(paths)
+        root = util.get_root(folder)
+        if root is None:
+            return False
+        if folder is None or folder == root:
+            return True
+        checkout = sparse.cached(root)
+        return checkout is None or not sparse.contains(checkout.last_read()[0], sparse.relative(root, folder))
+
+
+class ArcinatorSparseRemoveCommand(ArcinatorSparseCommand):
+    """Removes a folder from the sparse-checkout cone"""
+
+    def __init__(self, window):
+        """Initialize the command object"""
+        super().__init__(window)
+        self.command_name = 'Sparse Checkout Remove'
+        self.folders = []
+
+    def remove(self, root, folder):
+        """Removes a folder, relative to the repository, from the cone after checking with the user"""
+        if not sublime.ok_cancel_dialog('Are you sure you want to remove this folder from the sparse checkout?\n\nFolder:\n' + folder):
+            return
+        self.change(root, sparse.remove_command(root, folder))
+
+    def on_select_folder(self, root, index):
+        """Handles completion of the quick panel"""
+        if index < 0:
+            return
+        self.remove(root, self.folders[index])
+
+    def run(self, paths=None, group=-1, index=-1):
+        """Runs the command"""
+        util.debug(self.command_name)
+        folder = self.get_folder(paths)
+        root = util.get_root(folder)
+        if root is None:
+            return
+        if folder is not None and folder != root:
+            self.remove(root, sparse.relative(root, folder))
+            return
+        self.folders = sparse.get(root).get() or []
+        if len(self.folders) < 1:
+            sublime.status_message('No folders in the sparse checkout')
+            return
+        self.window.show_quick_panel(self.folders, lambda index: self.on_select_folder(root, index))
+
+    def is_enabled(self, paths=None, group=-1, index=-1):
+        """Checks if the repository is a sparse checkout and the folder is one of its cone folders, from the cone read in the background"""
+        folder = self.get_folder(paths)
+        root = util.get_root(folder)
+        checkout = sparse.cached(root) if root is not None else None
+        if checkout is None:
+            return False
+        folders, cone = checkout.last_read()
+        if folders is None or not cone:
+            return False
+        return folder is None or folder == root or sparse.relative(root, folder) in folders
+
+
+class ArcinatorPartialCloneCommand(ArcinatorCommand):
+    """Clones a repository without the file contents of its history, which are fetched when they are needed"""
+
+    def __init__(self, window):
+        """Initialize the command object"""
+        super().__init__(window)
+        self.command_name = 'Partial Clone'
+        self.tests = {}
+        self.url = None
+
+    def on_cloned(self, destination, process):
+        """Opens the clone in a new window"""
+        if process.returncode != 0:
+            return
+        sublime.run_command('new_window')
+        sublime.active_window().set_project_data({'folders': [{'path': destination}]})
+
+    def on_done_destination(self, value):
+        """Handles completion of the destination input panel"""
+        destination = os.path.abspath(os.path.expanduser(value.strip()))
+        if not value.strip() or os.path.exists(destination):
+            sublime.status_message('Cannot clone into ' + destination)
+            return
+        parent = os.path.dirname(destination)
+        if not os.path.isdir(parent):
+            sublime.status_message('Cannot clone into ' + destination + ', ' + parent + ' does not exist')
+            return
+        cmd = sparse.clone_command(self.url, destination)
+        thread.Process(self.command_name, cmd, None, True, True, lambda process: sublime.set_timeout(lambda: self.on_cloned(destination, process), 0), parent, window=self.window)
+
+    def on_done_url(self, value):
+        """Handles completion of the URL input panel"""
+        self.url = value.strip()
+        if not self.url:
+            return
+        folders = self.window.folders()
+        parent = os.path.dirname(util.get_root(folders[0]) or folders[0]) if folders else os.path.expanduser('~')
+        default = os.path.join(parent, sparse.clone_name(self.url))
+        self.window.show_input_panel('Clone into', default, self.on_done_destination, self.nothing, self.nothing)
+
+    def run(self, paths=None, group=-1, index=-1):
+        """Runs the command"""
+        util.debug(self.command_name)
+        self.window.show_input_panel('Repository to clone', '', self.on_done_url, self.nothing, self.nothing)
+
+
+startup.loaded('arcinator_command')
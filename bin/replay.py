@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""Replays the git and arc commands recorded with the recordCommands setting
+
+To replay, link this script as git and arc, point the gitPath and arcPath
+settings at the links and set these environment variables before starting
+Sublime Text:
+
+    ARCINATOR_REPLAY        fixture file written by recordCommands
+    ARCINATOR_REPLAY_SCALE  multiplies the recorded durations, 0 replays instantly
+    ARCINATOR_REPLAY_TRACE  file that each replayed command is appended to
+
+Commands are matched by their arguments, with paths inside the recorded
+working folder made relative, and by their input, so conduit calls that
+only differ in their parameters replay their own responses. Repeated
+commands are replayed in the order they were recorded, repeating the last
+recording once they run out. Arcinator starts the replay over each time it
+loads with ARCINATOR_REPLAY set.
+
+To compare runs:
+
+    replay.py --summary FILE       counts and times each git and arc subcommand
+    replay.py --compare OLD NEW    compares two recordings or traces
+    replay.py --reset FIXTURE      replays a fixture from the start again
+"""
+import os
+import sys
+import json
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+MISSING_CODE = 128
+TERMINATED_CODE = 143
+CONDUIT_COMMAND = ['arc', 'call-conduit']
+
+
+def load(path):
+    """Loads the entries of a fixture or trace file"""
+    entries = []
+    with open(path, 'r') as f:
+        for line in f:
+            if line.strip():
+                entries.append(json.loads(line))
+    return entries
+
+
+def normalize(argv, cwd):
+    """Makes the paths inside the working folder relative, so fixtures replay in another checkout"""
+    prefix = os.path.normpath(cwd) + os.sep
+    args = []
+    for arg in argv:
+        if os.path.normpath(arg) == prefix[:-1]:
+            arg = '.'
+        elif arg.startswith(prefix):
+            arg = arg[len(prefix):]
+        args.append(arg)
+    return json.dumps(args)
+
+
+def input_key(argv, stdin):
+    """Gets the part of the matching key that comes from the input of a command, with the parameters of conduit calls in a fixed order"""
+    if not stdin:
+        return None
+    if argv[:2] == CONDUIT_COMMAND:
+        try:
+            return json.dumps(json.loads(stdin), sort_keys=True)
+        except ValueError:
+            pass
+    return stdin
+
+
+def subcommand(argv):
+    """Gets the executable and the first argument that is not an option"""
+    for arg in argv[1:]:
+        if not arg.startswith('-'):
+            return argv[0] + ' ' + arg
+    return argv[0]
+
+
+class State(object):
+    """Counts how many times each command has been replayed, shared between concurrent replays"""
+
+    def __init__(self, fixture):
+        """Initializes a State object"""
+        self.path = fixture + '.state'
+        self.file = None
+
+    def __enter__(self):
+        """Locks and loads the counts"""
+        self.file = open(self.path, 'a+')
+        if fcntl is not None:
+            fcntl.flock(self.file, fcntl.LOCK_EX)
+        self.file.seek(0)
+        text = self.file.read()
+        self.counts = json.loads(text) if text else {}
+        return self
+
+    def __exit__(self, *args):
+        """Saves and unlocks the counts"""
+        self.file.seek(0)
+        self.file.truncate()
+        self.file.write(json.dumps(self.counts))
+        self.file.close()
+
+    def next(self, key):
+        """Gets the index of the next recording of a command"""
+        index = self.counts.get(key, 0)
+        self.counts[key] = index + 1
+        return index
+
+
+def find(fixture, argv, cwd, stdin=None):
+    """Finds the recording to replay for a command"""
+    key = normalize(argv, cwd)
+    stdin_key = input_key(argv, stdin)
+    matches = [
+        entry for entry in load(fixture)
+        if normalize(entry['argv'], entry['cwd']) == key and input_key(entry['argv'], entry.get('stdin')) == stdin_key
+    ]
+    if len(matches) < 1:
+        return None
+    with State(fixture) as state:
+        index = state.next(key if stdin_key is None else key + '\0' + stdin_key)
+    return matches[min(index, len(matches) - 1)]
+
+
+def replay(tool, args):
+    """Replays one command, returns its exit code"""
+    fixture = os.environ.get('ARCINATOR_REPLAY')
+    if not fixture:
+        sys.stderr.write('replay: ARCINATOR_REPLAY is not set\n')
+        return MISSING_CODE
+    started = time.time()
+    argv = [tool] + args
+    cwd = os.getcwd()
+    stdin = None
+    if sys.stdin is not None and not sys.stdin.isatty():
+        stdin = sys.stdin.read() or None
+    entry = find(fixture, argv, cwd, stdin)
+    if entry is None:
+        sys.stderr.write('replay: no recording of %s\n' % ' '.join(argv))
+        entry = {'stdin': None, 'stdout': '', 'stderr': '', 'returncode': MISSING_CODE, 'duration': 0}
+    time.sleep(entry['duration'] * float(os.environ.get('ARCINATOR_REPLAY_SCALE', '1')))
+    sys.stdout.write(entry['stdout'])
+    sys.stderr.write(entry['stderr'])
+    returncode = entry['returncode']
+    if returncode is None:
+        returncode = TERMINATED_CODE
+    trace = os.environ.get('ARCINATOR_REPLAY_TRACE')
+    if trace:
+        with open(trace, 'a') as f:
+            f.write(json.dumps({
+                'argv': argv,
+                'cwd': cwd,
+                'stdin': stdin,
+                'stdout': entry['stdout'],
+                'stderr': entry['stderr'],
+                'returncode': returncode,
+                'started': started,
+                'duration': time.time() - started
+            }) + '\n')
+    return returncode if returncode >= 0 else TERMINATED_CODE
+
+
+def summarize(entries):
+    """Gets the count, total and longest duration of each subcommand"""
+    summary = {}
+    for entry in entries:
+        name = subcommand(entry['argv'])
+        count, total, longest = summary.get(name, (0, 0.0, 0.0))
+        summary[name] = (count + 1, total + entry['duration'], max(longest, entry['duration']))
+    return summary
+
+
+def print_summary(path):
+    """Prints the summary of a fixture or trace file"""
+    summary = summarize(load(path))
+    print('%-32s %8s %10s %10s' % ('Command', 'Count', 'Total', 'Longest'))
+    for name in sorted(summary, key=lambda name: -summary[name][1]):
+        count, total, longest = summary[name]
+        print('%-32s %8d %9.3fs %9.3fs' % (name, count, total, longest))
+    print('%-32s %8d %9.3fs' % ('All', sum(s[0] for s in summary.values()), sum(s[1] for s in summary.values())))
+
+
+def print_comparison(old_path, new_path):
+    """Prints the change in subprocess counts and durations between two runs"""
+    old = summarize(load(old_path))
+    new = summarize(load(new_path))
+    print('%-32s %12s %20s' % ('Command', 'Count', 'Total'))
+    for name in sorted(set(old) | set(new)):
+        old_count, old_total, _ = old.get(name, (0, 0.0, 0.0))
+        new_count, new_total, _ = new.get(name, (0, 0.0, 0.0))
+        print('%-32s %5d -> %-4d %8.3fs -> %.3fs' % (name, old_count, new_count, old_total, new_total))
+    print('%-32s %5d -> %-4d %8.3fs -> %.3fs' % (
+        'All',
+        sum(s[0] for s in old.values()),
+        sum(s[0] for s in new.values()),
+        sum(s[1] for s in old.values()),
+        sum(s[1] for s in new.values())
+    ))
+
+
+def main(argv):
+    """Runs the script"""
+    tool = os.path.splitext(os.path.basename(argv[0]))[0]
+    args = argv[1:]
+    if tool in ('git', 'arc'):
+        return replay(tool, args)
+    if len(args) == 2 and args[0] == '--summary':
+        print_summary(args[1])
+        return 0
+    if len(args) == 3 and args[0] == '--compare':
+        print_comparison(args[1], args[2])
+        return 0
+    if len(args) == 2 and args[0] == '--reset':
+        if os.path.exists(args[1] + '.state'):
+            os.remove(args[1] + '.state')
+        return 0
+    if len(args) > 0 and args[0] in ('git', 'arc'):
+        return replay(args[0], args[1:])
+    sys.stderr.write(__doc__)
+    return 2
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,284 @@
+import sublime
+import os
+import hashlib
+import html
+import time
+from collections import OrderedDict
+from threading import Lock
+from . import runner, util, stats
+
+BLAME_COMMAND = 'git blame --incremental'
+PHANTOM_KEY = 'arcinator-blame'
+CACHE_SIZE = 50
+RENDER_INTERVAL = 100
+WATCH_INTERVAL = 250
+RENDER_MARGIN = 200
+UNCOMMITTED = '0' * 40
+
+PHANTOM_TEMPLATE = '<div style="color: color(var(--foreground) alpha(0.5)); font-size: 0.9rem;">%s</div>'
+
+
+def blob_id(path):
+    """Gets the git blob id and line count of a file on disk, without running git"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    size = data.count(b'\n')
+    if len(data) > 0 and not data.endswith(b'\n'):
+        size += 1
+    return hashlib.sha1(b'blob ' + str(len(data)).encode('ascii') + b'\0' + data).hexdigest(), size
+
+
+def file_stamp(path):
+    """Gets the modification time and size of a file, which change whenever its blob id may have"""
+    stat = os.stat(path)
+    return stat.st_mtime, stat.st_size
+
+
+class BlameResult(object):
+    """The blame of a single version of a file, filled in as git reports it"""
+
+    def __init__(self, path, blob, size):
+        """Initializes a BlameResult object"""
+        self.path = path
+        self.blob = blob
+        self.lines = [None] * size
+        self.commits = {}
+        self.complete = False
+        self.pending = None
+        self.lock = Lock()
+
+    def parse(self, line):
+        """Parses a line of git blame --incremental output"""
+        line = line.rstrip('\n')
+        if self.pending is None:
+            parts = line.split(' ')
+            if len(parts) < 4:
+                return False
+            commit_hash, final, count = parts[0], int(parts[2]), int(parts[3])
+            self.pending = (commit_hash, final, count)
+            if commit_hash not in self.commits:
+                self.commits[commit_hash] = {}
+            return False
+        commit_hash, final, count = self.pending
+        key, separator, value = line.partition(' ')
+        if key != 'filename':
+            self.commits[commit_hash][key] = value
+            return False
+        with self.lock:
+            end = final - 1 + count
+            if end > len(self.lines):
+                self.lines.extend([None] * (end - len(self.lines)))
+            for index in range(final - 1, end):
+                self.lines[index] = commit_hash
+        self.pending = None
+        return True
+
+    def label(self, commit_hash):
+        """Gets the annotation text for a commit"""
+        if commit_hash == UNCOMMITTED:
+            return 'Not committed yet'
+        commit = self.commits.get(commit_hash, {})
+        when = ''
+        if 'author-time' in commit:
+            when = util.relative_time(int(commit['author-time']))
+        return '%s %s, %s - %s' % (commit_hash[:8], commit.get('author', ''), when, commit.get('summary', ''))
+
+    def hunks(self, first, last):
+        """Gets (line, commit) for the first line of each block of lines from one commit"""
+        hunks = []
+        with self.lock:
+            last = min(last, len(self.lines) - 1)
+            previous = self.lines[first - 1] if 0 < first <= len(self.lines) else None
+            for index in range(first, last + 1):
+                commit_hash = self.lines[index]
+                if commit_hash is not None and commit_hash != previous:
+                    hunks.append((index, commit_hash))
+                previous = commit_hash
+        return hunks
+
+
+class BlameCache:
+    """Caches blame results by file and blob id"""
+    results = OrderedDict()
+    lock = Lock()
+
+    def get(path, blob):
+        """Gets a cached result"""
+        with BlameCache.lock:
+            result = BlameCache.results.get((path, blob))
+            if result is not None:
+                BlameCache.results.move_to_end((path, blob))
+            return result
+
+    def add(result):
+        """Adds a result to the cache, removing the least recently used results"""
+        with BlameCache.lock:
+            BlameCache.results[(result.path, result.blob)] = result
+            while len(BlameCache.results) > CACHE_SIZE:
+                BlameCache.results.popitem(last=False)
+
+    def remove(result):
+        """Removes a result that could not be completed"""
+        with BlameCache.lock:
+            if BlameCache.results.get((result.path, result.blob)) is result:
+                del BlameCache.results[(result.path, result.blob)]
+
+
+class Annotator(object):
+    """Shows the blame of a file in a view as phantoms"""
+    views = {}
+
+    def __init__(self, view, path):
+        """Initializes an Annotator object"""
+        self.view = view
+        self.path = path
+        self.result = None
+        self.stamp = None
+        self.phantoms = sublime.PhantomSet(view, PHANTOM_KEY)
+        self.render_queued = False
+        self.rendered = None
+        self.active = True
+        Annotator.views[view.id()] = self
+
+    def start(self):
+        """Hashes the file in the background, then loads or runs its blame"""
+        sublime.set_timeout_async(self.load, 0)
+
+    def load(self):
+        """Gets the blob id of the file, off the main thread as it reads the whole file"""
+        try:
+            stamp = file_stamp(self.path)
+            blob, size = blob_id(self.path)
+        except (IOError, OSError):
+            return
+        sublime.set_timeout(lambda: self.annotate(blob, size, stamp), 0)
+
+    def annotate(self, blob, size, stamp):
+        """Loads the blame of a blob from the cache, or starts running git blame"""
+        self.stamp = stamp
+        if not self.active or (self.result is not None and self.result.blob == blob):
+            return
+        self.phantoms.update([])
+        result = BlameCache.get(self.path, blob)
+        self.result = result
+        if result is not None:
+            util.debug('blame cache hit for ' + self.path)
+            self.render()
+            return
+        self.result = BlameResult(self.path, blob, size)
+        if size < 1:
+            self.result.complete = True
+            return
+        BlameCache.add(self.result)
+        first, last = self.visible_lines()
+        last = min(last, size - 1)
+        rest = []
+        if first > 0:
+            rest.append('-L 1,%d' % first)
+        if last + 1 < size:
+            rest.append('-L %d,%d' % (last + 2, size))
+        self.blame(self.result, ['-L %d,%d' % (first + 1, last + 1)], rest, time.time())
+
+    def blame(self, result, ranges, rest, started):
+        """Runs git blame for a set of line ranges, then for the rest of the file"""
+
+        def on_line(line):
+            if result.parse(line):
+                self.queue_render()
+
+        def on_complete(process):
+            if process.returncode != 0:
+                BlameCache.remove(result)
+                sublime.status_message('Blame failed: ' + process.error().strip())
+                return
+            if len(rest) > 0:
+                self.blame(result, rest, [], started)
+                return
+            result.complete = True
+            stats.record('Blame', os.path.basename(result.path), time.time() - started)
+            self.queue_render()
+
+        cmd = BLAME_COMMAND + ' ' + ' '.join(ranges) + ' --'
+        runner.run('Blame', cmd, [result.path], False, on_complete, os.path.dirname(result.path), on_line)
+
+    def visible_lines(self):
+        """Gets the first and last line of the viewport"""
+        region = self.view.visible_region()
+        return self.view.rowcol(region.begin())[0], self.view.rowcol(region.end())[0]
+
+    def queue_render(self):
+        """Renders the phantoms soon, at most once per interval"""
+        if self.render_queued:
+            return
+        self.render_queued = True
+        sublime.set_timeout(self.render, RENDER_INTERVAL)
+
+    def render(self):
+        """Renders the phantoms for the visible part of the view"""
+        self.render_queued = False
+        if not self.active or self.result is None:
+            return
+        first, last = self.visible_lines()
+        first = max(0, first - RENDER_MARGIN)
+        last = last + RENDER_MARGIN
+        phantoms = []
+        for line, commit_hash in self.result.hunks(first, last):
+            point = self.view.text_point(line, 0)
+            content = PHANTOM_TEMPLATE % html.escape(self.result.label(commit_hash))
+            phantoms.append(sublime.Phantom(sublime.Region(point), content, sublime.LAYOUT_BLOCK))
+        self.phantoms.update(phantoms)
+        self.rendered = (first, last, self.result.complete)
+
+    def watch(self):
+        """Re-renders when the viewport moves outside of the rendered lines"""
+        if not self.active or self.view.window() is None:
+            self.stop()
+            return
+        first, last = self.visible_lines()
+        rendered = self.rendered
+        if rendered is None or first < rendered[0] or last > rendered[1] or rendered[2] != self.result.complete:
+            self.render()
+        sublime.set_timeout(self.watch, WATCH_INTERVAL)
+
+    def stop(self):
+        """Removes the phantoms from the view"""
+        self.active = False
+        self.phantoms.update([])
+        if Annotator.views.get(self.view.id()) is self:
+            del Annotator.views[self.view.id()]
+
+
+def toggle(view):
+    """Shows or hides the blame of a view"""
+    annotator = Annotator.views.get(view.id())
+    if annotator is not None:
+        annotator.stop()
+        return
+    path = view.file_name()
+    if path is None or not os.path.isfile(path):
+        return
+    if view.is_dirty():
+        sublime.status_message('Blame shows the saved version of the file')
+    annotator = Annotator(view, path)
+    annotator.start()
+    annotator.watch()
+
+
+def refresh(view):
+    """Updates the blame of a view whose file may have changed on disk"""
+    annotator = Annotator.views.get(view.id())
+    if annotator is None or annotator.result is None:
+        return
+    try:
+        stamp = file_stamp(annotator.path)
+    except (IOError, OSError):
+        return
+    if stamp != annotator.stamp:
+        annotator.start()
+
+
+def stop(view):
+    """Stops annotating a view"""
+    annotator = Annotator.views.get(view.id())
+    if annotator is not None:
+        annotator.stop()
@@ -0,0 +1,181 @@
+import os
+import hashlib
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from threading import Lock
+from . import thread, output, util, settings, stats
+
+CHANGED_FILES_COMMAND = 'git diff --name-only --diff-filter=d'
+MERGE_BASE_COMMAND = 'git merge-base HEAD'
+DEFAULT_CHECKS = [
+    {
+        'name': 'Lint',
+        'command': 'arc lint --never-apply-patches --output compiler',
+        'blocking': True
+    }
+]
+DEFAULT_WORKERS = 4
+MAX_CACHE_SIZE = 10000
+MAX_FINDING_CODE = 125
+
+
+class CheckCache:
+    """Caches check results by check command and file content hash"""
+    lock = Lock()
+
+    def path(root):
+        """Gets the cache file of a repository"""
+        name = hashlib.sha1(root.encode('utf-8')).hexdigest()
+        return os.path.join(util.cache_dir('checks'), name + '.json')
+
+    def load(root):
+        """Loads the cached results of a repository"""
+        path = CheckCache.path(root)
+        if not os.path.exists(path):
+            return {}
+        try:
+            with open(path, 'r') as f:
+                return json.load(f)
+        except ValueError:
+            return {}
+
+    def save(root, results):
+        """Saves the cached results of a repository"""
+        with CheckCache.lock:
+            with open(CheckCache.path(root), 'w') as f:
+                json.dump(results, f)
+
+
+class CheckRun(object):
+    """Runs the pre-submit checks on changed files concurrently"""
+
+    def __init__(self, root, name):
+        """Initializes a CheckRun object"""
+        self.root = root
+        self.name = name
+        self.checks = settings.get('submitChecks', DEFAULT_CHECKS)
+        self.workers = settings.get('submitCheckWorkers', DEFAULT_WORKERS)
+        self.cache = CheckCache.load(root)
+        self.lock = Lock()
+        self.stopped = False
+        self.processes = []
+        self.failures = []
+        self.used = set()
+
+    def changed_files(self):
+        """Gets the files changed on the branch, including uncommitted changes"""
+        base = settings.get('submitBase', 'trunk')
+        p = thread.Process(self.name, MERGE_BASE_COMMAND + ' ' + base, None, False, False, cwd=self.root)
+        if p.returncode != 0:
+            return None
+        p = thread.Process(self.name, CHANGED_FILES_COMMAND + ' ' + p.output().strip(), None, False, False, cwd=self.root)
+        if p.returncode != 0:
+            return None
+        return [path for path in p.output().split('\n') if path]
+
+    def cache_key(self, check, path):
+        """Gets the cache key of a check on the current content of a file"""
+        with open(os.path.join(self.root, path), 'rb') as f:
+            content = hashlib.sha1(f.read()).hexdigest()
+        return check['command'] + '\0' + path + '\0' + content
+
+    def run_check(self, check, path):
+        """Runs one check on one file, returning (passed, output), passed is None when the file cannot be checked"""
+        if self.stopped:
+            return None
+        try:
+            key = self.cache_key(check, path)
+        except (IOError, OSError) as e:
+            return [None, 'Could not read the file: ' + str(e)]
+        self.used.add(key)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        p = thread.Process(check['name'], check['command'], [path], False, True, cwd=self.root)
+        with self.lock:
+            self.processes.append(p)
+        p.join()
+        with self.lock:
+            self.processes.remove(p)
+        if self.stopped:
+            return None
+        result = [p.returncode == 0, ((p.output() or '') + (p.error() or '')).strip()]
+        if is_finding(p):
+            self.cache[key] = result
+        return result
+
+    def report(self, check, path, result):
+        """Streams the findings of a check into the output"""
+        passed, text = result
+        if passed and not text:
+            return
+        status = 'skipped' if passed is None else ('passed' if passed else 'FAILED')
+        output.add_result_message('%s: %s %s' % (check['name'], path, status))
+        if text:
+            output.add_result_message(output.indent(text))
+
+    def stop(self):
+        """Stops the checks that have not finished"""
+        self.stopped = True
+        with self.lock:
+            processes = list(self.processes)
+        for p in processes:
+            if getattr(p, 'process', None) is not None:
+                p.terminate()
+
+    def run(self):
+        """Runs every check on every changed file, returns True if none of the blocking checks failed"""
+        output.add_command(self.name + ' - Checks')
+        try:
+            return self.run_checks()
+        finally:
+            output.end_command()
+
+    def run_checks(self):
+        """Runs the checks in the output section of the run"""
+        started = time.time()
+        files = self.changed_files()
+        if files is None:
+            output.add_error('Could not find the files changed since ' + settings.get('submitBase', 'trunk'))
+            return False
+        output.add_files(files)
+        output.add_result_section()
+        jobs = {}
+        executor = ThreadPoolExecutor(max_workers=max(1, self.workers))
+        for check in self.checks:
+            for path in files:
+                jobs[executor.submit(self.run_check, check, path)] = (check, path)
+        try:
+            for future in as_completed(jobs):
+                check, path = jobs[future]
+                result = future.result()
+                if result is None:
+                    continue
+                self.report(check, path, result)
+                if result[0] is False and check.get('blocking', True):
+                    self.failures.append((check['name'], path))
+                    output.add_result_message('Stopping, %s failed on %s' % (check['name'], path))
+                    self.stop()
+                    for pending in jobs:
+                        pending.cancel()
+                    break
+        finally:
+            executor.shutdown(wait=True)
+            if len(self.cache) > MAX_CACHE_SIZE:
+                self.cache = dict((key, value) for key, value in self.cache.items() if key in self.used)
+            CheckCache.save(self.root, self.cache)
+        stats.record('Submit checks', os.path.basename(self.root), time.time() - started)
+        return len(self.failures) == 0
+
+
+def is_finding(process):
+    """Checks if a check passed or found problems, as opposed to failing to run, which is not cached"""
+    return not process.timed_out and process.returncode is not None and 0 <= process.returncode <= MAX_FINDING_CODE
+
+
+def run(root, name):
+    """Runs the pre-submit checks, returns True if the submit can continue"""
+    if len(settings.get('submitChecks', DEFAULT_CHECKS)) < 1:
+        return True
+    return CheckRun(root, name).run()
@@ -0,0 +1,294 @@
+import sublime
+import os
+import re
+from threading import Lock
+from . import thread, settings
+
+HEAD_COMMAND = 'git rev-parse HEAD'
+GRAPH_COMMAND = 'git rev-parse --git-path objects/info/commit-graph --git-path objects/info/commit-graphs/commit-graph-chain'
+LOG_COMMAND = 'git log --stdin --date-order --format=%H%x1f%P%x1f%an%x1f%ar%x1f%s'
+FIELD_SEPARATOR = '\x1f'
+EDIT_COMMAND = 'arcinator_history_edit'
+VIEW_SETTING = 'arcinator_history'
+ROOT_SETTING = 'arcinator_history_root'
+HASH_MATCH = r'(?:^|\s)([0-9a-f]{10})\s'
+HASH_LENGTH = 10
+DEFAULT_PAGE_SIZE = 200
+MARGIN_PAGES = 1
+MAX_LANES = 24
+POLL_INTERVAL = 250
+
+
+def layout(lanes, commit_hash, parents):
+    """Places a commit in the lanes left by the rows above it, returns its graph cells and the lanes below it
+
+    Each lane holds the commit it is waiting for. A commit takes the first
+    lane waiting for it, other lanes waiting for it join it ("/"), its
+    first parent continues its lane and other parents open new lanes ("\\").
+    """
+    lanes = list(lanes)
+    joining = [index for index, lane in enumerate(lanes) if lane == commit_hash]
+    if len(joining) > 0:
+        column = joining[0]
+    elif None in lanes:
+        column = lanes.index(None)
+    else:
+        column = len(lanes)
+        lanes.append(None)
+    cells = ['|' if lane is not None else ' ' for lane in lanes]
+    for index in joining[1:]:
+        cells[index] = '/'
+        lanes[index] = None
+    cells[column] = '*'
+    lanes[column] = parents[0] if parents else None
+    for parent in parents[1:]:
+        if parent in lanes:
+            continue
+        free = [index for index, lane in enumerate(lanes) if lane is None and cells[index] == ' ']
+        if len(free) > 0:
+            index = free[0]
+        else:
+            index = len(lanes)
+            lanes.append(None)
+            cells.append(' ')
+        lanes[index] = parent
+        cells[index] = '\\'
+    while len(lanes) > 0 and lanes[-1] is None:
+        lanes.pop()
+    return cells, lanes
+
+
+def format_graph(cells, width):
+    """Draws the graph cells of a row, padded to the width of the widest row of its page"""
+    if len(cells) > MAX_LANES:
+        cells = cells[:MAX_LANES - 1] + ['~']
+    return ' '.join(cells).ljust(width * 2)
+
+
+def parse(raw):
+    """Parses the output of the log command into commits"""
+    commits = []
+    for line in raw.split('\n'):
+        fields = line.split(FIELD_SEPARATOR)
+        if len(fields) != 5:
+            continue
+        commits.append({
+            'hash': fields[0],
+            'parents': fields[1].split(),
+            'author': fields[2],
+            'date': fields[3],
+            'subject': fields[4]
+        })
+    return commits
+
+
+def page_size():
+    """Gets the number of commits loaded at a time"""
+    return max(int(settings.get('historyPageSize', DEFAULT_PAGE_SIZE)), 10)
+
+
+class History(object):
+    """A history view that only holds the pages of commits around its viewport
+
+    The lanes at the start of every page that has been laid out are kept.
+    They hold the commits the rows above are waiting for, which are the
+    commits the rest of the history starts from, so each page is read from
+    its lanes without walking the pages before it, and a page dropped from
+    the view can be loaded and laid out again on its own.
+    """
+    histories = {}
+    lock = Lock()
+
+    def __init__(self, view, root, head):
+        """Initializes a History object"""
+        self.view = view
+        self.root = root
+        self.head = head
+        self.size = page_size()
+        self.checkpoints = [[head]]
+        self.first = 0
+        self.last = -1
+        self.end = None
+        self.loading = False
+        self.closed = False
+
+    def load(self, index):
+        """Gets the rows of a page, laid out from the lanes its previous page left
+
+        Without a commit-graph, git log --date-order sorts every commit
+        reachable from the lanes before it prints the first one, so each page
+        costs a walk of the remaining history. The pages form a topological
+        order, but with small pages it can differ from the order of a single
+        git log --date-order.
+        """
+        lanes = self.checkpoints[index]
+        starts = []
+        for lane in lanes:
+            if lane is not None and lane not in starts:
+                starts.append(lane)
+        if len(starts) < 1:
+            return []
+        cmd = LOG_COMMAND + ' -n %d' % self.size
+        p = thread.Process('History', cmd, None, False, False, cwd=self.root, input_text=''.join(start + '\n' for start in starts))
+        commits = parse(p.output()) if p.returncode == 0 else []
+        graphs = []
+        for commit in commits:
+            cells, lanes = layout(lanes, commit['hash'], commit['parents'])
+            graphs.append(cells)
+        if index + 1 == len(self.checkpoints):
+            self.checkpoints.append(lanes)
+        width = min(max([len(cells) for cells in graphs] or [0]), MAX_LANES)
+        rows = []
+        for commit, cells in zip(commits, graphs):
+            rows.append('%s %s  %-14s %-18s %s' % (
+                format_graph(cells, width), commit['hash'][:HASH_LENGTH], commit['date'], commit['author'][:18], commit['subject']
+            ))
+        return rows
+
+    def line(self, index):
+        """Gets the first line of a loaded page in the view"""
+        return (index - self.first) * self.size
+
+    def edit(self, begin, end, text):
+        """Replaces a part of the view, without keeping the replaced text for undo where Sublime Text can clear it"""
+        self.view.run_command(EDIT_COMMAND, {'begin': begin, 'end': end, 'text': text})
+        if hasattr(self.view, 'clear_undo_stack'):
+            self.view.clear_undo_stack()
+
+    def shift_viewport(self, lines):
+        """Moves the viewport by a number of lines, to keep the same commits in view after editing above them"""
+        x, y = self.view.viewport_position()
+        self.view.set_viewport_position((x, max(y + lines * self.view.line_height(), 0)), False)
+
+    def add_page(self, index, rows):
+        """Adds a loaded page before or after the pages in the view"""
+        self.loading = False
+        if self.closed:
+            return
+        text = ''.join(row + '\n' for row in rows)
+        if index == self.last + 1:
+            if len(rows) > 0 or self.last < 0:
+                self.edit(self.view.size(), self.view.size(), text)
+                self.last = index
+            if len(rows) < self.size:
+                self.end = self.last
+        elif index == self.first - 1:
+            self.edit(0, 0, text)
+            self.first = index
+            self.shift_viewport(len(rows))
+        self.poll()
+
+    def drop_first(self):
+        """Removes the first page from the view"""
+        end = self.view.text_point(self.size, 0)
+        self.edit(0, end, '')
+        self.first += 1
+        self.shift_viewport(-self.size)
+
+    def drop_last(self):
+        """Removes the last page from the view"""
+        begin = self.view.text_point(self.line(self.last), 0)
+        self.edit(begin, self.view.size(), '')
+        self.last -= 1
+
+    def start_load(self, index):
+        """Loads a page in the background"""
+        self.loading = True
+        sublime.set_timeout_async(lambda: self.finish_load(index, self.load(index)), 0)
+
+    def finish_load(self, index, rows):
+        """Adds a page to the view on the main thread"""
+        sublime.set_timeout(lambda: self.add_page(index, rows), 0)
+
+    def wanted(self):
+        """Gets the first and last pages that should be in the view, the visible ones and a margin around them"""
+        region = self.view.visible_region()
+        top = self.view.rowcol(region.begin())[0]
+        bottom = self.view.rowcol(region.end())[0]
+        first = max(self.first + top // self.size - MARGIN_PAGES, 0)
+        last = self.first + bottom // self.size + MARGIN_PAGES
+        if self.end is not None:
+            last = min(last, self.end)
+        return first, last
+
+    def poll(self):
+        """Loads or drops one page to follow the viewport, returns True if it changed anything"""
+        if self.closed or self.loading:
+            return False
+        first, last = self.wanted()
+        if self.last < last and (self.end is None or self.last < self.end):
+            self.start_load(self.last + 1)
+        elif self.first > first:
+            self.start_load(self.first - 1)
+        elif self.first < first and self.first < self.last:
+            self.drop_first()
+        elif self.last > last and self.last > self.first:
+            self.drop_last()
+        else:
+            return False
+        return True
+
+    def watch(self):
+        """Follows the viewport until the view is closed"""
+        if self.closed:
+            return
+        if self.view.window() is None:
+            close(self.view)
+            return
+        self.poll()
+        sublime.set_timeout(self.watch, POLL_INTERVAL)
+
+
+def open_view(window, root):
+    """Opens a history view of the current branch of a repository"""
+    p = thread.Process('History', HEAD_COMMAND, None, False, False, cwd=root)
+    if p.returncode != 0:
+        sublime.status_message('No history in ' + root)
+        return None
+    view = window.new_file()
+    view.set_scratch(True)
+    view.set_name('History: ' + os.path.basename(root))
+    view.set_read_only(True)
+    view.settings().set(VIEW_SETTING, True)
+    view.settings().set(ROOT_SETTING, root)
+    view.settings().set('word_wrap', False)
+    view.settings().set('line_numbers', False)
+    if not has_commit_graph(root):
+        sublime.status_message('History is slow without a commit-graph, run "git commit-graph write --reachable" to speed it up')
+    history = History(view, root, p.output().strip())
+    with History.lock:
+        History.histories[view.id()] = history
+    history.watch()
+    return history
+
+
+def has_commit_graph(root):
+    """Checks if a repository has a commit-graph file or chain, which lets git log sort commits without walking all of them"""
+    p = thread.Process('History', GRAPH_COMMAND, None, False, False, cwd=root)
+    if p.returncode != 0:
+        return True
+    return any(os.path.isfile(os.path.join(root, path)) for path in p.output().split('\n') if path)
+
+
+def close(view):
+    """Stops following a history view that has been closed"""
+    with History.lock:
+        history = History.histories.pop(view.id(), None)
+    if history is not None:
+        history.closed = True
+
+
+def is_history(view):
+    """Checks if a view is a history view"""
+    return view is not None and bool(view.settings().get(VIEW_SETTING))
+
+
+def selected_commits(view):
+    """Gets the commits on the selected lines of a history view"""
+    commits = []
+    for region in view.sel():
+        for line in view.lines(region):
+            match = re.search(HASH_MATCH, view.substr(line))
+            if match is not None and match.group(1) not in commits:
+                commits.append(match.group(1))
+    return commits
@@ -0,0 +1,363 @@
+import os
+import re
+import hashlib
+import heapq
+import json
+import math
+import struct
+import time
+from threading import Lock
+from . import thread, util, settings, stats, sparse
+
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None
+
+SCHEMA_VERSION = 2
+SCHEMA = [
+    'CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)',
+    'CREATE TABLE IF NOT EXISTS commits (hash TEXT PRIMARY KEY, parents TEXT, author TEXT, date INTEGER, committed INTEGER, subject TEXT, body TEXT)',
+    'CREATE TABLE IF NOT EXISTS paths (hash TEXT, path TEXT)',
+    'CREATE INDEX IF NOT EXISTS paths_path ON paths (path)',
+    'CREATE INDEX IF NOT EXISTS paths_hash ON paths (hash)'
+]
+SEARCH_SCHEMA = 'CREATE VIRTUAL TABLE IF NOT EXISTS search USING fts4 (subject, body, author, paths)'
+
+# Weights of the search columns, in the same order as SEARCH_SCHEMA
+SEARCH_WEIGHTS = [4.0, 1.0, 2.0, 1.0]
+SEARCH_TOKEN = r'[^\W_]+'
+# Matches one token without full text search, the fields are joined with a separator so a token cannot span two of them
+SEARCH_LIKE = '(subject || char(31) || body || char(31) || author LIKE ? OR hash IN (SELECT hash FROM paths WHERE path LIKE ?))'
+
+HEAD_COMMAND = 'git rev-parse HEAD'
+CHECK_COMMAND = 'git cat-file --batch-check'
+INDEX_COMMAND = 'git -c core.quotepath=off log --name-only --format=%x1e%H%x1f%P%x1f%an%x1f%at%x1f%ct%x1f%s%x1f%b%x1d'
+RECORD_SEPARATOR = '\x1e'
+FIELD_SEPARATOR = '\x1f'
+PATHS_SEPARATOR = '\x1d'
+
+MAX_TIPS = 20
+
+
+class LogStore(object):
+    """An on-disk store of commit metadata for a single repository"""
+    stores = {}
+    stores_lock = Lock()
+
+    def __init__(self, root):
+        """Initializes a LogStore object"""
+        self.root = root
+        self.lock = Lock()
+        self.graph = None
+        self.searchable = False
+        name = hashlib.sha1(root.encode('utf-8')).hexdigest()
+        self.path = os.path.join(util.cache_dir('logs'), name + '.sqlite')
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+        self.db.create_function('rank', 1, rank)
+        self.create()
+
+    def create(self):
+        """Creates the tables, discarding the store if it uses an older schema"""
+        with self.lock:
+            for statement in SCHEMA:
+                self.db.execute(statement)
+            version = self.get_meta('version')
+            if version is not None and int(version) != SCHEMA_VERSION:
+                for table in ['commits', 'paths', 'meta', 'search']:
+                    self.db.execute('DROP TABLE IF EXISTS ' + table)
+                for statement in SCHEMA:
+                    self.db.execute(statement)
+            try:
+                self.db.execute(SEARCH_SCHEMA)
+                self.searchable = True
+            except sqlite3.OperationalError:
+                util.debug('full text search is not available in this version of sqlite')
+            self.set_meta('version', SCHEMA_VERSION)
+            self.set_meta('root', self.root)
+            self.db.commit()
+
+    def get_meta(self, key, default=None):
+        """Gets a value from the meta table"""
+        row = self.db.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row is not None else default
+
+    def set_meta(self, key, value):
+        """Sets a value in the meta table"""
+        self.db.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, str(value)))
+
+    def head(self):
+        """Gets the commit currently checked out"""
+        p = thread.Process('Log Index', HEAD_COMMAND, None, False, False, cwd=self.root)
+        if p.returncode != 0:
+            return None
+        return p.output().strip()
+
+    def update(self):
+        """Indexes the commits that are reachable from HEAD and not yet in the store"""
+        head = self.head()
+        if head is None:
+            return None
+        with self.lock:
+            tips = json.loads(self.get_meta('tips', '[]'))
+        if head in tips:
+            return head
+        tips = self.existing(tips)
+        if tips is None:
+            return None
+        started = time.time()
+        cmd = INDEX_COMMAND + ' ' + head
+        if sparse.is_partial(self.root):
+            cmd = cmd + ' --no-renames'
+        if len(tips) > 0:
+            cmd = cmd + ' --not ' + ' '.join(tips)
+        p = thread.Process('Log Index', cmd, None, False, False, cwd=self.root)
+        if p.returncode != 0:
+            return None
+        commits = self.parse(p.output())
+        with self.lock:
+            self.insert(commits)
+            tips = [head] + tips[:MAX_TIPS - 1]
+            self.set_meta('tips', json.dumps(tips))
+            self.db.commit()
+        stats.record('Log Index', os.path.basename(self.root), time.time() - started)
+        util.debug('indexed %d new commits in %s' % (len(commits), self.root))
+        return head
+
+    def existing(self, tips):
+        """Drops the tips that were pruned, as git log fails on a missing commit after --not"""
+        if len(tips) < 1:
+            return tips
+        p = thread.Process('Log Index', CHECK_COMMAND, None, False, False, cwd=self.root, input_text='\n'.join(tips) + '\n')
+        if p.returncode != 0:
+            return None
+        found = set(line.split(' ')[0] for line in p.output().split('\n') if line and not line.endswith(' missing'))
+        pruned = [tip for tip in tips if tip not in found]
+        if len(pruned) > 0:
+            util.debug('dropping pruned log index tips ' + ' '.join(pruned))
+            tips = [tip for tip in tips if tip in found]
+            with self.lock:
+                self.set_meta('tips', json.dumps(tips))
+                self.db.commit()
+        return tips
+
+    def parse(self, raw):
+        """Parses the output of the index command"""
+        commits = []
+        for record in raw.split(RECORD_SEPARATOR):
+            header, separator, paths = record.partition(PATHS_SEPARATOR)
+            fields = header.split(FIELD_SEPARATOR)
+            if len(fields) < 7:
+                continue
+            commit_hash, parents, author, date, committed, subject, body = fields[:7]
+            commits.append({
+                'hash': commit_hash,
+                'parents': parents,
+                'author': author,
+                'date': int(date),
+                'committed': int(committed),
+                'subject': subject,
+                'body': body.strip(),
+                'paths': [line for line in paths.split('\n') if line]
+            })
+        return commits
+
+    def insert(self, commits):
+        """Adds parsed commits to the store"""
+        for commit in commits:
+            cursor = self.db.execute(
+                'INSERT OR IGNORE INTO commits (hash, parents, author, date, committed, subject, body) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (commit['hash'], commit['parents'], commit['author'], commit['date'], commit['committed'], commit['subject'], commit['body'])
+            )
+            if cursor.rowcount < 1:
+                continue
+            self.db.executemany(
+                'INSERT INTO paths (hash, path) VALUES (?, ?)',
+                [(commit['hash'], path) for path in commit['paths']]
+            )
+            if self.searchable:
+                self.db.execute(
+                    'INSERT INTO search (docid, subject, body, author, paths) VALUES (?, ?, ?, ?, ?)',
+                    (cursor.lastrowid, commit['subject'], commit['body'], commit['author'], ' '.join(commit['paths']))
+                )
+            if self.graph is not None:
+                self.graph[commit['hash']] = (commit['committed'], commit['parents'].split())
+
+    def load_graph(self):
+        """Loads the commit graph into memory for walking history"""
+        if self.graph is None:
+            graph = {}
+            for commit_hash, committed, parents in self.db.execute('SELECT hash, committed, parents FROM commits'):
+                graph[commit_hash] = (committed, parents.split())
+            self.graph = graph
+        return self.graph
+
+    def relative_paths(self, paths):
+        """Converts paths to paths relative to the root, None means the whole repository"""
+        if not paths:
+            return None
+        relative = []
+        for path in paths:
+            path = os.path.relpath(os.path.abspath(path), self.root).replace(os.sep, '/')
+            if path == '.':
+                return None
+            relative.append(path)
+        return relative
+
+    def touching(self, paths):
+        """Gets the hashes of the commits that touched any of the paths"""
+        hashes = set()
+        for path in paths:
+            rows = self.db.execute(
+                'SELECT hash FROM paths WHERE path = ? OR (path >= ? AND path < ?)',
+                (path, path + '/', path + '0')
+            )
+            hashes.update(row[0] for row in rows)
+        return hashes
+
+    def walk(self, head, limit, skip=0, paths=None):
+        """Gets hashes reachable from head, newest first, like git log"""
+        graph = self.load_graph()
+        paths = self.relative_paths(paths)
+        touching = self.touching(paths) if paths is not None else None
+        found = []
+        seen = set([head])
+        queue = []
+        if head in graph:
+            queue.append((-graph[head][0], head))
+        while queue and len(found) < skip + limit:
+            committed, commit_hash = heapq.heappop(queue)
+            if touching is None or commit_hash in touching:
+                found.append(commit_hash)
+            for parent in graph[commit_hash][1]:
+                if parent in seen or parent not in graph:
+                    continue
+                seen.add(parent)
+                heapq.heappush(queue, (-graph[parent][0], parent))
+        return found[skip:]
+
+    def commits(self, hashes):
+        """Gets the metadata of a list of commits, in the same order"""
+        rows = {}
+        for start in range(0, len(hashes), 500):
+            chunk = hashes[start:start + 500]
+            query = 'SELECT hash, author, date, subject FROM commits WHERE hash IN (%s)' % ','.join('?' * len(chunk))
+            for row in self.db.execute(query, chunk):
+                rows[row[0]] = {
+                    'hash': row[0],
+                    'author': row[1],
+                    'date': row[2],
+                    'subject': row[3]
+                }
+        return [rows[commit_hash] for commit_hash in hashes if commit_hash in rows]
+
+    def log(self, limit, skip=0, paths=None):
+        """Gets the log of the current branch, optionally limited to paths"""
+        head = self.update()
+        if head is None:
+            return None
+        with self.lock:
+            return self.commits(self.walk(head, limit, skip, paths))
+
+    def touched(self, path, limit=100):
+        """Gets the commits that touched a path, newest first"""
+        paths = self.relative_paths([path])
+        if paths is None:
+            return self.log(limit)
+        self.update()
+        with self.lock:
+            commits = self.commits(list(self.touching(paths)))
+        commits.sort(key=lambda commit: commit['date'], reverse=True)
+        return commits[:limit]
+
+    def search(self, text, limit=50):
+        """Searches subjects, bodies, authors and paths, best matches first, returns None if the search fails"""
+        tokens = re.findall(SEARCH_TOKEN, text)
+        if len(tokens) < 1:
+            return []
+        self.update()
+        with self.lock:
+            try:
+                if self.searchable:
+                    rows = self.db.execute(
+                        'SELECT commits.hash FROM search JOIN commits ON commits.rowid = search.docid '
+                        'WHERE search MATCH ? ORDER BY rank(matchinfo(search, \'pcnx\')) DESC, commits.committed DESC LIMIT ?',
+                        (match_query(tokens), limit)
+                    )
+                else:
+                    where = ' AND '.join([SEARCH_LIKE] * len(tokens))
+                    parameters = []
+                    for token in tokens:
+                        parameters.extend(['%' + token + '%'] * 2)
+                    rows = self.db.execute(
+                        'SELECT hash FROM commits WHERE ' + where + ' ORDER BY committed DESC LIMIT ?',
+                        parameters + [limit]
+                    )
+                return self.commits([row[0] for row in rows])
+            except sqlite3.OperationalError as e:
+                util.debug('could not search for %s: %s' % (text, e))
+                return None
+
+    def count(self, text):
+        """Counts the commits that match a search"""
+        tokens = re.findall(SEARCH_TOKEN, text)
+        if len(tokens) < 1 or not self.searchable:
+            return 0
+        with self.lock:
+            try:
+                return self.db.execute('SELECT count(*) FROM search WHERE search MATCH ?', (match_query(tokens),)).fetchone()[0]
+            except sqlite3.OperationalError as e:
+                util.debug('could not count matches of %s: %s' % (text, e))
+                return 0
+
+    def paths(self, commit_hash):
+        """Gets the paths touched by a commit"""
+        with self.lock:
+            return [row[0] for row in self.db.execute('SELECT path FROM paths WHERE hash = ?', (commit_hash,))]
+
+    def close(self):
+        """Closes the database"""
+        with self.lock:
+            self.db.close()
+
+
+def match_query(tokens):
+    """Builds a full text query that matches every token as a prefix, quoted so words like OR and NEAR are not operators"""
+    return ' '.join('"' + token.replace('"', '""') + '*"' for token in tokens)
+
+
+def rank(info):
+    """Scores a full text match from its matchinfo('pcnx') blob, weighting each column"""
+    values = struct.unpack('@%dI' % (len(info) // 4), info)
+    phrases, columns, rows = values[:3]
+    score = 0.0
+    for phrase in range(phrases):
+        for column in range(columns):
+            offset = 3 + (phrase * columns + column) * 3
+            hits, total, documents = values[offset:offset + 3]
+            if hits > 0:
+                score += SEARCH_WEIGHTS[column] * hits * math.log(1.0 + float(rows) / documents)
+    return score
+
+
+def available():
+    """Checks if the commit store can be used"""
+    return sqlite3 is not None and settings.get('logIndex', True)
+
+
+def get(root):
+    """Gets the commit store for a repository"""
+    if root is None or not available():
+        return None
+    with LogStore.stores_lock:
+        if root not in LogStore.stores:
+            LogStore.stores[root] = LogStore(root)
+        return LogStore.stores[root]
+
+
+def close_all():
+    """Closes every open store"""
+    with LogStore.stores_lock:
+        for store in LogStore.stores.values():
+            store.close()
+        LogStore.stores = {}
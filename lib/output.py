@@ -1,44 +1,77 @@
 import sublime
 import sublime_plugin
+import os
 import re
+import time
+import threading
+from threading import Lock
+from bisect import bisect_left, bisect_right
 from . import util, settings
 
 VIEW_NAME = 'Arcinator Output'
 PANEL_ID = 'arcinator-output'
 SYNTAX = 'Packages/Arcinator/languages/Arcinator Output.hidden-tmLanguage'
 INDENT_LEVEL = 4
-
-# CONFLICTS_MATCH = r"^ +C .*?$"
-# CONFLICTS_GUTTER_KEY = "svn-conflicts"
-# CONFLICTS_SCOPE = "message.error"
+PROGRESS_INTERVAL = 0.2
+FLUSH_INTERVAL = 50
+DEFAULT_CHANNEL_DELAY = -1
+LINE_BREAK = r'\r\n|\n|\r'
+
+CONFLICTS_MATCH = r"^ +((?:UU|AA|DD|AU|UA|DU|UD) .*|CONFLICT .*)$"
+CONFLICTS_GUTTER_KEY = "arcinator-conflicts"
+CONFLICTS_SCOPE = "message.error"
+ERRORS_MATCH = r"^ +((?:error|fatal): .*)$"
+ERRORS_GUTTER_KEY = "arcinator-errors"
+ERRORS_SCOPE = "invalid"
+HIGHLIGHT_INTERVAL = 100
+
+UNIX_PATH = r"/[^\n'\"]*"
+NT_PATH = r"[A-Za-z]:\\[^\n'\"]*"
+PATH_MATCH = NT_PATH if os.name == 'nt' else UNIX_PATH
+COMMAND_PREFIX = 'Command: '
+EXISTS_TIMEOUT = 10
 
 MESSAGE_COMMAND = 'arcinator_view_message'
 CLEAR_COMMAND = 'arcinator_view_clear'
+PROGRESS_KEY = 'arcinator-progress'
+
+UNDERLINE_FLAGS = sublime.DRAW_NO_FILL | sublime.DRAW_NO_OUTLINE | sublime.DRAW_EMPTY_AS_OVERWRITE
 
-# UNDERLINE_FLAGS = sublime.DRAW_NO_FILL | sublime.DRAW_NO_OUTLINE | sublime.DRAW_EMPTY_AS_OVERWRITE
+CONFLICT_HIGHLIGHTS = {
+    'outline': sublime.DRAW_NO_FILL,
+    'fill': sublime.DRAW_NO_OUTLINE,
+    'solid': sublime.DRAW_SOLID_UNDERLINE | UNDERLINE_FLAGS,
+    'squiggly': sublime.DRAW_SQUIGGLY_UNDERLINE | UNDERLINE_FLAGS,
+    'stippled': sublime.DRAW_STIPPLED_UNDERLINE | UNDERLINE_FLAGS,
+    'none': sublime.HIDDEN
+}
 
-# CONFLICT_HIGHLIGHTS = {
-#     'outline': sublime.DRAW_NO_FILL,
-#     'fill': sublime.DRAW_NO_OUTLINE,
-#     'solid': sublime.DRAW_SOLID_UNDERLINE | UNDERLINE_FLAGS,
-#     'squiggly': sublime.DRAW_SQUIGGLY_UNDERLINE | UNDERLINE_FLAGS,
-#     'stippled': sublime.DRAW_STIPPLED_UNDERLINE | UNDERLINE_FLAGS,
-#     'none': sublime.HIDDEN
-# }
+HIGHLIGHTS = [
+    (CONFLICTS_GUTTER_KEY, CONFLICTS_MATCH, CONFLICTS_SCOPE),
+    (ERRORS_GUTTER_KEY, ERRORS_MATCH, ERRORS_SCOPE)
+]
 
 
 class OutputView:
-    """Handles the Output view/panel"""
-    buffer = ""
-    view = None
-    panel = None
-
-    def find_existing_view():
-        """Finds a view that matches the signature of an Output view"""
-        if OutputView.view:
-            return OutputView.view
-        views = sublime.active_window().views()
-        for view in views:
+    """Handles the Output view/panel of each window"""
+    views = {}
+    panels = {}
+    dialogs = {}
+
+    def get_window(window=None):
+        """Gets a window that is still open, the active window when window is None or has been closed"""
+        if window is not None:
+            for open_window in sublime.windows():
+                if open_window.id() == window.id():
+                    return window
+        return sublime.active_window()
+
+    def find_existing_view(window):
+        """Finds a view of a window that matches the signature of an Output view"""
+        view = OutputView.views.get(window.id())
+        if view:
+            return view
+        for view in window.views():
             if (
                 view.name() == VIEW_NAME
                 and view.is_read_only()
@@ -47,106 +80,414 @@ class OutputView:
                 return view
         return None
 
-    def get_existing():
+    def get_existing(window=None):
         """Gets a view if one exists, does not create one if it does not"""
+        window = OutputView.get_window(window)
         output = settings.get("outputTo", "panel")
         if output == "tab":
-            return OutputView.find_existing_view()
-        if output == "panel" and OutputView.panel:
-            return OutputView.panel
+            return OutputView.find_existing_view(window)
+        if output == "panel":
+            return OutputView.panels.get(window.id())
         return None
 
-    def get():
+    def is_output(view):
+        """Checks if a view is the Output view of its window or the view of a channel"""
+        if view is None:
+            return False
+        if view == OutputView.get_existing(view.window()):
+            return True
+        return any(channel.view == view for channel in Channel.channels())
+
+    def get(window=None):
         """Gets a view or panel for output, creates one if none available"""
+        window = OutputView.get_window(window)
         output = settings.get("outputTo", "panel")
         if output == "dialog":
             return None
         if output == "tab":
-            if OutputView.view is None or OutputView.view.window() is None:
-                OutputView.view = None
-                view = OutputView.find_existing_view()
+            view = OutputView.views.get(window.id())
+            if view is None or view.window() is None:
+                view = OutputView.find_existing_view(window)
                 if view is None:
-                    view = sublime.active_window().new_file()
-                    view.set_scratch(True)
-                    view.set_name(VIEW_NAME)
-                    view.set_read_only(True)
-                view.set_syntax_file(SYNTAX)
-                OutputView.view = view
-            return OutputView.view
-        if OutputView.panel is None:
-            panel = sublime.active_window().create_output_panel(PANEL_ID)
+                    view = new_view(window, VIEW_NAME)
+                else:
+                    view.set_syntax_file(SYNTAX)
+                OutputView.views[window.id()] = view
+            return view
+        panel = OutputView.panels.get(window.id())
+        if panel is None:
+            panel = window.create_output_panel(PANEL_ID)
             panel.set_syntax_file(SYNTAX)
-            OutputView.panel = panel
-        sublime.active_window().run_command(
+            OutputView.panels[window.id()] = panel
+        window.run_command(
             'show_panel',
             {
                 'panel': 'output.' + PANEL_ID
             }
         )
-        return OutputView.panel
+        return panel
 
-    def message(message):
-        """Sends a message to the output"""
-        output = settings.get("outputTo", "panel")
-        if output == "dialog":
-            OutputView.buffer = OutputView.buffer + message + "\n"
-            return
-        view = OutputView.get()
+    def message(message, progress=False, window=None):
+        """Sends a message to the output, progress messages are replaced by the next message"""
+        view = OutputView.get(window)
         if view is None:
             return
-        msg = re.sub(r'\r\n?', '\n', message)
-        view.run_command(
-            MESSAGE_COMMAND,
-            {
-                "message": msg
-            }
-        )
+        write(view, message, progress)
         if settings.get('outputScrollTo') == "bottom":
-            OutputView.scroll_bottom_to_visible()
+            view.show(view.size(), False)
+
+    def add_dialog(message, window=None):
+        """Buffers a message for the next output dialog of a window"""
+        window = OutputView.get_window(window)
+        OutputView.dialogs[window.id()] = OutputView.dialogs.get(window.id(), '') + message + '\n'
 
-    def clear():
+    def show_dialog(window=None):
+        """Shows the messages buffered for a window in one dialog"""
+        window = OutputView.get_window(window)
+        text = OutputView.dialogs.pop(window.id(), '')
+        if text:
+            sublime.message_dialog(text)
+
+    def clear(window=None):
         """Clears the output view"""
-        view = OutputView.get()
+        view = OutputView.get(window)
         if view is None:
             return
         view.run_command(CLEAR_COMMAND)
 
-    def end():
-        """Sends the end signal to the output"""
-        output = settings.get("outputTo", "panel")
-        if output == "dialog":
-            sublime.message_dialog(OutputView.buffer)
-        OutputView.buffer = ""
-        OutputView.message(indent("Completed\n"))
-
-    def focus():
+    def focus(window=None):
         """Brings the output view into focus"""
-        view = OutputView.get()
+        view = OutputView.get(window)
         if view is None:
             return
         view.window().focus_view(view)
 
-    def scroll_to_bottom():
+    def scroll_to_bottom(window=None):
         """Scrolls the bottom of the view to the top of the viewport"""
-        view = OutputView.get()
+        view = OutputView.get(window)
         if view is None:
             return
         point = view.text_to_layout(view.size())
         view.set_viewport_position(point, True)
 
-    def scroll_bottom_to_visible():
-        """Scrolls the bottom of the view into visible space"""
-        view = OutputView.get()
-        if view is None:
-            return
-        view.show(view.size(), False)
-
     def close(view):
         """Stop using the view if it has been closed"""
-        if view == OutputView.view:
-            OutputView.view = None
-        if view == OutputView.panel:
-            OutputView.panel = None
+        Highlighter.views.pop(view.id(), None)
+        PathIndex.views.pop(view.id(), None)
+        for views in (OutputView.views, OutputView.panels):
+            for key in [key for key, value in views.items() if value == view]:
+                del views[key]
+        for channel in Channel.channels():
+            if channel.view == view:
+                channel.view = None
+
+
+def new_view(window, name):
+    """Creates a read only scratch view for output"""
+    view = window.new_file()
+    view.set_scratch(True)
+    view.set_name(name)
+    view.set_read_only(True)
+    view.set_syntax_file(SYNTAX)
+    return view
+
+
+def write(view, message, progress=False):
+    """Adds a message to the end of a view"""
+    view.run_command(
+        MESSAGE_COMMAND,
+        {
+            "message": re.sub(r'\r\n?', '\n', message),
+            "progress": progress
+        }
+    )
+
+
+class Channel(object):
+    """The output of one command, buffered as it runs and written to the window that started it
+
+    The Output view of a window shows one channel at a time, in the order
+    they started, so the sections of concurrent commands never interleave.
+    The first channel streams into the view while the others are buffered
+    and written in one piece when it ends. With the outputChannelDelay
+    setting, a channel that waits for longer also streams into a view of its
+    own, which is closed once the channel has been written to the Output view.
+    """
+    queues = {}
+    local = threading.local()
+    lock = Lock()
+    scheduled = False
+
+    def __init__(self, name=None, cmd=None, window=None, owner=None):
+        """Initializes a Channel object, a section of its own when it has a name, a single message otherwise
+
+        The owner is the thread that writes the channel, the current thread by
+        default. A channel whose owner has stopped without ending it is ended
+        when it is flushed, so it cannot hold up the channels after it.
+        """
+        self.window = window or sublime.active_window()
+        self.name = name
+        self.owner = owner or threading.current_thread()
+        self.items = []
+        self.written = 0
+        self.view = None
+        self.view_written = 0
+        self.started = time.time()
+        self.ended = name is None
+        self.finished = False
+        self.queued = False
+        self.lock = Lock()
+        if name is not None:
+            self.add(COMMAND_PREFIX + name, kind='command')
+            if settings.get("outputRawCommand") and cmd is not None:
+                self.add(indent(cmd))
+
+    def channels():
+        """Gets every channel that has not been written in full"""
+        with Channel.lock:
+            return [channel for queue in Channel.queues.values() for channel in queue]
+
+    def add(self, message, progress=False, kind=None):
+        """Buffers a message, replacing a progress message that has not been written yet
+
+        A channel joins the queue of its window with its first message, so a
+        single message channel is never flushed before it has its message.
+        """
+        with self.lock:
+            if self.finished:
+                return
+            last = len(self.items) - 1
+            if last >= max(self.written, self.view_written) and self.items[last][1]:
+                del self.items[last]
+            self.items.append((message, progress, kind))
+            queue = not self.queued
+            self.queued = True
+        if queue:
+            with Channel.lock:
+                Channel.queues.setdefault(self.window.id(), []).append(self)
+        Channel.schedule(FLUSH_INTERVAL)
+
+    def add_message(self, message):
+        """Add a message to output"""
+        self.add(message)
+
+    def add_files(self, paths=None):
+        """Add a list of files to output"""
+        if paths is None:
+            return
+        s = paths
+        if isinstance(paths, list):
+            s = "\n".join(paths)
+        self.add(indent("Files:\n" + indent(s)))
+
+    def add_files_section(self):
+        """Adds a files section to output"""
+        self.add(indent("Files:"))
+
+    def add_result(self, result):
+        """Adds results to output"""
+        if result:
+            self.add(indent("Output:\n" + indent(result)))
+
+    def add_result_section(self):
+        """Opens a result section in output"""
+        self.add(indent("Output:"))
+
+    def add_result_message(self, result):
+        """Adds a result message to output"""
+        self.add(indent(result, INDENT_LEVEL * 2))
+
+    def add_result_progress(self, result):
+        """Adds a result message to output that is replaced by the next message"""
+        self.add(indent(result, INDENT_LEVEL * 2), True)
+
+    def add_error(self, err, code=None):
+        """Adds errors to output"""
+        if err:
+            self.add(indent("Error: " + str(code if code is not None else "") + "\n" + indent(err)))
+
+    def add_error_section(self, code=None):
+        """Opens an error section in output"""
+        self.add(indent("Error: " + str(code if code is not None else "")))
+
+    def end(self):
+        """Ends the section, which lets the next channel of the window write"""
+        self.add(indent("Completed\n"))
+        with self.lock:
+            self.ended = True
+
+    def is_abandoned(self):
+        """Checks if the owner of the channel has stopped without ending it"""
+        return not self.ended and self.owner.ident is not None and not self.owner.is_alive()
+
+    def pending(self, start):
+        """Gets the buffered messages from an index on, and whether the channel has ended"""
+        with self.lock:
+            return self.items[start:], self.ended
+
+    def trim(self):
+        """Drops the messages every view has written"""
+        with self.lock:
+            done = self.written if self.view is None else min(self.written, self.view_written)
+            if done > 0:
+                del self.items[:done]
+                self.written -= done
+                self.view_written = max(self.view_written - done, 0)
+
+    def write_output(self):
+        """Writes the buffered messages to the Output view of the window, returns True once the channel has ended"""
+        items, ended = self.pending(self.written)
+        if settings.get("outputTo", "panel") == "dialog":
+            if ended:
+                self.written += len(items)
+                for message, progress, kind in items:
+                    if not progress:
+                        OutputView.add_dialog(message, self.window)
+                if self.name is not None:
+                    OutputView.show_dialog(self.window)
+            return ended
+        for message, progress, kind in items:
+            if kind == 'command':
+                OutputView.focus(self.window)
+                if settings.get('outputScrollTo', default="command") == "command":
+                    OutputView.scroll_to_bottom(self.window)
+            OutputView.message(message, progress, self.window)
+        self.written += len(items)
+        return ended
+
+    def write_view(self):
+        """Writes the buffered messages to the view of the channel, opening it once the channel has waited long enough"""
+        if self.view is None:
+            delay = settings.get('outputChannelDelay', DEFAULT_CHANNEL_DELAY)
+            if delay < 0 or self.ended or time.time() - self.started < delay or settings.get("outputTo", "panel") == "dialog":
+                return
+            window = OutputView.get_window(self.window)
+            active = window.active_view()
+            self.view = new_view(window, VIEW_NAME + ': ' + self.name)
+            self.view_written = 0
+            if active is not None:
+                window.focus_view(active)
+        items, ended = self.pending(self.view_written)
+        for message, progress, kind in items:
+            write(self.view, message, progress)
+        self.view_written += len(items)
+        if len(items) > 0:
+            self.view.show(self.view.size(), False)
+
+    def close_view(self):
+        """Closes the view of the channel, once the Output view has all of its messages"""
+        view = self.view
+        self.view = None
+        window = view.window() if view is not None else None
+        if window is None:
+            return
+        active = window.active_view()
+        window.focus_view(view)
+        window.run_command('close_file')
+        if active is not None and active != view:
+            window.focus_view(active)
+
+    def flush():
+        """Writes the buffered channels of every window, called on the main thread"""
+        with Channel.lock:
+            Channel.scheduled = False
+            queues = [(key, list(queue)) for key, queue in Channel.queues.items()]
+        delay = settings.get('outputChannelDelay', DEFAULT_CHANNEL_DELAY)
+        waiting = False
+        for key, queue in queues:
+            for channel in queue:
+                if channel.is_abandoned():
+                    util.debug('ending the output of ' + str(channel.name) + ', its thread has stopped')
+                    channel.end()
+            while len(queue) > 0 and queue[0].write_output():
+                channel = queue.pop(0)
+                channel.close_view()
+                channel.finished = True
+            for channel in queue[1:]:
+                channel.write_view()
+                waiting = waiting or (channel.view is None and not channel.ended)
+            for channel in queue:
+                channel.trim()
+            with Channel.lock:
+                Channel.queues[key] = [channel for channel in Channel.queues[key] if not channel.finished]
+                if len(Channel.queues[key]) < 1:
+                    del Channel.queues[key]
+        if waiting and delay >= 0:
+            Channel.schedule(int(delay * 1000))
+
+    def schedule(delay):
+        """Flushes the channels on the main thread after a delay, unless a flush is already due"""
+        with Channel.lock:
+            if Channel.scheduled:
+                return
+            Channel.scheduled = True
+        sublime.set_timeout(Channel.flush, delay)
+
+
+class ProgressStream(object):
+    """Splits streamed text into lines, collapsing carriage return updates into one line"""
+
+    def __init__(self, on_line, on_progress=None, interval=PROGRESS_INTERVAL):
+        """Initializes a ProgressStream object"""
+        self.on_line = on_line
+        self.on_progress = on_progress
+        self.interval = interval
+        self.pending = ''
+        self.current = None
+        self.last_progress = 0
+
+    def feed(self, text):
+        """Adds streamed text"""
+        self.pending = self.pending + text
+        while True:
+            match = re.search(LINE_BREAK, self.pending)
+            if match is None:
+                break
+            if match.group(0) == '\r' and match.end() == len(self.pending):
+                # could be the first half of a \r\n split between two chunks
+                break
+            segment = self.pending[:match.start()]
+            self.pending = self.pending[match.end():]
+            if match.group(0) == '\r':
+                if segment:
+                    self.current = segment
+                self.progress()
+                continue
+            if segment or self.current is None:
+                line = segment
+            else:
+                line = self.current
+            self.current = None
+            self.on_line(line)
+
+    def progress(self):
+        """Reports the current state of a progress line, at most once per interval"""
+        if self.on_progress is None or self.current is None:
+            return
+        now = time.time()
+        if now - self.last_progress < self.interval:
+            return
+        self.last_progress = now
+        self.on_progress(self.current)
+
+    def close(self):
+        """Reports the final state of any unfinished line"""
+        text = self.pending.rstrip('\r')
+        self.pending = ''
+        if text:
+            self.current = text
+        if self.current is not None:
+            self.on_line(self.current)
+            self.current = None
+
+
+def collapse_progress(text):
+    """Keeps only the final state of each carriage return progress line in a block of text"""
+    lines = []
+    stream = ProgressStream(lines.append)
+    stream.feed(text)
+    stream.close()
+    return '\n'.join(lines)
 
 
 def indent(text="", spaces=INDENT_LEVEL):
@@ -154,111 +495,225 @@ def indent(text="", spaces=INDENT_LEVEL):
     return " " * spaces + re.sub(r'\n', '\n' + " " * spaces, text)
 
 
+def channel(name=None, cmd=None, window=None, owner=None):
+    """Starts the output channel of a command, written to the window that started it"""
+    return Channel(name, cmd, window, owner)
+
+
+def current():
+    """Gets the channel of the command the current thread writes, a single message channel outside of commands"""
+    current_channel = getattr(Channel.local, 'channel', None)
+    if current_channel is None or current_channel.ended:
+        return Channel()
+    return current_channel
+
+
 def add_message(message):
     """Add a message to output"""
-    OutputView.message(message)
+    current().add_message(message)
 
 
-def add_command(name, cmd=None):
-    """Adds a named command to output"""
-    OutputView.focus()
-    if settings.get('outputScrollTo', default="command") == "command":
-        OutputView.scroll_to_bottom()
-    add_message("Command: " + name)
-    if settings.get("outputRawCommand") and cmd is not None:
-        add_message(indent(cmd))
+def add_command(name, cmd=None, window=None):
+    """Starts the channel of a named command on the current thread"""
+    Channel.local.channel = Channel(name, cmd, window)
 
 
 def add_files(paths=None):
     """Add a list of files to output"""
-    if paths is None:
-        return
-    s = paths
-    if isinstance(paths, list):
-        s = "\n".join(paths)
-    add_message(indent("Files:\n" + indent(s)))
+    current().add_files(paths)
 
 
 def add_files_section():
     """Adds a files section to output"""
-    add_message(indent("Files:"))
+    current().add_files_section()
 
 
 def add_result(result):
     """Adds results to output"""
-    if result:
-        add_message(indent("Output:\n" + indent(result)))
+    current().add_result(result)
 
 
 def add_result_section():
     """Opens a result section in output"""
-    add_message(indent("Output:"))
+    current().add_result_section()
 
 
 def add_result_message(result):
     """Adds a result message to output"""
-    add_message(indent(result, INDENT_LEVEL * 2))
+    current().add_result_message(result)
+
+
+def add_result_progress(result):
+    """Adds a result message to output that is replaced by the next message"""
+    current().add_result_progress(result)
 
 
 def add_error(err, code=None):
     """Adds errors to output"""
-    if err:
-        add_message(indent("Error: " + str(code if code is not None else "") + "\n" + indent(err)))
+    current().add_error(err, code)
 
 
 def add_error_section(code=None):
     """Opens an error section in output"""
-    add_message(indent("Error: " + str(code if code is not None else "")))
+    current().add_error_section(code)
 
 
 def end_command():
     """Ends a command in output"""
-    OutputView.end()
+    current().end()
+    Channel.local.channel = None
 
 
-def clear():
+def clear(window=None):
     """Clears the output view"""
-    OutputView.clear()
-
-
-# def highlight_conflicts():
-#     """Highlights the conflicted files found in commands"""
-#     gutter = settings.get("outputGutter", "circle")
-#     highlight = settings.get("outputHighlight", "none")
-#     if gutter == "none" and highlight == "none":
-#         return
-
-#     if highlight in CONFLICT_HIGHLIGHTS:
-#         style = CONFLICT_HIGHLIGHTS[highlight]
-#     else:
-#         style = CONFLICT_HIGHLIGHTS["none"]
-
-#     view = OutputView.get()
-#     region = sublime.Region(0, view.size())
-#     contents = view.substr(region)
-#     size = 0
-#     regions = []
-
-#     lines = contents.split("\n")
-#     for line in lines:
-#         m = re.match(CONFLICTS_MATCH, line)
-#         if m:
-#             region = sublime.Region(size + 8, size + len(line))
-#             regions.append(region)
-#         size = size + len(line) + 1
-
-#     if gutter is "none":
-#         view.add_regions(
-#             CONFLICTS_GUTTER_KEY,
-#             regions,
-#             CONFLICTS_SCOPE,
-#             flags=style | sublime.PERSISTENT
-#         )
-#     else:
-#         view.add_regions(
-#             CONFLICTS_GUTTER_KEY,
-#             regions,
-#             CONFLICTS_SCOPE,
-#             gutter,
-#             flags=style | sublime.PERSISTENT
-#         )
+    OutputView.clear(window)
+
+
+class Highlighter(object):
+    """Highlights conflicts and errors in the text appended to an output view"""
+    views = {}
+
+    def __init__(self, view):
+        """Initializes a Highlighter object"""
+        self.view = view
+        self.regions = dict((key, []) for key, match, scope in HIGHLIGHTS)
+        self.dirty = False
+        self.flush_queued = False
+
+    def scan(self, start, end):
+        """Finds the conflicts and errors in newly appended text"""
+        text = self.view.substr(sublime.Region(start, end))
+        for key, match, scope in HIGHLIGHTS:
+            for m in re.finditer(match, text, re.M):
+                self.regions[key].append(sublime.Region(start + m.start(1), start + m.end(1)))
+                self.dirty = True
+        if self.dirty and not self.flush_queued:
+            self.flush_queued = True
+            sublime.set_timeout(self.flush, HIGHLIGHT_INTERVAL)
+
+    def flush(self):
+        """Adds all of the regions found since the last flush to the view"""
+        self.flush_queued = False
+        if not self.dirty:
+            return
+        self.dirty = False
+        gutter = settings.get("outputGutter", "circle")
+        highlight = settings.get("outputHighlight", "none")
+        if gutter == "none" and highlight == "none":
+            return
+        style = CONFLICT_HIGHLIGHTS.get(highlight, CONFLICT_HIGHLIGHTS["none"])
+        for key, match, scope in HIGHLIGHTS:
+            if gutter == "none":
+                self.view.add_regions(key, self.regions[key], scope, flags=style | sublime.PERSISTENT)
+            else:
+                self.view.add_regions(key, self.regions[key], scope, gutter, flags=style | sublime.PERSISTENT)
+
+    def clear(self):
+        """Forgets all of the highlighted regions"""
+        for key in self.regions:
+            self.regions[key] = []
+            self.view.erase_regions(key)
+        self.dirty = False
+
+
+def highlight_conflicts(view, start, end):
+    """Highlights the conflicts and errors in text appended to an output view"""
+    highlighter = Highlighter.views.get(view.id())
+    if highlighter is None:
+        highlighter = Highlighter(view)
+        Highlighter.views[view.id()] = highlighter
+    highlighter.scan(start, end)
+
+
+def clear_highlights(view):
+    """Removes the conflict and error highlights from an output view"""
+    highlighter = Highlighter.views.pop(view.id(), None)
+    if highlighter is not None:
+        highlighter.clear()
+
+
+class PathIndex(object):
+    """Indexes the file paths written to an output view by their position"""
+    views = {}
+    exists = {}
+
+    def __init__(self):
+        """Initializes a PathIndex object"""
+        self.starts = []
+        self.paths = []
+        self.commands = []
+
+    def scan(self, view, start, end):
+        """Finds the paths in newly appended text"""
+        offset = start
+        for line in view.substr(sublime.Region(start, end)).split('\n'):
+            if line.startswith(COMMAND_PREFIX):
+                self.commands.append(offset)
+            match = re.search(PATH_MATCH, line)
+            if match:
+                self.starts.append(offset + match.start())
+                self.paths.append(match.group(0))
+            offset += len(line) + 1
+
+    def between(self, begin, end):
+        """Gets the existing files whose paths start between two points"""
+        files = []
+        for path in self.paths[bisect_left(self.starts, begin):bisect_right(self.starts, end)]:
+            if is_file(path) and path not in files:
+                files.append(path)
+        return files
+
+    def command_bounds(self, point):
+        """Gets the start and end of the command output that contains a point"""
+        index = bisect_right(self.commands, point) - 1
+        begin = self.commands[index] if index >= 0 else 0
+        end = self.commands[index + 1] - 1 if index + 1 < len(self.commands) else float('inf')
+        return begin, end
+
+
+def is_file(path):
+    """Checks if a path is an existing file, caching the result for a short time"""
+    now = time.time()
+    cached = PathIndex.exists.get(path)
+    if cached is not None and now - cached[1] < EXISTS_TIMEOUT:
+        return cached[0]
+    exists = os.path.isfile(path)
+    PathIndex.exists[path] = (exists, now)
+    return exists
+
+
+def index_paths(view, start, end):
+    """Indexes the paths in text appended to an output view"""
+    index = PathIndex.views.get(view.id())
+    if index is None:
+        index = PathIndex()
+        PathIndex.views[view.id()] = index
+    index.scan(view, start, end)
+
+
+def clear_paths(view):
+    """Forgets the paths indexed for an output view"""
+    PathIndex.views.pop(view.id(), None)
+
+
+def selected_files(view):
+    """Gets the existing files on the selected lines of an output view"""
+    index = PathIndex.views.get(view.id())
+    if index is None:
+        return []
+    files = []
+    for region in view.sel():
+        lines = view.line(region)
+        for path in index.between(lines.begin(), lines.end()):
+            if path not in files:
+                files.append(path)
+    return files
+
+
+def command_files(view, point):
+    """Gets the existing files in the output of the command that contains a point"""
+    index = PathIndex.views.get(view.id())
+    if index is None:
+        return []
+    begin, end = index.command_bounds(point)
+    return index.between(begin, end)
@@ -99,9 +99,16 @@ class MultiSelect(object):
         """Opens the MultiSelect again"""
         sublime.set_timeout(self.open, TIMEOUT)
 
+    def panel_items(self):
+        """Gets the items for the quick panel, all with the same number of rows"""
+        rows = max([len(item) for item in self.items if isinstance(item, list)] or [0])
+        if rows == 0:
+            return self.items
+        return [item if isinstance(item, list) else [item] + [''] * (rows - 1) for item in self.items]
+
     def open(self):
         """Opens the MultiSelect panel"""
-        sublime.active_window().show_quick_panel(self.items, self.select, sublime.MONOSPACE_FONT)
+        sublime.active_window().show_quick_panel(self.panel_items(), self.select, sublime.MONOSPACE_FONT)
 
 
 class SelectOrAdd(object):
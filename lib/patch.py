@@ -0,0 +1,127 @@
+import os
+import re
+import json
+import time
+from urllib.parse import parse_qs
+from . import util, settings, stats, review
+
+RAW_DIFF_METHOD = 'differential.getrawdiff'
+REVISION_MATCH = r'^\s*(?:\S*/)?D?(\d+)(?:\s*[:\s]\s*(\d+))?\s*$'
+APPLY_COMMAND = 'git apply'
+CACHE_FOLDER = 'patches'
+ARCCONFIG_FILE = '.arcconfig'
+URI_KEYS = ['phabricator.uri', 'conduit_uri']
+DEFAULT_INSTALL = 'default'
+CACHE_NAME = 'D%d-%d.diff'
+CACHE_MATCH = r'^D(\d+)-(\d+)\.diff$'
+
+
+def install_name(root):
+    """Gets a folder name for the Phabricator install of a repository, from the conduit URI in its .arcconfig"""
+    try:
+        with open(os.path.join(root, ARCCONFIG_FILE), 'r', encoding='utf-8') as f:
+            config = json.load(f)
+    except (IOError, OSError, ValueError):
+        return DEFAULT_INSTALL
+    for key in URI_KEYS:
+        uri = config.get(key) if isinstance(config, dict) else None
+        if uri:
+            return re.sub(r'[^A-Za-z0-9.]+', '-', uri.split('://')[-1]).strip('-') or DEFAULT_INSTALL
+    return DEFAULT_INSTALL
+
+
+class PatchCache:
+    """Keeps the raw diffs of Differential revisions on disk, keyed by Phabricator install, revision and diff id"""
+
+    def folder(root):
+        """Gets the cache folder of the Phabricator install of a repository"""
+        return util.cache_dir(CACHE_FOLDER, install_name(root))
+
+    def path(root, revision, diff):
+        """Gets the cache file of a diff"""
+        return os.path.join(PatchCache.folder(root), CACHE_NAME % (revision, diff))
+
+    def get(root, revision, diff):
+        """Gets a cached diff, None if it has not been downloaded"""
+        path = PatchCache.path(root, revision, diff)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r', encoding='utf-8', newline='') as f:
+            return f.read()
+
+    def put(root, revision, diff, text):
+        """Caches a diff, writing it in full before it can be found"""
+        path = PatchCache.path(root, revision, diff)
+        with open(path + '.tmp', 'w', encoding='utf-8', newline='') as f:
+            f.write(text)
+        os.replace(path + '.tmp', path)
+
+    def diffs(root, revision):
+        """Gets the ids of the cached diffs of a revision, the newest first"""
+        diffs = []
+        for name in os.listdir(PatchCache.folder(root)):
+            match = re.match(CACHE_MATCH, name)
+            if match is not None and int(match.group(1)) == revision:
+                diffs.append(int(match.group(2)))
+        return sorted(diffs, reverse=True)
+
+
+def parse_revision(text):
+    """Parses D123, a revision URL, with ?id=456 for a specific diff, or D123:456 into (revision, diff), None if it is neither"""
+    text, separator, query = text.strip().partition('#')[0].partition('?')
+    ids = parse_qs(query).get('id', [])
+    match = re.match(REVISION_MATCH, text)
+    if match is None:
+        return None
+    if match.group(2):
+        return int(match.group(1)), int(match.group(2))
+    return int(match.group(1)), int(ids[0]) if len(ids) > 0 and ids[0].isdigit() else None
+
+
+def revision_diffs(root, revision):
+    """Gets the ids of the diffs of a revision, None if it cannot be queried"""
+    response = review.conduit(root, review.QUERY_METHOD, {'ids': [revision]}, 'Apply Patch')
+    if not response:
+        return None
+    return [int(diff) for diff in response[0].get('diffs') or []]
+
+
+def fetch(root, revision, diff=None):
+    """Gets a raw diff of a revision as (diff id, text), from the cache when it has been downloaded before
+
+    Without a diff id the newest diff is queried, or taken from the cache
+    when the query fails, so cached diffs can be applied offline. A diff id
+    that the query shows belongs to another revision gives (diff id, None).
+    """
+    started = time.time()
+    diffs = None
+    if diff is None:
+        diffs = revision_diffs(root, revision)
+        diff = max(diffs) if diffs else None
+        if diff is None:
+            cached = PatchCache.diffs(root, revision)
+            if len(cached) < 1:
+                return None, None
+            diff = cached[0]
+            util.debug('could not query D%d, using its cached diff %d' % (revision, diff))
+    text = PatchCache.get(root, revision, diff)
+    if text is not None:
+        stats.record('Patch', 'cached', time.time() - started)
+        return diff, text
+    if diffs is None:
+        diffs = revision_diffs(root, revision)
+    if diffs is not None and diff not in diffs:
+        return diff, None
+    text = review.conduit(root, RAW_DIFF_METHOD, {'diffID': diff}, 'Apply Patch')
+    if not isinstance(text, str):
+        return None, None
+    PatchCache.put(root, revision, diff, text)
+    stats.record('Patch', 'downloaded', time.time() - started)
+    return diff, text
+
+
+def apply_command():
+    """Builds the command that applies a patch from its input, with a three way merge when patchThreeWay is set"""
+    if settings.get('patchThreeWay', False):
+        return APPLY_COMMAND + ' --3way'
+    return APPLY_COMMAND
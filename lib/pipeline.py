@@ -0,0 +1,129 @@
+import sublime
+import time
+from collections import OrderedDict
+from threading import Lock
+from . import thread, util, stats
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class Step(object):
+    """A single command in a pipeline"""
+
+    def __init__(self, name, cmd, requires=None, paths=None):
+        """Initializes a Step object"""
+        self.name = name
+        self.cmd = cmd
+        self.requires = requires or []
+        self.paths = paths
+        self.state = PENDING
+        self.started = None
+        self.duration = None
+        self.process = None
+
+
+class Pipeline(object):
+    """Runs a set of steps, each one as soon as the steps it requires have completed"""
+
+    def __init__(self, name, steps, on_complete=None, cwd=None):
+        """Initializes a Pipeline object"""
+        self.name = name
+        self.steps = OrderedDict()
+        self.on_complete = on_complete
+        self.cwd = cwd
+        self.lock = Lock()
+        self.running = False
+        self.started = None
+        for step in steps:
+            for required in step.requires:
+                if required not in self.steps:
+                    raise ValueError('Step "%s" requires unknown step "%s"' % (step.name, required))
+            self.steps[step.name] = step
+
+    def start(self):
+        """Starts the pipeline, steps that already completed are not run again"""
+        with self.lock:
+            if self.running:
+                return
+            for step in self.steps.values():
+                if step.state != DONE:
+                    step.state = PENDING
+            self.running = True
+            self.started = time.time()
+        self.advance()
+
+    def failed_step(self):
+        """Gets the first step that failed, if any"""
+        for step in self.steps.values():
+            if step.state == FAILED:
+                return step
+        return None
+
+    def can_resume(self):
+        """Checks if the pipeline stopped part way through"""
+        return not self.running and self.failed_step() is not None
+
+    def is_complete(self):
+        """Checks if every step in the pipeline has completed"""
+        return all(step.state == DONE for step in self.steps.values())
+
+    def ready_steps(self):
+        """Gets the pending steps whose requirements have all completed"""
+        ready = []
+        for step in self.steps.values():
+            if step.state != PENDING:
+                continue
+            if all(self.steps[required].state == DONE for required in step.requires):
+                ready.append(step)
+        return ready
+
+    def advance(self):
+        """Starts every step that is ready, or finishes the pipeline"""
+        with self.lock:
+            if not self.running:
+                return
+            running = [step for step in self.steps.values() if step.state == RUNNING]
+            ready = [] if self.failed_step() else self.ready_steps()
+            for step in ready:
+                step.state = RUNNING
+                step.started = time.time()
+            finished = len(running) == 0 and len(ready) == 0
+            if finished:
+                self.running = False
+        for step in ready:
+            self.run_step(step)
+        if finished:
+            self.finish()
+
+    def run_step(self, step):
+        """Starts the process for a step"""
+        util.debug('%s: starting "%s"' % (self.name, step.name))
+
+        def on_complete(process):
+            self.on_step_complete(step, process)
+
+        step.process = thread.Process(self.name + ' - ' + step.name, step.cmd, step.paths, True, True, on_complete, self.cwd)
+
+    def on_step_complete(self, step, process):
+        """Handles the completion of a step's process"""
+        step.duration = time.time() - step.started
+        stats.record('Pipeline: ' + self.name, step.name, step.duration)
+        with self.lock:
+            step.state = DONE if process.returncode == 0 else FAILED
+        util.debug('%s: "%s" %s in %.2fs' % (self.name, step.name, step.state, step.duration))
+        self.advance()
+
+    def finish(self):
+        """Reports the result of the pipeline"""
+        duration = time.time() - self.started
+        failed = self.failed_step()
+        if failed is None:
+            stats.record('Pipeline: ' + self.name, 'Total', duration)
+            sublime.status_message('%s completed in %.1fs' % (self.name, duration))
+        else:
+            sublime.status_message('%s failed at "%s", run it again to resume' % (self.name, failed.name))
+        if self.on_complete is not None:
+            self.on_complete(self)
@@ -0,0 +1,64 @@
+import os
+import json
+import shlex
+import time
+from threading import Lock
+from . import settings, util
+
+REPLAY_VARIABLE = 'ARCINATOR_REPLAY'
+STATE_SUFFIX = '.state'
+
+lock = Lock()
+
+
+def fixture_path():
+    """Gets the fixture file that commands are recorded to, None when recording is off"""
+    path = settings.get('recordCommands', None)
+    if not path:
+        return None
+    return os.path.expanduser(path)
+
+
+def get_argv(command):
+    """Splits a shell command into arguments, naming the executable git or arc even when a path is set"""
+    try:
+        argv = shlex.split(command, posix=os.name != 'nt')
+    except ValueError:
+        argv = command.split(' ')
+    if len(argv) > 0:
+        argv[0] = os.path.splitext(os.path.basename(argv[0].strip('"')))[0]
+    return argv
+
+
+def record(process, started):
+    """Appends a finished process to the fixture file"""
+    path = fixture_path()
+    if path is None:
+        return
+    entry = {
+        'argv': get_argv(process.command),
+        'cwd': process.cwd,
+        'stdin': process.input_text,
+        'stdout': process.output() or '',
+        'stderr': process.error() or '',
+        'returncode': process.returncode,
+        'started': started,
+        'duration': time.time() - started
+    }
+    with lock:
+        try:
+            with open(path, 'a') as f:
+                f.write(json.dumps(entry) + '\n')
+        except (IOError, OSError):
+            util.debug('Could not record to ' + path)
+
+
+def reset_replay():
+    """Starts the fixture that bin/replay.py replays from the beginning again, when one is set"""
+    fixture = os.environ.get(REPLAY_VARIABLE)
+    if not fixture or not os.path.exists(fixture + STATE_SUFFIX):
+        return
+    try:
+        os.remove(fixture + STATE_SUFFIX)
+    except OSError:
+        util.debug('Could not reset the replay of ' + fixture)
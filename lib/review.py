@@ -0,0 +1,160 @@
+import sublime
+import os
+import re
+import hashlib
+import json
+import time
+from threading import Lock
+from . import thread, util, settings, stats
+
+BRANCHES_COMMAND = 'git for-each-ref refs/heads "--format=%1e%(refname:short)%1f%(contents)"'
+CONDUIT_COMMAND = 'arc call-conduit '
+QUERY_METHOD = 'differential.query'
+RECORD_SEPARATOR = '\x1e'
+FIELD_SEPARATOR = '\x1f'
+REVISION_MATCH = r'^Differential Revision:\s*\S*?D(\d+)\s*$'
+DEFAULT_TTL = 300
+
+
+class ReviewCache:
+    """Caches the Differential revision status of the branches of each repository"""
+    caches = {}
+    refreshing = set()
+    lock = Lock()
+
+    def path(root):
+        """Gets the cache file of a repository"""
+        name = hashlib.sha1(root.encode('utf-8')).hexdigest()
+        return os.path.join(util.cache_dir('reviews'), name + '.json')
+
+    def get(root):
+        """Gets the cached statuses of a repository, loading them from disk the first time"""
+        with ReviewCache.lock:
+            if root not in ReviewCache.caches:
+                cache = {'fetched': 0, 'branches': {}}
+                path = ReviewCache.path(root)
+                if os.path.exists(path):
+                    try:
+                        with open(path, 'r') as f:
+                            cache = json.load(f)
+                    except ValueError:
+                        util.debug('discarding unreadable review cache ' + path)
+                ReviewCache.caches[root] = cache
+            return ReviewCache.caches[root]
+
+    def set(root, branches, fetched=None):
+        """Replaces the cached statuses of a repository, fetched now unless a time is given"""
+        cache = {'fetched': time.time() if fetched is None else fetched, 'branches': branches}
+        with ReviewCache.lock:
+            ReviewCache.caches[root] = cache
+            with open(ReviewCache.path(root), 'w') as f:
+                json.dump(cache, f)
+
+
+def enabled():
+    """Checks if branch pickers should show review statuses"""
+    return bool(settings.get('reviewStatus', True))
+
+
+def parse_branches(raw):
+    """Parses the branch names and the revision ids in their latest commit messages"""
+    revisions = {}
+    for record in raw.split(RECORD_SEPARATOR):
+        branch, separator, message = record.partition(FIELD_SEPARATOR)
+        if not separator:
+            continue
+        match = re.search(REVISION_MATCH, message, re.M)
+        revisions[branch.strip()] = int(match.group(1)) if match else None
+    return revisions
+
+
+def conduit(root, method, params, name='Conduit'):
+    """Calls a conduit method through arc, returns its response or None if the call failed"""
+    p = thread.Process(name, CONDUIT_COMMAND + method, None, False, False, cwd=root, input_text=json.dumps(params))
+    if p.returncode != 0:
+        util.debug('conduit call failed: ' + p.error())
+        return None
+    try:
+        result = json.loads(p.output())
+    except ValueError:
+        util.debug('conduit returned invalid JSON')
+        return None
+    if result.get('error'):
+        util.debug('conduit error: ' + str(result.get('errorMessage') or result.get('error')))
+        return None
+    return result.get('response')
+
+
+def query_statuses(root, ids):
+    """Gets the status of a list of revisions with one conduit call"""
+    if len(ids) < 1:
+        return {}
+    response = conduit(root, QUERY_METHOD, {'ids': ids}, 'Review Status')
+    if response is None:
+        return None
+    statuses = {}
+    for revision in response:
+        statuses[int(revision['id'])] = revision.get('statusName', '')
+    return statuses
+
+
+def refresh(root):
+    """Fetches the statuses of every branch, blocking until they are cached"""
+    with ReviewCache.lock:
+        if root in ReviewCache.refreshing:
+            return
+        ReviewCache.refreshing.add(root)
+    started = time.time()
+    try:
+        p = thread.Process('Review Status', BRANCHES_COMMAND, None, False, False, cwd=root)
+        if p.returncode != 0:
+            return
+        revisions = parse_branches(p.output())
+        ids = sorted(set(revision for revision in revisions.values() if revision is not None))
+        statuses = query_statuses(root, ids)
+        fetched = None
+        if statuses is None:
+            # keep the statuses that were fetched before, and try again when the cache is next used
+            previous = ReviewCache.get(root)
+            fetched = previous.get('fetched', 0)
+            statuses = dict(
+                (entry['revision'], entry['status']) for entry in previous['branches'].values()
+                if entry['revision'] is not None
+            )
+        branches = {}
+        for branch, revision in revisions.items():
+            branches[branch] = {
+                'revision': revision,
+                'status': statuses.get(revision, '') if revision is not None else ''
+            }
+        ReviewCache.set(root, branches, fetched)
+        stats.record('Review status', os.path.basename(root), time.time() - started)
+    finally:
+        with ReviewCache.lock:
+            ReviewCache.refreshing.discard(root)
+
+
+def is_stale(root):
+    """Checks if the cached statuses are older than the reviewStatusTTL setting"""
+    cache = ReviewCache.get(root)
+    return time.time() - cache.get('fetched', 0) > settings.get('reviewStatusTTL', DEFAULT_TTL)
+
+
+def label(cache, branch):
+    """Gets the review column of a branch"""
+    entry = cache['branches'].get(branch)
+    if entry is None:
+        return ''
+    if entry['revision'] is None:
+        return 'No revision'
+    if not entry['status']:
+        return 'D%d' % entry['revision']
+    return 'D%d: %s' % (entry['revision'], entry['status'])
+
+
+def labels(root, branches):
+    """Gets the quick panel items for branches from the cache, refreshing it in the background when stale"""
+    cache = ReviewCache.get(root)
+    if is_stale(root):
+        sublime.set_timeout_async(lambda: refresh(root), 0)
+    return [[branch, label(cache, branch.strip('* ').strip())] for branch in branches]
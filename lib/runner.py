@@ -0,0 +1,314 @@
+import sublime
+import os
+import sys
+import time
+import codecs
+import signal
+from subprocess import PIPE, DEVNULL
+from threading import Thread, Event, Lock
+from . import thread, output, util, settings, stats, stalls, recorder
+
+try:
+    import asyncio
+except ImportError:
+    asyncio = None
+
+MIN_VERSION = (3, 8)
+STDOUT = 1
+STDERR = 2
+
+
+class EventLoop:
+    """Runs the event loop that every job shares on one background thread"""
+    loop = None
+    worker = None
+    lock = Lock()
+
+    def get():
+        """Gets the running event loop, starting it the first time"""
+        with EventLoop.lock:
+            if EventLoop.loop is None:
+                if os.name == 'nt':
+                    EventLoop.loop = asyncio.ProactorEventLoop()
+                else:
+                    EventLoop.loop = asyncio.new_event_loop()
+                EventLoop.worker = Thread(target=EventLoop.run, args=[EventLoop.loop], name='Arcinator event loop')
+                EventLoop.worker.daemon = True
+                EventLoop.worker.start()
+            return EventLoop.loop
+
+    def run(loop):
+        """Runs an event loop until it is stopped"""
+        asyncio.set_event_loop(loop)
+        loop.run_forever()
+        loop.close()
+
+    def stop():
+        """Stops the event loop"""
+        with EventLoop.lock:
+            loop = EventLoop.loop
+            EventLoop.loop = None
+        if loop is not None:
+            loop.call_soon_threadsafe(loop.stop)
+
+
+class JobProtocol(asyncio.SubprocessProtocol if asyncio is not None else object):
+    """Passes the events of a subprocess to its job"""
+
+    def __init__(self, job):
+        """Initializes a JobProtocol object"""
+        self.job = job
+
+    def connection_made(self, transport):
+        """Handles the process starting"""
+        self.job.transport = transport
+
+    def pipe_data_received(self, fd, data):
+        """Handles output from the process"""
+        self.job.receive(fd, data)
+
+    def connection_lost(self, exc):
+        """Handles the process exiting and closing all of its pipes"""
+        self.job.exited()
+
+
+class Job(object):
+    """A command run as a few callbacks on the shared event loop instead of on its own thread
+
+    Jobs have the same interface as thread.Process. Lines are streamed to
+    on_line on the event loop thread, on_complete is called on the main
+    thread, and coroutines on the loop can await job.future.
+    """
+    active_jobs = []
+
+    def __init__(self, name, cmd, paths=None, log=True, on_complete=None, cwd=None, on_line=None, input_text=None, window=None):
+        """Initializes a Job object"""
+        self.name = name
+        self.cmd = cmd
+        self.paths = paths
+        self.log = log
+        self.on_complete = on_complete
+        self.on_line = on_line
+        self.input_text = input_text
+        self.lines = []
+        self.errors = []
+        self.output_text = None
+        self.error_text = None
+        self.returncode = None
+        self.done = False
+        self.timed_out = False
+        self.cancelled = False
+        self.transport = None
+        self.watchdog = None
+        self.future = None
+        self.finished = Event()
+        self.channel = None
+        self.command = thread.resolve_executable(cmd)
+        if paths:
+            self.command = self.command + ' "' + '" "'.join(paths) + '"'
+        if cwd is not None:
+            self.cwd = cwd
+        else:
+            self.cwd = (window or sublime.active_window()).folders()[0]
+        if log:
+            self.channel = output.channel(self.name, self.command, window)
+            self.channel.add_files(self.paths)
+            self.channel.add_result_section()
+        util.debug(self.command)
+        util.debug(self.cwd)
+        self.decoder = codecs.getincrementaldecoder(thread.ENCODING)('replace')
+        self.stream = output.ProgressStream(self.add_line, self.add_progress if log else None)
+        self.started = time.time()
+        self.loop = EventLoop.get()
+        self.loop.call_soon_threadsafe(self.start)
+
+    def start(self):
+        """Starts the process on the event loop, finishing the job if it cannot be started"""
+        Job.active_jobs.append(self)
+        self.future = self.loop.create_future()
+        if self.cancelled:
+            self.returncode = -signal.SIGTERM
+            self.finish()
+            return
+        try:
+            self.spawn()
+        except Exception as e:
+            self.error_text = str(e)
+            self.returncode = -1
+            self.finish()
+            raise
+
+    def spawn(self):
+        """Starts the process and its watchdog"""
+        task = asyncio.ensure_future(self.loop.subprocess_shell(
+            lambda: JobProtocol(self),
+            self.command,
+            stdin=DEVNULL if self.input_text is None else PIPE,
+            stdout=PIPE,
+            stderr=PIPE,
+            cwd=self.cwd,
+            env=thread.get_env(self.cmd),
+            **thread.group_options()
+        ), loop=self.loop)
+        task.add_done_callback(self.on_started)
+        timeout = thread.get_timeout(self.cmd)
+        if timeout > 0:
+            self.watchdog = self.loop.call_later(timeout, self.on_timeout)
+
+    def on_started(self, task):
+        """Writes the input of a started process, or finishes a job whose process could not start"""
+        if task.exception() is not None:
+            self.error_text = str(task.exception())
+            self.returncode = -1
+            self.finish()
+            return
+        if self.cancelled:
+            self.kill()
+        if self.input_text is not None:
+            stdin = self.transport.get_pipe_transport(0)
+            stdin.write(self.input_text.encode(thread.ENCODING))
+            stdin.close()
+
+    def receive(self, fd, data):
+        """Streams output from the process"""
+        if fd == STDOUT:
+            self.stream.feed(self.decoder.decode(data))
+        elif fd == STDERR:
+            self.errors.append(data)
+
+    def add_line(self, line):
+        """Handles a complete line of output"""
+        self.lines.append(line + '\n')
+        if self.log:
+            self.channel.add_result_message(line)
+        if self.on_line is not None:
+            self.on_line(line + '\n')
+
+    def add_progress(self, line):
+        """Handles an update to a progress line of output"""
+        self.channel.add_result_progress(line)
+
+    def exited(self):
+        """Collects the results of a process that has exited"""
+        try:
+            self.stream.feed(self.decoder.decode(b'', True))
+            self.stream.close()
+            self.error_text = output.collapse_progress(b''.join(self.errors).decode(thread.ENCODING, 'replace'))
+            self.returncode = self.transport.get_returncode()
+            self.transport.close()
+        finally:
+            self.finish()
+
+    def finish(self):
+        """Completes the job, calling on_complete on the main thread"""
+        if self.done:
+            return
+        util.debug(self.command + " DONE")
+        self.done = True
+        self.output_text = "".join(self.lines)
+        if self.error_text is None:
+            self.error_text = ''
+        if self.watchdog is not None:
+            self.watchdog.cancel()
+        if self in Job.active_jobs:
+            Job.active_jobs.remove(self)
+        stats.record('Runner', thread.command_class(self.cmd), time.time() - self.started)
+        recorder.record(self, self.started)
+        if self.log:
+            self.channel.add_error(self.error(), self.returncode)
+            self.channel.end()
+        self.finished.set()
+        if not self.future.done():
+            self.future.set_result(self)
+        if self.on_complete is not None:
+            on_complete = stalls.wrap('Callback', stalls.callback_name(self.on_complete), self.on_complete)
+            sublime.set_timeout(lambda: on_complete(self), 0)
+
+    def output(self):
+        """Get output from the process"""
+        return self.output_text
+
+    def error(self):
+        """Get error text from the process"""
+        return self.error_text
+
+    def join(self, timeout=None):
+        """Waits for the job to complete, from any thread except the event loop"""
+        return self.finished.wait(timeout)
+
+    def on_timeout(self):
+        """Kills a process that has run for longer than its timeout"""
+        if self.done:
+            return
+        self.timed_out = True
+        util.debug(self.command + " TIMED OUT")
+        stats.record('Timeouts', thread.command_class(self.cmd), thread.get_timeout(self.cmd))
+        if self.log:
+            self.channel.add_result_message('Timed out after %d seconds' % thread.get_timeout(self.cmd))
+        self.cancel()
+
+    def kill(self, sig=signal.SIGTERM):
+        """Kills the process and every process it started"""
+        if self.transport is None or self.transport.get_returncode() is not None:
+            return
+        try:
+            thread.kill_group(self.transport.get_pid(), sig)
+        except OSError:
+            util.debug('Could not kill process group of ' + self.command)
+            self.transport.kill()
+
+    def cancel(self):
+        """Kills the process on the event loop, with SIGKILL if it is still running after a grace period"""
+        self.cancelled = True
+        if self.done:
+            return
+
+        def cancel_job():
+            self.kill()
+            if os.name != 'nt':
+                self.loop.call_later(thread.KILL_GRACE, self.kill, signal.SIGKILL)
+
+        self.loop.call_soon_threadsafe(cancel_job)
+
+    def terminate(self):
+        """Terminates the process"""
+        self.cancel()
+
+
+def available():
+    """Checks if the host has an asyncio that can run subprocesses from a background thread"""
+    return asyncio is not None and sys.version_info >= MIN_VERSION
+
+
+def enabled():
+    """Checks if the processRunner setting chooses the event loop runner"""
+    return available() and settings.get('processRunner', 'thread') == 'asyncio'
+
+
+def run(name, cmd, paths=None, log=True, on_complete=None, cwd=None, on_line=None, input_text=None):
+    """Starts a command in the background with the runner chosen by the processRunner setting"""
+    if enabled():
+        return Job(name, cmd, paths, log, on_complete, cwd, on_line, input_text)
+    return thread.Process(name, cmd, paths, log, True, on_complete, cwd, on_line, input_text)
+
+
+def terminate_all():
+    """Terminates all active jobs"""
+    for job in list(Job.active_jobs):
+        job.terminate()
+
+
+def stop():
+    """Terminates all active jobs and stops the event loop"""
+    terminate_all()
+    EventLoop.stop()
+
+
+def report():
+    """Gets the state of the runner for the stats view"""
+    if not enabled():
+        return ['Threads, %d running' % len(thread.Process.active_processes)]
+    return ['Event loop, %d running' % len(Job.active_jobs)]
+
+
+stats.add_reporter('Process runner', report)
@@ -0,0 +1,134 @@
+import os
+from . import thread, util, settings
+
+HEAD_SIZE_COMMAND = 'git cat-file "--batch-check=%(objectsize)"'
+ATTRIBUTE_COMMAND = 'git check-attr --stdin -z filter'
+LFS_FILTER = 'lfs'
+MISSING_OBJECT = ' missing'
+LARGE_FILE_SIZE = 1024 * 1024
+BINARY_CHECK_SIZE = 8000
+
+
+def large_file_size():
+    """Gets the number of bytes above which a file is large"""
+    return settings.get('largeFileSize', LARGE_FILE_SIZE)
+
+
+def diffs_large_files():
+    """Checks if large, binary and LFS files get content diffs anyway"""
+    return bool(settings.get('largeFileDiffs', False))
+
+
+def working_size(path):
+    """Gets the size of a file in the working tree, None if it does not exist"""
+    try:
+        return os.path.getsize(path) if os.path.isfile(path) else None
+    except OSError:
+        return None
+
+
+def is_binary(path):
+    """Checks if a file looks binary, from a NUL byte near its start"""
+    try:
+        with open(path, 'rb') as f:
+            return b'\0' in f.read(settings.get('binaryCheckSize', BINARY_CHECK_SIZE))
+    except (IOError, OSError):
+        return False
+
+
+def head_sizes(root, paths):
+    """Gets the size of each path at HEAD with a single command, None for paths that are not in HEAD"""
+    sizes = dict((path, None) for path in paths)
+    if len(paths) < 1:
+        return sizes
+    text = ''.join('HEAD:' + path + '\n' for path in paths)
+    p = thread.Process('Sizes', HEAD_SIZE_COMMAND, None, False, False, cwd=root, input_text=text)
+    if p.returncode != 0:
+        return sizes
+    for path, line in zip(paths, p.output().split('\n')):
+        if not line.endswith(MISSING_OBJECT) and line.isdigit():
+            sizes[path] = int(line)
+    return sizes
+
+
+def lfs_paths(root, paths):
+    """Gets the paths stored with Git LFS, from their filter attribute"""
+    if len(paths) < 1:
+        return set()
+    text = ''.join(path + '\0' for path in paths)
+    p = thread.Process('Sizes', ATTRIBUTE_COMMAND, None, False, False, cwd=root, input_text=text)
+    if p.returncode != 0:
+        return set()
+    fields = p.output().split('\0')
+    lfs = set()
+    for index in range(0, len(fields) - 2, 3):
+        if fields[index + 2] == LFS_FILTER:
+            lfs.add(fields[index])
+    return lfs
+
+
+def classify(root, paths):
+    """Gets the size, size at HEAD and kind of each path relative to the repository"""
+    paths = list(paths)
+    heads = head_sizes(root, paths)
+    lfs = lfs_paths(root, paths)
+    threshold = large_file_size()
+    classes = {}
+    for path in paths:
+        full_path = os.path.join(root, path)
+        size = working_size(full_path)
+        head_size = heads.get(path)
+        classes[path] = {
+            'size': size,
+            'head_size': head_size,
+            'large': max(size or 0, head_size or 0) > threshold,
+            'binary': size is not None and is_binary(full_path),
+            'lfs': path in lfs
+        }
+    return classes
+
+
+def skips_content(info):
+    """Checks if a file is left out of content diffs"""
+    if info is None or diffs_large_files():
+        return False
+    return info['large'] or info['binary'] or info['lfs']
+
+
+def kind(info):
+    """Gets a short name for what makes a file special, empty for ordinary files"""
+    if info['lfs']:
+        return 'LFS'
+    if info['binary']:
+        return 'binary'
+    if info['large']:
+        return 'large'
+    return ''
+
+
+def size_delta(info):
+    """Describes how the size of a file changed since HEAD"""
+    size = info['size']
+    head_size = info['head_size']
+    if size is None and head_size is None:
+        return ''
+    if head_size is None:
+        return util.format_size(size)
+    if size is None:
+        return 'deleted (%s)' % util.format_size(head_size)
+    delta = size - head_size
+    sign = '+' if delta >= 0 else '-'
+    return '%s -> %s (%s%s)' % (util.format_size(head_size), util.format_size(size), sign, util.format_size(abs(delta)))
+
+
+def describe(info):
+    """Describes a file that is left out of content diffs, with its kind and size delta"""
+    return ('%s  %s' % (kind(info), size_delta(info))).strip()
+
+
+def skips_mini_diff(path):
+    """Checks if the gutter diff of an open file should be turned off, because it is large or binary"""
+    if path is None or diffs_large_files():
+        return False
+    size = working_size(path)
+    return size is not None and (size > large_file_size() or is_binary(path))
@@ -0,0 +1,169 @@
+import sublime
+import os
+from threading import Lock
+from . import thread, util, settings
+
+CONFIG_COMMAND = 'git config --get-regexp "^(core\\.sparsecheckout|core\\.sparsecheckoutcone|extensions\\.partialclone|remote\\..*\\.promisor)$"'
+SPARSE_FILE_COMMAND = 'git rev-parse --git-path info/sparse-checkout'
+LIST_COMMAND = 'git sparse-checkout list'
+SET_COMMAND = 'git sparse-checkout set --cone'
+ADD_COMMAND = 'git sparse-checkout add'
+CLONE_COMMAND = 'git clone'
+DEFAULT_CLONE_FILTER = 'blob:none'
+
+
+class SparseCheckout(object):
+    """The sparse-checkout cone of a repository, read again only when its sparse-checkout file changes"""
+    checkouts = {}
+    checkouts_lock = Lock()
+
+    def __init__(self, root):
+        """Initializes a SparseCheckout object"""
+        self.root = root
+        self.folders = None
+        self.cone = False
+        self.mtime = None
+        self.loaded = False
+        self.lock = Lock()
+        p = self.git(SPARSE_FILE_COMMAND)
+        path = p.output().strip() if p.returncode == 0 else os.path.join('.git', 'info', 'sparse-checkout')
+        self.file = os.path.join(root, path)
+        config = self.read_config()
+        self.partial = 'extensions.partialclone' in config or any(
+            key.endswith('.promisor') and config[key] == 'true' for key in config
+        )
+
+    def git(self, cmd):
+        """Runs a git command for the repository"""
+        return thread.Process('Sparse Checkout', cmd, None, False, False, cwd=self.root)
+
+    def read_config(self):
+        """Gets the sparse-checkout and partial clone settings of the repository"""
+        p = self.git(CONFIG_COMMAND)
+        config = {}
+        for line in p.output().split('\n'):
+            key, separator, value = line.partition(' ')
+            if separator:
+                config[key.lower()] = value.strip()
+        return config
+
+    def file_mtime(self):
+        """Gets the modification time of the sparse-checkout file, None when there is none"""
+        try:
+            return os.path.getmtime(self.file)
+        except OSError:
+            return None
+
+    def load(self):
+        """Reads the cone again if the sparse-checkout file changed since it was last read"""
+        mtime = self.file_mtime()
+        if self.loaded and mtime == self.mtime:
+            return
+        util.debug('reading the sparse-checkout cone of ' + self.root)
+        config = self.read_config()
+        self.cone = config.get('core.sparsecheckoutcone') == 'true'
+        self.folders = None
+        if config.get('core.sparsecheckout') == 'true':
+            p = self.git(LIST_COMMAND)
+            if p.returncode == 0:
+                self.folders = [line for line in p.output().split('\n') if line]
+        self.mtime = mtime
+        self.loaded = True
+
+    def get(self):
+        """Gets the folders of the cone, None when the repository is not a sparse checkout"""
+        with self.lock:
+            self.load()
+            return list(self.folders) if self.folders is not None else None
+
+    def is_cone(self):
+        """Checks if the sparse checkout uses cone mode, the only mode the commands edit"""
+        with self.lock:
+            self.load()
+            return self.folders is not None and self.cone
+
+    def contains(self, path):
+        """Checks if a relative folder is checked out in full, because it is in one of the cone folders"""
+        return contains(self.get(), path)
+
+    def last_read(self):
+        """Gets the cone folders, None when it is not a sparse checkout, and cone mode as they were last read, without reading them again"""
+        return self.folders, self.cone
+
+
+def get(root):
+    """Gets the sparse checkout of a repository"""
+    with SparseCheckout.checkouts_lock:
+        if root not in SparseCheckout.checkouts:
+            SparseCheckout.checkouts[root] = SparseCheckout(root)
+        return SparseCheckout.checkouts[root]
+
+
+def cached(root):
+    """Gets the sparse checkout of a repository without running git, None until it has been read
+
+    For is_enabled checks on the main thread: the checkout is read, or read
+    again when its sparse-checkout file changed, in the background, and the
+    menu answers from what was last read.
+    """
+    with SparseCheckout.checkouts_lock:
+        checkout = SparseCheckout.checkouts.get(root)
+    if checkout is None or not checkout.loaded or checkout.file_mtime() != checkout.mtime:
+        sublime.set_timeout_async(lambda: get(root).get(), 0)
+    if checkout is None or not checkout.loaded:
+        return None
+    return checkout
+
+
+def contains(folders, path):
+    """Checks if a relative folder is in one of the cone folders, or checked out because there is no cone"""
+    if folders is None:
+        return True
+    return any(path == folder or path.startswith(folder + '/') for folder in folders)
+
+
+def relative(root, path):
+    """Gets the path of a folder relative to the repository, as the cone lists it"""
+    return os.path.relpath(path, root).replace(os.sep, '/')
+
+
+def is_partial(root):
+    """Checks if a repository is a partial clone, which fetches missing objects on demand"""
+    return get(root).partial
+
+
+def set_command(folders):
+    """Builds the command that sets the cone to folders, with a sparse index unless the sparseIndex setting is off"""
+    cmd = SET_COMMAND
+    if settings.get('sparseIndex', True):
+        cmd = cmd + ' --sparse-index'
+    return cmd + ''.join(' "' + util.escape_quotes(folder) + '"' for folder in folders)
+
+
+def add_command(root, folder):
+    """Builds the command that adds a folder to the cone, starting a sparse checkout if there is none"""
+    if get(root).is_cone():
+        return ADD_COMMAND + ' "' + util.escape_quotes(folder) + '"'
+    return set_command([folder])
+
+
+def remove_command(root, folder):
+    """Builds the command that removes a folder from the cone"""
+    folders = get(root).get() or []
+    return set_command([f for f in folders if f != folder])
+
+
+def clone_command(url, destination):
+    """Builds the partial clone command from the partialCloneFilter and partialCloneSparse settings"""
+    cmd = CLONE_COMMAND + ' "--filter=' + settings.get('partialCloneFilter', DEFAULT_CLONE_FILTER) + '"'
+    if settings.get('partialCloneSparse', True):
+        cmd = cmd + ' --sparse'
+    return cmd + ' "' + util.escape_quotes(url) + '" "' + util.escape_quotes(destination) + '"'
+
+
+def clone_name(url):
+    """Gets the folder name git would clone a repository into"""
+    name = url.rstrip('/').replace(':', '/').split('/')[-1]
+    if name.endswith('.git'):
+        name = name[:-4]
+    return name
@@ -0,0 +1,119 @@
+import os
+import stat
+import glob
+import subprocess
+import tempfile
+from subprocess import PIPE, DEVNULL
+from . import settings, util, stats
+
+CONTROL_PATH = '%C'
+CHECK_TIMEOUT = 5
+SSH_VARIABLES = ['GIT_SSH_COMMAND', 'SVN_SSH']
+
+
+def enabled():
+    """Checks if network commands should share ssh connections"""
+    return os.name != 'nt' and bool(settings.get('sshConnectionReuse', False))
+
+
+def control_path():
+    """Gets the path of the folder that holds the control sockets"""
+    return os.path.join(tempfile.gettempdir(), 'arcinator-ssh-%d' % os.getuid())
+
+
+def control_dir():
+    """Gets the private folder that holds the control sockets, None if it is not private
+
+    The folder is in the shared temporary folder, to keep socket paths short,
+    so it has to be a folder of the user that nobody else can open. Otherwise
+    another user could create it first and plant sockets in it.
+    """
+    path = control_path()
+    try:
+        os.mkdir(path, 0o700)
+    except FileExistsError:
+        pass
+    except OSError as e:
+        util.debug('cannot create %s: %s' % (path, e))
+        return None
+    info = os.lstat(path)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o077:
+        util.debug('not sharing ssh connections, %s is not a private folder' % path)
+        return None
+    return path
+
+
+def ssh_command(folder, base='ssh'):
+    """Gets the ssh command that connects through a shared control socket for each host"""
+    persist = settings.get('sshControlPersist', '10m')
+    return '%s -o ControlMaster=auto -o "ControlPath=%s" -o ControlPersist=%s' % (
+        base,
+        os.path.join(folder, CONTROL_PATH),
+        persist
+    )
+
+
+def update_env(env):
+    """Adds the connection sharing ssh command to the environment of a network command, for git and for git svn over svn+ssh"""
+    if enabled():
+        folder = control_dir()
+        if folder is not None:
+            for variable in SSH_VARIABLES:
+                env[variable] = ssh_command(folder, env.get(variable, 'ssh'))
+    return env
+
+
+def sockets():
+    """Gets the control sockets that have been created"""
+    if os.name == 'nt':
+        return []
+    if not os.path.isdir(control_path()):
+        return []
+    path = control_dir()
+    if path is None:
+        return []
+    return sorted(glob.glob(os.path.join(path, '*')))
+
+
+def control(socket, operation):
+    """Sends a control command to the master of a socket"""
+    try:
+        p = subprocess.Popen(
+            ['ssh', '-o', 'ControlPath=' + socket, '-O', operation, 'arcinator'],
+            stdin=DEVNULL,
+            stdout=PIPE,
+            stderr=PIPE,
+            universal_newlines=True
+        )
+    except OSError:
+        return False, 'ssh not found'
+    try:
+        out, err = p.communicate(timeout=CHECK_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        p.kill()
+        p.communicate()
+        return False, 'not responding'
+    return p.returncode == 0, (out + err).strip()
+
+
+def report():
+    """Gets the status of each control socket for the stats view"""
+    lines = []
+    for socket in sockets():
+        running, status = control(socket, 'check')
+        lines.append('%-48s %s' % (os.path.basename(socket), status))
+    if len(lines) < 1 and enabled():
+        lines.append('No open connections')
+    return lines
+
+
+def close_all():
+    """Closes every shared connection"""
+    for socket in sockets():
+        closed, status = control(socket, 'exit')
+        util.debug('closing ssh connection %s: %s' % (socket, status))
+        if not closed and os.path.exists(socket):
+            os.remove(socket)
+
+
+stats.add_reporter('SSH connections', report)
@@ -0,0 +1,137 @@
+import time
+import threading
+import traceback
+from threading import Lock
+from . import settings
+
+DEFAULT_THRESHOLD = 100
+MAX_RECORDS = 500
+STACK_LIMIT = 12
+STALL_FORMAT = '%-56s %6d %10.3fs %10.3fs'
+STALL_HEADER = '%-56s %6s %11s %11s' % ('Name', 'Count', 'Total', 'Max')
+
+
+class Stalls:
+    """Records the work that blocked the main thread for longer than the stallThreshold setting"""
+    main_thread = None
+    records = []
+    lock = Lock()
+
+    def is_main_thread():
+        """Checks if the current thread is the one Sublime Text runs commands and callbacks on"""
+        main_thread = Stalls.main_thread
+        if main_thread is None:
+            main_thread = getattr(threading, 'main_thread', lambda: None)()
+        return main_thread is not None and threading.current_thread() is main_thread
+
+    def record(kind, name, duration, stack):
+        """Records one stall, dropping the oldest records once there are too many"""
+        with Stalls.lock:
+            Stalls.records.append({
+                'kind': kind,
+                'name': name,
+                'duration': duration,
+                'stack': stack
+            })
+            if len(Stalls.records) > MAX_RECORDS:
+                del Stalls.records[0]
+
+    def report():
+        """Builds the text of the stalls report, the slowest first, with the stack of the slowest of each"""
+        with Stalls.lock:
+            records = list(Stalls.records)
+        if len(records) < 1:
+            return 'No stalls recorded'
+        groups = {}
+        for record in records:
+            key = (record['kind'], record['name'])
+            group = groups.setdefault(key, {'count': 0, 'total': 0.0, 'slowest': record})
+            group['count'] += 1
+            group['total'] += record['duration']
+            if record['duration'] > group['slowest']['duration']:
+                group['slowest'] = record
+        sections = []
+        for key in sorted(groups, key=lambda key: -groups[key]['total']):
+            group = groups[key]
+            name = '%s: %s' % key
+            lines = [STALL_HEADER, STALL_FORMAT % (name[:56], group['count'], group['total'], group['slowest']['duration'])]
+            lines.extend(line.rstrip('\n') for line in group['slowest']['stack'])
+            sections.append('\n'.join(lines))
+        return '\n\n'.join(sections)
+
+    def clear():
+        """Clears all recorded stalls"""
+        with Stalls.lock:
+            Stalls.records = []
+
+
+class Watch(object):
+    """Records a block of code as a stall when it blocks the main thread for too long"""
+
+    def __init__(self, kind, name):
+        """Initializes the Watch"""
+        self.kind = kind
+        self.name = name
+        self.started = None
+        self.stack = None
+
+    def __enter__(self):
+        """Starts timing when the block runs on the main thread"""
+        if enabled() and Stalls.is_main_thread():
+            self.started = time.time()
+            self.stack = traceback.format_stack(limit=STACK_LIMIT + 1)[:-1]
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        """Records the block if it took longer than the threshold"""
+        if self.started is None:
+            return False
+        duration = time.time() - self.started
+        if duration * 1000 >= threshold():
+            Stalls.record(self.kind, self.name, duration, self.stack)
+        return False
+
+
+def threshold():
+    """Gets the number of milliseconds that counts as a stall"""
+    return settings.get('stallThreshold', DEFAULT_THRESHOLD)
+
+
+def enabled():
+    """Checks if stalls are recorded, which they are in debug mode"""
+    return bool(settings.get('debug', False))
+
+
+def set_main_thread():
+    """Remembers the current thread as the main thread, called from plugin_loaded"""
+    Stalls.main_thread = threading.current_thread()
+
+
+def callback_name(callback):
+    """Gets a readable name for a callback"""
+    return getattr(callback, '__qualname__', getattr(callback, '__name__', repr(callback)))
+
+
+def watch(kind, name):
+    """Gets a context manager that records a block that stalls the main thread"""
+    return Watch(kind, name)
+
+
+def wrap(kind, name, callback):
+    """Gets a function that runs a callback, recording it if it stalls the main thread"""
+
+    def run(*args, **kwargs):
+        with Watch(kind, name):
+            return callback(*args, **kwargs)
+
+    return run
+
+
+def report():
+    """Gets the text of the stalls report"""
+    return Stalls.report()
+
+
+def clear():
+    """Clears all recorded stalls"""
+    Stalls.clear()
@@ -0,0 +1,80 @@
+import sublime
+import sys
+import importlib
+import time
+from threading import Lock
+from . import util, settings, stats
+
+STARTED = time.time()
+PACKAGE = __name__.rpartition('.')[0]
+
+
+class LazyModule(object):
+    """A module that is only imported the first time one of its attributes is used"""
+
+    def __init__(self, name):
+        """Initializes a LazyModule object"""
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+        self.__dict__['_lock'] = Lock()
+
+    def _load(self):
+        """Imports the module, recording how long it took"""
+        with self._lock:
+            if self._module is None:
+                started = time.time()
+                module = importlib.import_module(PACKAGE + '.' + self._name)
+                stats.record('Startup', 'import ' + self._name, time.time() - started)
+                self.__dict__['_module'] = module
+        return self._module
+
+    def __getattr__(self, name):
+        """Gets an attribute of the module, importing it the first time"""
+        return getattr(self._module or self._load(), name)
+
+    def __setattr__(self, name, value):
+        """Sets an attribute of the module"""
+        setattr(self._module or self._load(), name, value)
+
+
+def lazy(name):
+    """Gets a module of the lib package that is imported when it is first used"""
+    return LazyModule(name)
+
+
+def is_loaded(module):
+    """Checks if a lazy module has been imported, through any of its proxies"""
+    return not isinstance(module, LazyModule) or PACKAGE + '.' + module._name in sys.modules
+
+
+def loaded(name):
+    """Records how long a plugin file took to load, since the first Arcinator module was imported"""
+    stats.record('Startup', 'load ' + name, time.time() - STARTED)
+
+
+status = lazy('status')
+
+
+def get_roots():
+    """Gets the repositories of the folders open in every window"""
+    roots = []
+    for window in sublime.windows():
+        for folder in window.folders():
+            root = util.get_root(folder)
+            if root is not None and root not in roots:
+                roots.append(root)
+    return roots
+
+
+def warm_up():
+    """Fills the status caches of the open repositories with local git queries, so the first menu is as fast as the rest"""
+    for root in get_roots():
+        started = time.time()
+        status.query([root], root)
+        stats.record('Startup', 'warm up ' + root, time.time() - started)
+
+
+def start():
+    """Warms the caches in the background once the plugin has loaded"""
+    if settings.get('warmUpCaches', True):
+        sublime.set_timeout_async(warm_up, 0)
@@ -0,0 +1,114 @@
+import os
+from threading import Lock
+from . import thread, util
+
+LIST_COMMAND = 'git stash list "--format=%H%x1f%gd%x1f%cr%x1f%gs"'
+SHOW_COMMAND = 'git stash show --stat'
+GIT_DIR_COMMAND = 'git rev-parse --git-common-dir'
+FIELD_SEPARATOR = '\x1f'
+STASH_LOG = os.path.join('logs', 'refs', 'stash')
+
+
+class StashList(object):
+    """The stashes of a repository, listed once and kept up to date by the stash commands"""
+    lists = {}
+    lists_lock = Lock()
+
+    def __init__(self, root):
+        """Initializes a StashList object"""
+        self.root = root
+        self.entries = None
+        self.diffstats = {}
+        self.mtime = None
+        self.lock = Lock()
+        p = self.git(GIT_DIR_COMMAND)
+        git_dir = p.output().strip() if p.returncode == 0 else '.git'
+        self.log = os.path.join(root, git_dir, STASH_LOG)
+
+    def git(self, cmd, on_complete=None):
+        """Runs a git command for the repository, in the background when on_complete is given"""
+        return thread.Process('Stash', cmd, None, False, on_complete is not None, on_complete, self.root)
+
+    def log_mtime(self):
+        """Gets the modification time of the stash reflog, None when there are no stashes"""
+        try:
+            return os.path.getmtime(self.log)
+        except OSError:
+            return None
+
+    def parse(self, raw):
+        """Parses the output of the list command"""
+        entries = []
+        for line in raw.split('\n'):
+            parts = line.split(FIELD_SEPARATOR)
+            if len(parts) != 4:
+                continue
+            entries.append({
+                'id': parts[0],
+                'ref': parts[1],
+                'date': parts[2],
+                'subject': parts[3]
+            })
+        return entries
+
+    def get(self):
+        """Gets the stashes, listing them again only if something else changed the stash"""
+        with self.lock:
+            mtime = self.log_mtime()
+            if self.entries is None or mtime != self.mtime:
+                util.debug('listing stashes of ' + self.root)
+                p = self.git(LIST_COMMAND)
+                self.entries = self.parse(p.output()) if p.returncode == 0 else []
+                self.mtime = mtime
+            return list(self.entries)
+
+    def renumber(self):
+        """Updates the stash@{n} names after entries were added or removed"""
+        for index, entry in enumerate(self.entries):
+            entry['ref'] = 'stash@{%d}' % index
+
+    def added(self):
+        """Adds the stash that was just created to the top of the list"""
+        with self.lock:
+            if self.entries is None:
+                return
+            p = self.git(LIST_COMMAND + ' -n 1')
+            entries = self.parse(p.output()) if p.returncode == 0 else []
+            if len(entries) < 1:
+                self.entries = None
+                return
+            self.entries.insert(0, entries[0])
+            self.renumber()
+            self.mtime = self.log_mtime()
+
+    def removed(self, entry):
+        """Removes a stash that was popped or dropped from the list"""
+        with self.lock:
+            if self.entries is None:
+                return
+            self.entries = [e for e in self.entries if e['id'] != entry['id']]
+            self.renumber()
+            self.mtime = self.log_mtime()
+
+    def diffstat(self, entry, on_done):
+        """Gets the diffstat of a stash, from the cache or in the background"""
+        cached = self.diffstats.get(entry['id'])
+        if cached is not None:
+            on_done(cached)
+            return
+
+        def on_complete(process):
+            text = process.output() if process.returncode == 0 else process.error()
+            if process.returncode == 0:
+                self.diffstats[entry['id']] = text
+            on_done(text)
+
+        self.git(SHOW_COMMAND + ' ' + entry['id'], on_complete)
+
+
+def get(root):
+    """Gets the stash list of a repository"""
+    with StashList.lists_lock:
+        if root not in StashList.lists:
+            StashList.lists[root] = StashList(root)
+        return StashList.lists[root]
@@ -0,0 +1,102 @@
+import time
+from threading import Lock
+
+TIMING_FORMAT = '%-48s %6d %10.3fs %10.3fs %10.3fs'
+TIMING_HEADER = '%-48s %6s %11s %11s %11s' % ('Name', 'Count', 'Total', 'Max', 'Last')
+
+
+class Stats:
+    """Collects timings and status information for the stats view"""
+    timings = {}
+    reporters = []
+    lock = Lock()
+
+    def record(category, name, duration):
+        """Records the duration of a named operation"""
+        with Stats.lock:
+            entries = Stats.timings.setdefault(category, {})
+            entry = entries.setdefault(name, {
+                'count': 0,
+                'total': 0.0,
+                'max': 0.0,
+                'last': 0.0
+            })
+            entry['count'] += 1
+            entry['total'] += duration
+            entry['max'] = max(entry['max'], duration)
+            entry['last'] = duration
+
+    def add_reporter(title, reporter):
+        """Adds a function that returns extra lines for the stats view"""
+        Stats.reporters.append((title, reporter))
+
+    def clear():
+        """Clears all recorded timings"""
+        with Stats.lock:
+            Stats.timings = {}
+
+    def report():
+        """Builds the text for the stats view"""
+        sections = []
+        with Stats.lock:
+            for category in sorted(Stats.timings):
+                lines = [category + ':', TIMING_HEADER]
+                entries = Stats.timings[category]
+                for name in sorted(entries):
+                    entry = entries[name]
+                    lines.append(TIMING_FORMAT % (name[:48], entry['count'], entry['total'], entry['max'], entry['last']))
+                sections.append('\n'.join(lines))
+        for title, reporter in Stats.reporters:
+            lines = reporter()
+            if lines:
+                sections.append('\n'.join([title + ':'] + lines))
+        if len(sections) < 1:
+            return 'No stats recorded'
+        return '\n\n'.join(sections)
+
+
+class Timer(object):
+    """Records the duration of a block of code"""
+
+    def __init__(self, category, name):
+        """Initializes the Timer"""
+        self.category = category
+        self.name = name
+        self.started = None
+        self.duration = None
+
+    def __enter__(self):
+        """Starts the timer"""
+        self.started = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        """Stops the timer and records the duration"""
+        self.duration = time.time() - self.started
+        Stats.record(self.category, self.name, self.duration)
+        return False
+
+
+def record(category, name, duration):
+    """Records the duration of a named operation"""
+    Stats.record(category, name, duration)
+
+
+def timed(category, name):
+    """Gets a context manager that records the duration of a block"""
+    return Timer(category, name)
+
+
+def add_reporter(title, reporter):
+    """Adds a function that returns extra lines for the stats view"""
+    Stats.add_reporter(title, reporter)
+
+
+def report():
+    """Gets the text of the stats view"""
+    return Stats.report()
+
+
+def clear():
+    """Clears all recorded timings"""
+    Stats.clear()
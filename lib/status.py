@@ -0,0 +1,575 @@
+import sublime
+import os
+import sys
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+from threading import Thread, Lock, RLock, Event
+from . import thread, util, settings, stats, sizes
+
+UNTRACKED_NONE = '-uno'
+UNTRACKED_FOLDERS = '-unormal'
+UNTRACKED_FILES = '-uall'
+STATUS_COMMAND = 'git status --porcelain -z ' + UNTRACKED_FOLDERS
+TIMING_COMMAND = 'git status --porcelain ' + UNTRACKED_FOLDERS
+FSMONITOR_STATUS_COMMAND = 'git fsmonitor--daemon status'
+GIT_DIR_COMMAND = 'git rev-parse --git-dir'
+IGNORED_FOLDERS_COMMAND = 'git ls-files -z --others --ignored --exclude-standard --directory'
+CHECK_IGNORE_COMMAND = 'git check-ignore --stdin -z'
+FAST_STATUS_CONFIG = [
+    ('core.untrackedCache', 'git update-index --untracked-cache'),
+    ('core.fsmonitor', None),
+    ('core.splitIndex', 'git update-index --split-index')
+]
+MAX_PATHSPECS = 100
+LITERAL_PATHSPEC = ':(literal)'
+DEFAULT_POLL_INTERVAL = 5
+GIT_FOLDER = '.git'
+GIT_STATE_FILES = ['index', 'HEAD']
+
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+EVENT_HEADER = struct.Struct('iIII')
+READ_SIZE = 64 * 1024
+READ_TIMEOUT = 1
+
+
+def parse(raw):
+    """Parses the output of a -z status command into (status, path) entries"""
+    entries = []
+    fields = raw.rstrip('\n').split('\0')
+    index = 0
+    while index < len(fields):
+        field = fields[index]
+        index += 1
+        if len(field) < 4:
+            continue
+        code, path = field[:2], field[3:]
+        if code[0] in 'RC':
+            index += 1
+        entries.append((code, path))
+    return entries
+
+
+def is_inside(path, folder):
+    """Checks if a relative path is a folder or inside of it"""
+    return folder == '' or path == folder or path.startswith(folder + '/')
+
+
+def covers(entry, path):
+    """Checks if a status entry is the path, inside of it, or an untracked folder that contains it"""
+    if entry.endswith('/') and is_inside(path, entry[:-1]):
+        return True
+    return is_inside(entry, path)
+
+
+class Snapshot(object):
+    """The status of every changed file in a repository, kept up to date with the paths a watcher reports"""
+
+    def __init__(self, root):
+        """Initializes a Snapshot object"""
+        self.root = root
+        self.entries = {}
+        self.classes = {}
+        self.pending = set()
+        self.stale = True
+        self.watched = True
+        self.git_dir = os.path.join(root, GIT_FOLDER)
+        self.lock = Lock()
+        self.refresh_lock = RLock()
+        self.watcher = None
+
+    def find_git_dir(self):
+        """Finds the git folder of the repository, which is elsewhere when .git is a file, as in worktrees and submodules"""
+        p = thread.Process('Status', GIT_DIR_COMMAND, None, False, False, cwd=self.root)
+        if p.returncode == 0 and p.output().strip():
+            self.git_dir = os.path.normpath(os.path.join(self.root, p.output().strip()))
+        return self.git_dir
+
+    def ignored_folders(self, folder=None):
+        """Gets the ignored folders of the repository, or of one of its folders, which are not watched
+
+        ls-files also lists untracked folders that only hold ignored files,
+        so only the folders an ignore pattern matches are kept.
+        """
+        paths = None
+        if folder is not None:
+            paths = [LITERAL_PATHSPEC + folder]
+        p = thread.Process('Status', IGNORED_FOLDERS_COMMAND + (' --' if paths else ''), paths, False, False, cwd=self.root)
+        if p.returncode != 0:
+            return set()
+        folders = [path[:-1] for path in p.output().rstrip('\n').split('\0') if path.endswith('/')]
+        if len(folders) < 1:
+            return set()
+        text = ''.join(path + '\0' for path in folders)
+        p = thread.Process('Status', CHECK_IGNORE_COMMAND, None, False, False, cwd=self.root, input_text=text)
+        return set(path for path in p.output().rstrip('\n').split('\0') if path)
+
+    def unwatch(self):
+        """Stops caching the status, so every query runs a full status"""
+        util.debug('not watching ' + self.root + ', every status query runs git status')
+        with self.lock:
+            self.watched = False
+            self.pending = set()
+
+    def relative(self, path):
+        """Gets a path relative to the repository, None if it is outside of it"""
+        path = os.path.relpath(os.path.abspath(path), self.root)
+        if path == os.curdir:
+            return ''
+        if path == os.pardir or path.startswith(os.pardir + os.sep):
+            return None
+        return path.replace(os.sep, '/')
+
+    def changed(self, path):
+        """Records that a path has changed since the last refresh"""
+        path = self.relative(path)
+        if path is None or is_inside(path, GIT_FOLDER):
+            return
+        with self.lock:
+            self.pending.add(path)
+
+    def invalidate(self):
+        """Marks the whole snapshot out of date"""
+        with self.lock:
+            self.stale = True
+            self.pending = set()
+
+    def take_pending(self):
+        """Gets the paths to refresh, None when the whole repository has to be refreshed"""
+        with self.lock:
+            pending = self.pending
+            self.pending = set()
+            if self.stale or not self.watched:
+                self.stale = False
+                return None
+        if len(pending) > MAX_PATHSPECS:
+            pending = set(os.path.dirname(path) for path in pending)
+        if len(pending) > MAX_PATHSPECS or '' in pending:
+            return None
+        for path in list(pending):
+            for entry in self.entries:
+                if entry.endswith('/') and is_inside(path, entry[:-1]):
+                    pending.add(entry[:-1])
+        return sorted(pending)
+
+    def run_status(self, paths):
+        """Runs a status command, limited to paths when they are given"""
+        if paths:
+            paths = [LITERAL_PATHSPEC + path for path in paths]
+        p = thread.Process('Status', STATUS_COMMAND + (' --' if paths else ''), paths, False, False, cwd=self.root)
+        if p.returncode != 0:
+            return None
+        return parse(p.output())
+
+    def refresh(self):
+        """Brings the snapshot up to date, with a full status only when it has to"""
+        with self.refresh_lock:
+            paths = self.take_pending()
+            if paths is not None and len(paths) < 1:
+                return True
+            started = time.time()
+            entries = self.run_status(paths)
+            if entries is None:
+                self.invalidate()
+                return False
+            if paths is None:
+                self.entries = dict((path, code) for code, path in entries)
+                self.classes = {}
+                stats.record('Status', 'full', time.time() - started)
+                return True
+            merged = dict(
+                (path, code) for path, code in self.entries.items()
+                if not any(covers(path, folder) for folder in paths)
+            )
+            for code, path in entries:
+                merged[path] = code
+            self.entries = merged
+            self.classes = dict(
+                (path, info) for path, info in self.classes.items()
+                if not any(covers(path, folder) for folder in paths)
+            )
+            stats.record('Status', 'partial', time.time() - started)
+            return True
+
+    def query(self, files):
+        """Gets the porcelain status lines of files, None if they are not in the repository"""
+        folders = []
+        for path in files:
+            relative = self.relative(path)
+            if relative is None:
+                return None
+            folders.append(relative)
+        if len(folders) < 1:
+            folders.append('')
+        if not self.refresh():
+            return None
+        entries = self.entries
+        lines = []
+        for path in sorted(entries):
+            if any(covers(path, folder) for folder in folders):
+                lines.append(entries[path] + ' ' + path)
+        return '\n'.join(lines) + '\n' if lines else ''
+
+    def classify(self, paths):
+        """Gets the size and kind of changed paths, only looking again at those that changed since the last time"""
+        with self.refresh_lock:
+            if not self.refresh():
+                return sizes.classify(self.root, paths)
+            classes = self.classes
+            missing = [path for path in paths if path not in classes]
+            if len(missing) > 0:
+                classes.update(sizes.classify(self.root, missing))
+            return dict((path, classes[path]) for path in paths)
+
+
+class InotifyWatcher(Thread):
+    """Reports changed paths in a repository with inotify"""
+
+    def __init__(self, snapshot):
+        """Initializes an InotifyWatcher object"""
+        Thread.__init__(self)
+        self.daemon = True
+        self.snapshot = snapshot
+        self.stopped = Event()
+        self.folders = {}
+        self.git_dir = None
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+
+    def add_watch(self, folder):
+        """Watches one folder"""
+        wd = self.libc.inotify_add_watch(self.fd, folder.encode(sys.getfilesystemencoding()), WATCH_MASK)
+        if wd < 0:
+            error = ctypes.get_errno()
+            if error in (errno.ENOENT, errno.ENOTDIR, errno.EACCES):
+                return
+            raise OSError(error, 'inotify_add_watch failed for ' + folder)
+        self.folders[wd] = folder
+
+    def add_tree(self, folder):
+        """Watches a folder and every folder inside it, except the git folder and ignored folders"""
+        relative = self.snapshot.relative(folder)
+        ignored = self.snapshot.ignored_folders(relative or None)
+        for path, files in walk(folder, self.snapshot.root, ignored):
+            self.add_watch(path)
+
+    def run(self):
+        """Adds the watches, then reads events until stopped"""
+        try:
+            self.git_dir = self.snapshot.find_git_dir()
+            self.add_tree(self.snapshot.root)
+            self.add_watch(self.git_dir)
+        except OSError as e:
+            util.debug('inotify failed: ' + str(e))
+            os.close(self.fd)
+            self.snapshot.unwatch()
+            return
+        self.snapshot.invalidate()
+        while not self.stopped.is_set():
+            readable = select.select([self.fd], [], [], READ_TIMEOUT)[0]
+            if not readable:
+                continue
+            try:
+                data = os.read(self.fd, READ_SIZE)
+            except OSError as e:
+                if e.errno == errno.EAGAIN:
+                    continue
+                raise
+            self.handle(data)
+        os.close(self.fd)
+
+    def handle(self, data):
+        """Records the paths of a batch of events"""
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, size = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + size].rstrip(b'\0').decode(sys.getfilesystemencoding(), 'replace')
+            offset += size
+            if mask & IN_Q_OVERFLOW:
+                self.snapshot.invalidate()
+                continue
+            folder = self.folders.get(wd)
+            if folder is None:
+                continue
+            if mask & IN_IGNORED:
+                del self.folders[wd]
+                continue
+            path = os.path.join(folder, name) if name else folder
+            if folder == self.git_dir:
+                if name in GIT_STATE_FILES:
+                    self.snapshot.invalidate()
+                continue
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO) and name != GIT_FOLDER:
+                try:
+                    self.add_tree(path)
+                except OSError as e:
+                    util.debug('inotify failed: ' + str(e))
+                    self.stop()
+                    self.snapshot.unwatch()
+            self.snapshot.changed(path)
+
+    def stop(self):
+        """Stops watching"""
+        self.stopped.set()
+
+
+class PollingWatcher(Thread):
+    """Reports changed paths in a repository by comparing modification times"""
+
+    def __init__(self, snapshot):
+        """Initializes a PollingWatcher object"""
+        Thread.__init__(self)
+        self.daemon = True
+        self.snapshot = snapshot
+        self.stopped = Event()
+        self.times = None
+        self.git_dir = None
+        self.ignored = set()
+
+    def scan(self):
+        """Gets the modification time and size of every file, except those in the git folder and ignored folders"""
+        times = {}
+        for path, files in walk(self.snapshot.root, self.snapshot.root, self.ignored):
+            for name in files:
+                full = os.path.join(path, name)
+                try:
+                    info = os.lstat(full)
+                except OSError:
+                    continue
+                times[full] = (info.st_mtime, info.st_size, info.st_mode)
+        for name in GIT_STATE_FILES:
+            full = os.path.join(self.git_dir, name)
+            try:
+                info = os.stat(full)
+                times[full] = (info.st_mtime, info.st_size, info.st_mode)
+            except OSError:
+                continue
+        return times
+
+    def run(self):
+        """Compares the files every pollInterval seconds until stopped"""
+        self.git_dir = self.snapshot.find_git_dir()
+        self.ignored = self.snapshot.ignored_folders()
+        self.times = self.scan()
+        self.snapshot.invalidate()
+        while not self.stopped.wait(settings.get('statusPollInterval', DEFAULT_POLL_INTERVAL)):
+            times = self.scan()
+            changed = set(path for path, value in times.items() if self.times.get(path) != value)
+            changed.update(path for path in self.times if path not in times)
+            self.times = times
+            if any(os.path.dirname(path) == self.git_dir for path in changed):
+                self.snapshot.invalidate()
+                continue
+            for path in changed:
+                self.snapshot.changed(path)
+
+    def stop(self):
+        """Stops watching"""
+        self.stopped.set()
+
+
+def walk(folder, root, ignored):
+    """Walks the folders inside a folder of a repository, except git folders and the ignored folders relative to root"""
+    for path, folders, files in os.walk(folder):
+        relative = os.path.relpath(path, root).replace(os.sep, '/')
+        if relative in ignored:
+            folders[:] = []
+            continue
+        prefix = '' if relative == os.curdir else relative + '/'
+        folders[:] = [name for name in folders if name != GIT_FOLDER and prefix + name not in ignored]
+        yield path, files
+
+
+class StatusCache:
+    """Holds the watched status snapshot of each repository"""
+    snapshots = {}
+    lock = Lock()
+
+    def get(root):
+        """Gets the snapshot of a repository, starting its watcher the first time"""
+        with StatusCache.lock:
+            snapshot = StatusCache.snapshots.get(root)
+            if snapshot is None:
+                snapshot = Snapshot(root)
+                snapshot.watcher = create_watcher(snapshot)
+                snapshot.watcher.start()
+                StatusCache.snapshots[root] = snapshot
+                check_fast_status(root)
+            return snapshot
+
+    def stop_all():
+        """Stops every watcher"""
+        with StatusCache.lock:
+            for snapshot in StatusCache.snapshots.values():
+                snapshot.watcher.stop()
+            StatusCache.snapshots = {}
+
+
+def watcher_type():
+    """Gets the watcher chosen by the statusWatcher setting, None when status is not cached"""
+    value = settings.get('statusWatcher', 'auto')
+    if value not in ('auto', 'inotify', 'polling'):
+        return None
+    return value
+
+
+def create_watcher(snapshot):
+    """Creates an inotify watcher where it is available, a polling watcher otherwise"""
+    if watcher_type() != 'polling' and sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(snapshot)
+        except (OSError, AttributeError) as e:
+            util.debug('inotify is not available: ' + str(e))
+    return PollingWatcher(snapshot)
+
+
+def query(files, root=None):
+    """Gets the porcelain status lines of files from the watched snapshot, None if it cannot be used"""
+    if watcher_type() is None:
+        return None
+    if root is None:
+        root = util.get_root(files[0] if len(files) > 0 else None)
+    if root is None:
+        return None
+    return StatusCache.get(root).query(files)
+
+
+def classify(root, paths):
+    """Gets the size and kind of paths relative to a repository, cached with the watched snapshot"""
+    if watcher_type() is None:
+        return sizes.classify(root, paths)
+    return StatusCache.get(root).classify(paths)
+
+
+def hint(path):
+    """Records that a file has changed, for example when it is saved"""
+    if watcher_type() is None or path is None:
+        return
+    root = util.get_root(path)
+    with StatusCache.lock:
+        snapshot = StatusCache.snapshots.get(root)
+    if snapshot is not None:
+        snapshot.changed(path)
+
+
+def invalidate(root):
+    """Marks the snapshot of a repository out of date, for example after a command changes the index"""
+    with StatusCache.lock:
+        snapshot = StatusCache.snapshots.get(root)
+    if snapshot is not None:
+        snapshot.invalidate()
+
+
+def stop_all():
+    """Stops every watcher"""
+    StatusCache.stop_all()
+
+
+class FastStatus:
+    """Holds the fast status configuration found in each repository"""
+    repositories = {}
+    checked = set()
+    lock = Lock()
+
+    def git(root, cmd):
+        """Runs a git command for fast status in a repository"""
+        return thread.Process('Fast Status', cmd, None, False, False, cwd=root)
+
+    def fsmonitor_supported(root):
+        """Checks if git has a built-in file system monitor daemon for this platform"""
+        p = FastStatus.git(root, FSMONITOR_STATUS_COMMAND)
+        message = (p.output() + p.error()).lower()
+        return 'not supported' not in message and 'is not a git command' not in message and 'unknown' not in message
+
+    def config(root):
+        """Gets the fast status options of a repository, None for options git cannot use"""
+        options = {}
+        for name, command in FAST_STATUS_CONFIG:
+            if name == 'core.fsmonitor' and not FastStatus.fsmonitor_supported(root):
+                options[name] = None
+                continue
+            value = FastStatus.git(root, 'git config --get ' + name).output().strip()
+            options[name] = value.lower() in ('true', 'yes', 'on', '1')
+        return options
+
+    def time_status(root):
+        """Times a full status of a repository"""
+        started = time.time()
+        FastStatus.git(root, TIMING_COMMAND)
+        return time.time() - started
+
+    def enable(root, options):
+        """Enables the options that are off, timing status before and after"""
+        name = os.path.basename(root)
+        stats.record('Fast status', name + ' before', FastStatus.time_status(root))
+        for option, command in FAST_STATUS_CONFIG:
+            if options[option] is not False:
+                continue
+            p = FastStatus.git(root, 'git config %s true' % option)
+            if p.returncode == 0 and command is not None:
+                FastStatus.git(root, command)
+            options[option] = p.returncode == 0
+        FastStatus.time_status(root)
+        stats.record('Fast status', name + ' after', FastStatus.time_status(root))
+
+    def check(root):
+        """Checks, and enables when the fastStatus setting asks for it, the fast status options of a repository"""
+        options = FastStatus.config(root)
+        if fast_status_mode() == 'enable' and False in options.values():
+            FastStatus.enable(root, options)
+        with FastStatus.lock:
+            FastStatus.repositories[root] = options
+
+    def report():
+        """Gets the fast status options of each repository for the stats view"""
+        lines = []
+        with FastStatus.lock:
+            repositories = dict(FastStatus.repositories)
+        for root in sorted(repositories):
+            states = []
+            for option, value in sorted(repositories[root].items()):
+                states.append('%s=%s' % (option[len('core.'):], 'unsupported' if value is None else ('on' if value else 'off')))
+            lines.append('%-32s %s' % (os.path.basename(root), ' '.join(states)))
+        return lines
+
+
+def fast_status_mode():
+    """Gets the fastStatus setting: "off", "check" to report the options, or "enable" to turn them on"""
+    value = settings.get('fastStatus', 'off')
+    if value is True:
+        return 'enable'
+    if value not in ('check', 'enable'):
+        return 'off'
+    return value
+
+
+def check_fast_status(root):
+    """Checks the fast status options of a repository once, in the background"""
+    if fast_status_mode() == 'off':
+        return
+    with FastStatus.lock:
+        if root in FastStatus.checked:
+            return
+        FastStatus.checked.add(root)
+    sublime.set_timeout_async(lambda: FastStatus.check(root), 0)
+
+
+stats.add_reporter('Fast status options', FastStatus.report)
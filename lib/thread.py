@@ -1,23 +1,49 @@
 import sublime
-from subprocess import Popen, PIPE
+import os
+import re
+import signal
+import codecs
+import time
+import subprocess
+from subprocess import Popen, PIPE, DEVNULL
 from threading import Thread, Timer
-from . import output, util
+from . import output, util, settings, stats, stalls, ssh, recorder
 
 TIME_INTERVAL = 0.05
 LOADING_SIZE = 7
+CHUNK_SIZE = 4096
+ENCODING = 'utf-8'
+KILL_GRACE = 5
+
+NETWORK_COMMAND = r'^(git\s+(push|pull|fetch|clone|ls-remote|svn)|arc)\b'
+QUERY_COMMAND = r'^git\s+(status|rev-parse|branch|config|remote|symbolic-ref|ls-files|cat-file|hash-object)\b'
+DEFAULT_TIMEOUTS = {
+    'network': 600,
+    'local': 300,
+    'query': 60
+}
+EXECUTABLES = [
+    ('git', 'gitPath'),
+    ('arc', 'arcPath')
+]
+NON_INTERACTIVE_ENV = {
+    'GIT_TERMINAL_PROMPT': '0',
+    'GIT_MERGE_AUTOEDIT': 'no',
+    'GCM_INTERACTIVE': 'never'
+}
 
 
 class Process(Thread):
     """A threaded process"""
     active_processes = []
 
-    def __init__(self, name, cmd, paths=None, log=True, async=False, on_complete=None, cwd=None):
-        """Initializes a Process object"""
+    def __init__(self, name, cmd, paths=None, log=True, background=False, on_complete=None, cwd=None, on_line=None, input_text=None, window=None):
+        """Initializes a Process object, logging to the output of window or the active window"""
         Thread.__init__(self)
         self.name = name
         self.cmd = cmd
         self.paths = paths
-        self.async = async
+        self.background = background
         self.done = False
         self.log = log
         self.lines = []
@@ -27,45 +53,103 @@ class Process(Thread):
         self.loading = 0
         self.returncode = None
         self.on_complete = on_complete
+        self.on_line = on_line
+        self.input_text = input_text
+        self.watchdog = None
+        self.timed_out = False
+        self.started = None
+        self.process = None
+        self.channel = None
         if not paths:
-            self.command = cmd
+            self.command = resolve_executable(cmd)
         else:
-            self.command = cmd + ' ' + self.get_path(paths)
+            self.command = resolve_executable(cmd) + ' ' + self.get_path(paths)
         if cwd is not None:
             self.cwd = cwd
         else:
-            self.cwd = sublime.active_window().folders()[0]
+            self.cwd = (window or sublime.active_window()).folders()[0]
         if log:
-            output.add_command(self.name, self.command)
-            output.add_files(self.paths)
-            output.add_result_section()
+            self.channel = output.channel(self.name, self.command, window, self if background else None)
+            self.channel.add_files(self.paths)
+            self.channel.add_result_section()
         util.debug(self.command)
         util.debug(self.cwd)
-        if self.async:
+        if self.background:
             self.start()
         else:
-            self.run()
+            with stalls.watch('Command', self.command):
+                self.run()
 
     def run(self):
-        """Runs the process"""
-        self.process = Popen(self.command, stdout=PIPE, stderr=PIPE, shell=True, universal_newlines=True, cwd=self.cwd)
-
+        """Runs the process, ending its output even when it fails to start or to complete"""
         try:
-            self.process.stdout.encoding = "UTF8"
-            self.process.stderr.encoding = "UTF8"
-        except:
-            util.debug('Cannot set std encoding')
+            self.execute()
+        except Exception as e:
+            if not self.done:
+                self.abort(e)
+            raise
 
+    def execute(self):
+        """Starts the process and reads its output until it exits"""
+        self.started = time.time()
+        self.process = Popen(
+            self.command,
+            stdin=DEVNULL if self.input_text is None else PIPE,
+            stdout=PIPE,
+            stderr=PIPE,
+            shell=True,
+            cwd=self.cwd,
+            env=get_env(self.cmd),
+            **group_options()
+        )
         Process.active_processes.append(self)
-        for line in self.process.stdout:
-            self.lines.append(line)
-            if self.log:
-                output.add_result_message(line.strip('\r\n'))
-        self.output_text = "\n".join(self.lines)
-        self.error_text = self.process.stderr.read()
-        self.process.communicate()
+        timeout = get_timeout(self.cmd)
+        if timeout > 0:
+            self.watchdog = Timer(timeout, self.on_timeout)
+            self.watchdog.daemon = True
+            self.watchdog.start()
+        if self.input_text is not None:
+            Thread(target=self.write_input).start()
+        error_reader = Thread(target=self.read_error)
+        error_reader.start()
+        decoder = codecs.getincrementaldecoder(ENCODING)('replace')
+        stream = output.ProgressStream(self.add_line, self.add_progress if self.log else None)
+        while True:
+            chunk = self.process.stdout.read1(CHUNK_SIZE)
+            if not chunk:
+                break
+            stream.feed(decoder.decode(chunk))
+        stream.feed(decoder.decode(b'', True))
+        stream.close()
+        self.output_text = "".join(self.lines)
+        error_reader.join()
+        self.process.wait()
         self.complete()
 
+    def write_input(self):
+        """Writes the input text to the process and closes its input"""
+        try:
+            self.process.stdin.write(self.input_text.encode(ENCODING))
+            self.process.stdin.close()
+        except (OSError, ValueError):
+            util.debug('Could not write the input of ' + self.command)
+
+    def read_error(self):
+        """Reads the error stream, keeping only the final state of progress lines"""
+        self.error_text = output.collapse_progress(self.process.stderr.read().decode(ENCODING, 'replace'))
+
+    def add_line(self, line):
+        """Handles a complete line of output"""
+        self.lines.append(line + '\n')
+        if self.log:
+            self.channel.add_result_message(line)
+        if self.on_line is not None:
+            self.on_line(line + '\n')
+
+    def add_progress(self, line):
+        """Handles an update to a progress line of output"""
+        self.channel.add_result_progress(line)
+
     def get_path(self, paths):
         """Gets path for command arguments"""
         path = None
@@ -83,11 +167,32 @@ class Process(Thread):
         util.debug(self.command + " DONE")
         self.done = True
         self.returncode = self.process.returncode
+        if self.watchdog is not None:
+            self.watchdog.cancel()
+        if self in Process.active_processes:
+            Process.active_processes.remove(self)
+        if self.started is not None:
+            recorder.record(self, self.started)
+        if self.log:
+            self.channel.add_error(self.error(), self.process.returncode)
+            self.channel.end()
+        if self.on_complete is not None:
+            self.on_complete(self)
+
+    def abort(self, error):
+        """Completes a process that raised an error before it completed, with a return code of -1 like a job that could not start"""
+        util.debug(self.command + " FAILED")
+        self.done = True
+        self.returncode = -1
+        self.output_text = "".join(self.lines)
+        self.error_text = str(error)
+        if self.watchdog is not None:
+            self.watchdog.cancel()
         if self in Process.active_processes:
             Process.active_processes.remove(self)
         if self.log:
-            output.add_error(self.error(), self.process.returncode)
-            output.end_command()
+            self.channel.add_error(self.error_text, self.returncode)
+            self.channel.end()
         if self.on_complete is not None:
             self.on_complete(self)
 
@@ -114,14 +219,100 @@ class Process(Thread):
         """Get error text from the process"""
         return self.error_text
 
+    def on_timeout(self):
+        """Kills a process that has run for longer than its timeout"""
+        if self.done:
+            return
+        self.timed_out = True
+        util.debug(self.command + " TIMED OUT")
+        stats.record('Timeouts', command_class(self.cmd), get_timeout(self.cmd))
+        if self.log:
+            self.channel.add_result_message('Timed out after %d seconds' % get_timeout(self.cmd))
+        self.terminate()
+
+    def kill(self, sig=signal.SIGTERM):
+        """Kills the process and every process it started
+
+        The whole group is signalled even when the shell has exited, because
+        the commands it started can outlive it.
+        """
+        if self.process is None:
+            return
+        try:
+            kill_group(self.process.pid, sig)
+        except ProcessLookupError:
+            return
+        except OSError:
+            util.debug('Could not kill process group of ' + self.command)
+            if self.process.poll() is None:
+                self.process.kill()
+
     def terminate(self):
-        """Terminates the process"""
-        if not self.done:
-            self.process.terminate()
-        self.complete()
+        """Terminates the process, which completes once its output has been read"""
+        if self.done:
+            return
+        self.kill()
+        if os.name != 'nt':
+            grace = Timer(KILL_GRACE, self.kill, [signal.SIGKILL])
+            grace.daemon = True
+            grace.start()
+
+
+def resolve_executable(cmd):
+    """Replaces git and arc with the executables set in the gitPath and arcPath settings"""
+    for name, setting in EXECUTABLES:
+        path = settings.get(setting)
+        if path and (cmd == name or cmd.startswith(name + ' ')):
+            return '"' + path + '"' + cmd[len(name):]
+    return cmd
+
+
+def command_class(cmd):
+    """Gets the class of a command that decides its timeout"""
+    if re.match(NETWORK_COMMAND, cmd):
+        return 'network'
+    if re.match(QUERY_COMMAND, cmd):
+        return 'query'
+    return 'local'
+
+
+def get_timeout(cmd):
+    """Gets the timeout in seconds of a command, 0 for no timeout"""
+    timeouts = dict(DEFAULT_TIMEOUTS)
+    timeouts.update(settings.get('commandTimeouts', {}))
+    return timeouts.get(command_class(cmd), 0)
+
+
+def get_env(cmd):
+    """Gets the environment for a command, without terminal prompts and with shared ssh connections when enabled"""
+    env = dict(os.environ)
+    if settings.get('nonInteractive', True):
+        env.update(NON_INTERACTIVE_ENV)
+    if command_class(cmd) == 'network':
+        ssh.update_env(env)
+    return env
+
+
+def group_options():
+    """Gets the Popen options that start a process in its own process group
+
+    On POSIX the new session also has no controlling terminal, so ssh cannot
+    open /dev/tty to ask for passwords or host keys and fails instead.
+    """
+    if os.name == 'nt':
+        return {'creationflags': subprocess.CREATE_NEW_PROCESS_GROUP}
+    return {'start_new_session': True}
+
+
+def kill_group(pid, sig=signal.SIGTERM):
+    """Kills a process started with group_options and every process it started"""
+    if os.name == 'nt':
+        subprocess.call(['taskkill', '/F', '/T', '/PID', str(pid)], stdout=DEVNULL, stderr=DEVNULL)
+    else:
+        os.killpg(pid, sig)
 
 
 def terminate_all():
     """Terminates all active processes"""
-    for proc in Process.active_processes:
+    for proc in list(Process.active_processes):
         proc.terminate()
@@ -1,9 +1,18 @@
 import sublime
 import os
 import re
+import time
 from . import settings
 
 URL_TEST = r"(http|https|git)?:\/\/.*"
+RELATIVE_UNITS = [
+    ('years', 365 * 24 * 60 * 60),
+    ('months', 30 * 24 * 60 * 60),
+    ('weeks', 7 * 24 * 60 * 60),
+    ('days', 24 * 60 * 60),
+    ('hours', 60 * 60),
+    ('minutes', 60)
+]
 
 
 def get_files(paths=None, group=-1, index=-1, base=None):
@@ -48,3 +57,52 @@ def is_url(url):
 def escape_quotes(message):
     """Escapes quotes in a message."""
     return message.replace('"', '\\"')
+
+
+def get_root(path=None):
+    """Gets the root folder of the repository that contains a path"""
+    if path is None:
+        folders = sublime.active_window().folders()
+        if len(folders) < 1:
+            return None
+        path = folders[0]
+    path = os.path.abspath(path)
+    if os.path.isfile(path):
+        path = os.path.dirname(path)
+    while True:
+        if os.path.exists(os.path.join(path, '.git')):
+            return path
+        parent = os.path.dirname(path)
+        if parent == path:
+            return None
+        path = parent
+
+
+def cache_dir(*parts):
+    """Gets a folder inside the Arcinator cache, creating it if it does not exist"""
+    path = os.path.join(sublime.cache_path(), 'Arcinator', *parts)
+    if not os.path.exists(path):
+        os.makedirs(path)
+    return path
+
+
+def relative_time(timestamp, now=None):
+    """Formats a timestamp relative to now, like git's relative dates"""
+    if now is None:
+        now = time.time()
+    seconds = int(now - timestamp)
+    for unit, size in RELATIVE_UNITS:
+        if seconds >= size * 2:
+            return '%d %s ago' % (seconds // size, unit)
+    return '%d seconds ago' % max(seconds, 0)
+
+
+def format_size(size):
+    """Formats a number of bytes for display"""
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if abs(size) < 1024 or unit == 'GB':
+            break
+        size = size / 1024.0
+    if unit == 'B':
+        return '%d %s' % (size, unit)
+    return '%.1f %s' % (size, unit)
@@ -0,0 +1,160 @@
+import sublime
+import os
+import re
+import hashlib
+import json
+from collections import OrderedDict
+from threading import Lock
+from . import thread, util, settings, sparse
+
+POOL_FILE = 'pool.json'
+LIST_COMMAND = 'git worktree list --porcelain'
+SAFE_NAME = r'[^A-Za-z0-9._-]+'
+
+
+class WorktreePool(object):
+    """A bounded, least recently used pool of git worktrees for one repository"""
+    pools = {}
+    pools_lock = Lock()
+
+    def __init__(self, root):
+        """Initializes a WorktreePool object"""
+        self.root = root
+        self.lock = Lock()
+        name = hashlib.sha1(root.encode('utf-8')).hexdigest()[:12]
+        base = settings.get('worktreeFolder', None)
+        if base:
+            self.folder = os.path.join(os.path.expanduser(base), name)
+            if not os.path.exists(self.folder):
+                os.makedirs(self.folder)
+        else:
+            self.folder = util.cache_dir('worktrees', name)
+        self.entries = self.load()
+
+    def load(self):
+        """Loads the pool, dropping worktrees that no longer exist"""
+        path = os.path.join(self.folder, POOL_FILE)
+        entries = OrderedDict()
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                for branch, folder in json.load(f):
+                    if os.path.isdir(folder):
+                        entries[branch] = folder
+        return entries
+
+    def save(self):
+        """Saves the order of the pool"""
+        with open(os.path.join(self.folder, POOL_FILE), 'w') as f:
+            json.dump(list(self.entries.items()), f)
+
+    def git(self, cmd, log=False, cwd=None):
+        """Runs a git command for the repository"""
+        return thread.Process('Worktree', cmd, None, log, False, cwd=cwd or self.root)
+
+    def checked_out(self):
+        """Gets the worktrees of the repository by branch"""
+        p = self.git(LIST_COMMAND)
+        worktrees = {}
+        folder = None
+        for line in p.output().split('\n'):
+            if line.startswith('worktree '):
+                folder = line[len('worktree '):]
+            elif line.startswith('branch refs/heads/') and folder is not None:
+                worktrees[line[len('branch refs/heads/'):]] = os.path.normpath(folder)
+        return worktrees
+
+    def acquire(self, branch, keep=(), capacity=None):
+        """Gets a folder with the branch checked out, adding a worktree to the pool if needed
+
+        Adding a worktree evicts others to stay within capacity, which defaults
+        to the pool size, but never the folders in keep or open in a window.
+        """
+        with self.lock:
+            if branch in self.entries and not os.path.isdir(self.entries[branch]):
+                del self.entries[branch]
+            if branch in self.entries:
+                self.entries.move_to_end(branch)
+                self.save()
+                return self.entries[branch]
+            existing = self.checked_out().get(branch)
+            if existing is not None:
+                return existing
+            self.evict((size() if capacity is None else capacity) - 1, set(keep) | open_folders())
+            folder = os.path.join(self.folder, folder_name(branch))
+            if not self.add(folder, branch):
+                return None
+            self.entries[branch] = folder
+            self.save()
+            return folder
+
+    def add(self, folder, branch):
+        """Adds a worktree, checking out only the sparse-checkout cone of the repository if it has one"""
+        checkout = sparse.get(self.root)
+        if not checkout.is_cone():
+            return self.git('git worktree add "%s" "%s"' % (folder, branch), True).returncode == 0
+        if self.git('git worktree add --no-checkout "%s" "%s"' % (folder, branch), True).returncode != 0:
+            return False
+        if (
+            self.git(sparse.set_command(checkout.get()), True, folder).returncode != 0
+            or self.git('git checkout "%s"' % branch, True, folder).returncode != 0
+        ):
+            util.debug('removing worktree %s, its sparse checkout failed' % folder)
+            self.git('git worktree remove --force "%s"' % folder, True)
+            return False
+        return True
+
+    def evict(self, count, keep=()):
+        """Removes the least recently used worktrees that are not dirty and not in keep until only count remain"""
+        keep = set(os.path.normpath(folder) for folder in keep)
+        for branch in list(self.entries.keys()):
+            if len(self.entries) <= max(count, 0):
+                break
+            folder = self.entries[branch]
+            if os.path.normpath(folder) in keep:
+                continue
+            p = self.git('git worktree remove "%s"' % folder, True)
+            if p.returncode != 0:
+                util.debug('keeping worktree %s, it could not be removed' % folder)
+                continue
+            del self.entries[branch]
+        self.git('git worktree prune')
+        self.save()
+
+
+def folder_name(branch):
+    """Gets the folder of a branch in the pool, with a hash so branches like feature/x and feature_x differ"""
+    suffix = hashlib.sha1(branch.encode('utf-8')).hexdigest()[:8]
+    return re.sub(SAFE_NAME, '_', branch) + '-' + suffix
+
+
+def open_folders():
+    """Gets the folders open in every window, which are never evicted"""
+    return set(os.path.normpath(folder) for window in sublime.windows() for folder in window.folders())
+
+
+def size():
+    """Gets the maximum number of worktrees in each pool, 0 when the pool is disabled"""
+    return int(settings.get('worktreePoolSize', 0) or 0)
+
+
+def enabled():
+    """Checks if branches should be opened in worktrees"""
+    return size() > 0
+
+
+def get(root):
+    """Gets the worktree pool for a repository"""
+    if root is None:
+        return None
+    with WorktreePool.pools_lock:
+        if root not in WorktreePool.pools:
+            WorktreePool.pools[root] = WorktreePool(root)
+        return WorktreePool.pools[root]
+
+
+def checkout(root, branch, keep=(), capacity=None):
+    """Gets a folder with the branch checked out, the main working copy if it already is"""
+    pool = get(root)
+    if pool is None:
+        return None
+    return pool.acquire(branch, keep, capacity)
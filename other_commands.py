@@ -1,6 +1,8 @@
 import sublime
 import sublime_plugin
-from .lib import thread
+from .lib import startup, thread, output, stats, stalls
+
+runner = startup.lazy('runner')
 
 
 class ArcinatorKillProcessesCommand(sublime_plugin.WindowCommand):
@@ -8,4 +10,32 @@ class ArcinatorKillProcessesCommand(sublime_plugin.WindowCommand):
 
     def run(self):
         """Runs the command"""
-        thread.terminate_all()
\ No newline at end of file
+        thread.terminate_all()
+        if startup.is_loaded(runner):
+            runner.terminate_all()
+
+
+class ArcinatorStatsCommand(sublime_plugin.WindowCommand):
+    """A command that shows the recorded timings and status of Arcinator"""
+
+    def run(self):
+        """Runs the command"""
+        output.add_command('Stats', window=self.window)
+        output.add_result(stats.report())
+        output.end_command()
+
+
+class ArcinatorStallsCommand(sublime_plugin.WindowCommand):
+    """A command that shows the commands and callbacks that blocked the main thread in debug mode"""
+
+    def run(self, clear=False):
+        """Runs the command"""
+        if clear:
+            stalls.clear()
+            sublime.status_message('Stalls cleared')
+            return
+        output.add_command('Stalls', window=self.window)
+        if not stalls.enabled():
+            output.add_result_message('Stalls are only recorded when debug is true')
+        output.add_result(stalls.report())
+        output.end_command()
@@ -1,22 +1,28 @@
 import sublime
 import sublime_plugin
-import os
-import re
-from .lib import output
+from .lib import startup, thread, output
 
-UNIX_PATH = r"/[^\n'\"]*"
-NT_PATH = r"[A-Za-z]:\\[^\n'\"]*"
+history = startup.lazy('history')
+LOG_FULL = 'git show --name-only'
 
 
 class ArcinatorViewMessageCommand(sublime_plugin.TextCommand):
     """A command that adds a message to the end of a view"""
 
-    def run(self, edit, message=""):
-        """Runs the command"""
+    def run(self, edit, message="", progress=False):
+        """Runs the command, replacing the last progress message"""
         self.view.set_read_only(False)
-        self.view.insert(edit, self.view.size(), message + '\n')
+        for region in self.view.get_regions(output.PROGRESS_KEY):
+            self.view.erase(edit, region)
+        start = self.view.size()
+        self.view.insert(edit, start, message + '\n')
+        if progress:
+            self.view.add_regions(output.PROGRESS_KEY, [sublime.Region(start, self.view.size())], '', '', sublime.HIDDEN)
+        else:
+            self.view.erase_regions(output.PROGRESS_KEY)
+            output.highlight_conflicts(self.view, start, self.view.size())
+            output.index_paths(self.view, start, self.view.size())
         self.view.set_read_only(True)
-        # output.highlight_conflicts()
 
 
 class ArcinatorViewClearCommand(sublime_plugin.TextCommand):
@@ -27,10 +33,12 @@ class ArcinatorViewClearCommand(sublime_plugin.TextCommand):
         self.view.set_read_only(False)
         self.view.erase(edit, sublime.Region(0, self.view.size()))
         self.view.set_read_only(True)
+        output.clear_highlights(self.view)
+        output.clear_paths(self.view)
 
     def is_visible(self, edit=None):
         """Checks if the view should be visible"""
-        return output.OutputView.get_existing() == self.view
+        return output.OutputView.is_output(self.view)
 
 
 class ArcinatorOutputClearCommand(sublime_plugin.WindowCommand):
@@ -38,50 +46,73 @@ class ArcinatorOutputClearCommand(sublime_plugin.WindowCommand):
 
     def run(self, group=-1, index=-1):
         """Runs the command"""
-        output.clear()
+        output.clear(self.window)
 
     def is_visible(self, group=-1, index=-1):
         """Checks if the view should be visible"""
         if group >= 0 and index >= 0:
             view = sublime.active_window().views_in_group(group)[index]
-            return output.OutputView.get_existing() == view
+            return output.OutputView.is_output(view)
         return True
 
 
 class ArcinatorOutputOpenFileCommand(sublime_plugin.TextCommand):
-    """A command that clears all content from a view"""
+    """A command that opens the files on the selected lines of the output"""
+
+    def run(self, edit):
+        """Runs the command"""
+        win = self.view.window() or sublime.active_window()
+        for path in output.selected_files(self.view):
+            win.open_file(path)
+
+    def is_visible(self, edit=None):
+        """Checks if the view should be visible"""
+        if not output.OutputView.is_output(self.view):
+            return False
+        return len(output.selected_files(self.view)) > 0
 
-    def line_to_file(self, line):
-        """Checks if there is a valid path in the line"""
-        if os.name == 'nt':
-            match = re.search(NT_PATH, line)
-        else:
-            match = re.search(UNIX_PATH, line)
-        if not match:
-            return None
-        path = match.group(0)
-        return path if os.path.exists(path) and os.path.isfile(path) else None
+
+class ArcinatorOutputOpenCommandFilesCommand(sublime_plugin.TextCommand):
+    """A command that opens all of the files in the output of the command under the cursor"""
+
+    def files(self):
+        """Gets the files in the output of the command under the cursor"""
+        if len(self.view.sel()) < 1:
+            return []
+        return output.command_files(self.view, self.view.sel()[0].b)
 
     def run(self, edit):
         """Runs the command"""
-        win = sublime.active_window()
-        regions = self.view.sel()
-        for region in regions:
-            lines = self.view.lines(region)
-            for line in lines:
-                path = self.line_to_file(self.view.substr(line))
-                if path is not None:
-                    win.open_file(path)
+        win = self.view.window() or sublime.active_window()
+        for path in self.files():
+            win.open_file(path)
 
     def is_visible(self, edit=None):
         """Checks if the view should be visible"""
-        if output.OutputView.get_existing() != self.view:
+        if not output.OutputView.is_output(self.view):
             return False
-        regions = self.view.sel()
-        for region in regions:
-            lines = self.view.lines(region)
-            for line in lines:
-                path = self.line_to_file(self.view.substr(line))
-                if path is not None:
-                    return True
-        return False
\ No newline at end of file
+        return len(self.files()) > 0
+
+
+class ArcinatorHistoryEditCommand(sublime_plugin.TextCommand):
+    """A command that replaces part of a history view with a page of commits"""
+
+    def run(self, edit, begin=0, end=0, text=""):
+        """Runs the command"""
+        self.view.set_read_only(False)
+        self.view.replace(edit, sublime.Region(begin, end), text)
+        self.view.set_read_only(True)
+
+
+class ArcinatorHistoryShowCommand(sublime_plugin.TextCommand):
+    """A command that outputs the commits on the selected lines of a history view"""
+
+    def run(self, edit):
+        """Runs the command"""
+        root = self.view.settings().get(history.ROOT_SETTING)
+        for commit in history.selected_commits(self.view):
+            thread.Process('Log revision (%s)' % commit, LOG_FULL + ' ' + commit, None, True, True, cwd=root, window=self.view.window())
+
+    def is_visible(self, edit=None):
+        """Checks if the view should be visible"""
+        return history.is_history(self.view) and len(history.selected_commits(self.view)) > 0
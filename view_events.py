@@ -1,5 +1,19 @@
 import sublime_plugin
-from .lib import output
+import os
+from .lib import startup, output, settings
+
+blame = startup.lazy('blame')
+status = startup.lazy('status')
+sizes = startup.lazy('sizes')
+history = startup.lazy('history')
+
+
+def is_large(path):
+    """Checks the size of a file against largeFileSize with a single stat"""
+    try:
+        return os.path.getsize(path) > settings.get('largeFileSize', 0)
+    except OSError:
+        return False
 
 
 class OutputViewEvents(sublime_plugin.EventListener):
@@ -7,4 +21,54 @@ class OutputViewEvents(sublime_plugin.EventListener):
 
     def on_close(self, view):
         """Stop using the view if it has been closed"""
-        output.OutputView.close(view)
\ No newline at end of file
+        output.OutputView.close(view)
+
+
+class BlameViewEvents(sublime_plugin.EventListener):
+    """Keeps blame annotations in sync with the file on disk"""
+
+    def on_activated(self, view):
+        """Refreshes the blame if the file changed while the view was in the background"""
+        if startup.is_loaded(blame):
+            blame.refresh(view)
+
+    def on_post_save(self, view):
+        """Refreshes the blame when the file is saved"""
+        if startup.is_loaded(blame):
+            blame.refresh(view)
+
+    def on_close(self, view):
+        """Stops annotating a view that has been closed"""
+        if startup.is_loaded(blame):
+            blame.stop(view)
+
+
+class StatusViewEvents(sublime_plugin.EventListener):
+    """Tells the status snapshot about saved files, before its watcher notices them"""
+
+    def on_post_save(self, view):
+        """Records that the file has changed"""
+        if startup.is_loaded(status):
+            status.hint(view.file_name())
+
+
+class LargeFileViewEvents(sublime_plugin.EventListener):
+    """Turns off the gutter diff of large and binary files, which would be recomputed on every change"""
+
+    def on_load_async(self, view):
+        """Disables mini_diff for the file if it is too large to diff, only importing the sizes module for large files"""
+        path = view.file_name()
+        if path is None or not (startup.is_loaded(sizes) or is_large(path)):
+            return
+        if sizes.skips_mini_diff(path):
+            view.settings().set('mini_diff', False)
+
+
+
+class HistoryViewEvents(sublime_plugin.EventListener):
+    """Stops loading commits into history views that have been closed"""
+
+    def on_close(self, view):
+        """Forgets the history of a view that has been closed"""
+        if startup.is_loaded(history):
+            history.close(view)